@@ -0,0 +1,20 @@
+"""
+ASGI config for backend project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+
+The WSGI application is served from a bounded thread pool, while response
+bodies are streamed to clients asynchronously. See ``core.asgi`` for details.
+"""
+
+import os
+
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+
+from core.asgi import ASGIHandler  # NOQA
+
+application = ASGIHandler(get_wsgi_application(),
+                          max_workers=settings.ASGI_THREADS)
@@ -13,23 +13,23 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.contrib import admin
 from django.urls import path, include
 from rest_framework import routers
 
-from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+from core.openapi import get_cached_schema_view
 from core.views import RiskTypeViewSet, RiskViewSet
 
-schema_view = get_schema_view(
-    openapi.Info(
-        title="Risk Management API",
-        default_version='v1',
-        description="API for Britecore Product Development Project",
-    ),
-    public=True,
+api_info = openapi.Info(
+    title="Risk Management API",
+    default_version='v1',
+    description="API for Britecore Product Development Project",
 )
 
+schema_view = get_cached_schema_view(info=api_info, public=True)
+
 router = routers.DefaultRouter()
 router.register("risk_types", RiskTypeViewSet)
 router.register("risks", RiskViewSet)
@@ -37,6 +37,6 @@ router.register("risks", RiskViewSet)
 
 urlpatterns = [
     path('api/', include(router.urls)),
-    path('docs/', schema_view.with_ui('swagger', cache_timeout=0),
-         name='swagger_docs'),
+    path('docs/', schema_view.with_ui('swagger'), name='swagger_docs'),
+    path('admin/', admin.site.urls),
 ]
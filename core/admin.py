@@ -1,3 +1,260 @@
+"""
+Admin of risk types and risks which stays usable with millions of rows.
+
+- Changelists of large tables are counted with an estimate of the query
+  planner on PostgreSQL instead of an exact `COUNT(*)`.
+- Changelists select the related objects they display, the `__str__` of
+  risks and field values would otherwise query them row by row.
+- Foreign keys to large tables use raw id widgets instead of select boxes
+  listing every row.
+
+Risk types and risks are created and deleted through the API, which keeps
+counters, caches and archives in sync. The admin is for browsing them and
+correcting names and values.
+"""
+import json
+
+from django import forms
+from django.conf import settings
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import IntegrityError, connections, transaction
+from django.utils.functional import cached_property
+
+from core import cache, counters
+from core.models import Field, FieldValue, Risk, RiskType
+from core.uniqueness import (duplicate_values_message, find_duplicates,
+                             set_value_hash)
+
+VALUE_COLUMNS = {
+    Field.TEXT_FIELD: 'value_text',
+    Field.NUMBER_FIELD: 'value_number',
+    Field.DATE_FIELD: 'value_date',
+    Field.ENUM_FIELD: 'value_option',
+}
+
+
+def estimate_count(queryset):
+    """
+    Return the number of rows of `queryset` estimated by the PostgreSQL
+    query planner.
+    """
+    sql, params = queryset.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator which uses the estimate of the query planner as the number
+    of objects when it is over `ADMIN_EXACT_COUNT_LIMIT` on PostgreSQL.
+
+    Smaller results and other backends are counted exactly.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if connections[queryset.db].vendor == 'postgresql':
+            estimate = estimate_count(queryset)
+            if estimate > settings.ADMIN_EXACT_COUNT_LIMIT:
+                return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Changelist settings for tables with millions of rows.
+    """
+    paginator = EstimatedCountPaginator
+    # Don't count the unfiltered table next to the filtered results
+    show_full_result_count = False
+
+
+class FieldInline(admin.TabularInline):
+    model = Field
+    fields = ('name', 'description', 'field_type', 'unique')
+    readonly_fields = ('field_type', 'unique')
+    extra = 0
+    can_delete = False
+    show_change_link = True
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(RiskType)
+class RiskTypeAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'tenant', 'risk_count')
+    search_fields = ('name',)
+    fields = ('tenant', 'name', 'description', 'risk_count')
+    readonly_fields = ('tenant', 'risk_count')
+    inlines = (FieldInline,)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        cache.risk_type_edited(form.instance.id, form.instance.tenant)
+
+
+@admin.register(Field)
+class FieldAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'risk_type', 'field_type', 'unique')
+    list_select_related = ('risk_type',)
+    search_fields = ('name',)
+    # Options of large enum fields are searched through the API
+    fields = ('risk_type', 'name', 'description', 'field_type', 'unique')
+    readonly_fields = ('risk_type', 'field_type', 'unique')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        cache.risk_type_edited(obj.risk_type_id, obj.risk_type.tenant)
+
+
+class DuplicateValuesError(Exception):
+    """
+    Values of unique fields taken by a concurrent write after they were
+    validated.
+    """
+
+
+class FieldValueForm(forms.ModelForm):
+    """
+    Form of a value of a risk, validated like values sent to the API.
+    """
+
+    class Meta:
+        model = FieldValue
+        fields = ('value_text', 'value_number', 'value_date', 'value_option')
+
+    def clean(self):
+        data = super().clean()
+        field = self.instance.field
+        column = VALUE_COLUMNS[field.field_type]
+
+        for other in VALUE_COLUMNS.values():
+            if other != column and data.get(other) not in (None, ''):
+                self.add_error(other, "Must be empty for %s fields."
+                               % field.field_type)
+        if data.get(column) in (None, ''):
+            self.add_error(column, "This field is required.")
+        elif column not in self.changed_data:
+            return data
+
+        option = data.get('value_option')
+        if option is not None and field.field_type == Field.ENUM_FIELD and \
+                not field.options.filter(pk=option.pk).exists():
+            self.add_error('value_option',
+                           "Invalid value. Option value does not exist.")
+
+        if field.unique and not self.errors:
+            value = FieldValue(field=field, **{column: data[column]})
+            if find_duplicates([set_value_hash(value)],
+                               self.instance._state.db):
+                self.add_error(column, duplicate_values_message([field]))
+        return data
+
+
+class FieldValueInline(admin.TabularInline):
+    model = FieldValue
+    form = FieldValueForm
+    fields = ('field', 'value_text', 'value_number', 'value_date',
+              'value_option')
+    readonly_fields = ('field',)
+    raw_id_fields = ('value_option',)
+    extra = 0
+    can_delete = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request) \
+            .select_related('field').order_by('field_id')
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Risk)
+class RiskAdmin(LargeTableAdmin):
+    list_display = ('id', 'risk_type', 'tenant', 'created', 'archive')
+    list_select_related = ('risk_type', 'archive')
+    fields = ('risk_type', 'tenant', 'created', 'archive')
+    readonly_fields = fields
+    inlines = (FieldValueInline,)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def changeform_view(self, request, object_id=None, form_url='',
+                        extra_context=None):
+        try:
+            return super().changeform_view(request, object_id, form_url,
+                                           extra_context)
+        except DuplicateValuesError:
+            # Validate the values again, values taken by a concurrent
+            # write are now reported as errors of their forms
+            return super().changeform_view(request, object_id, form_url,
+                                           extra_context)
+
+    def save_formset(self, request, form, formset, change):
+        # Values can only be changed, keep their hashes and the usage
+        # counters of options in sync
+        formset.save(commit=False)
+        values = []
+        try:
+            with transaction.atomic(using=form.instance._state.db):
+                for value_form in formset.forms:
+                    if not value_form.has_changed():
+                        continue
+                    value = set_value_hash(value_form.instance)
+                    values.append(value)
+                    value.save()
+                    counters.value_option_changed(
+                        value_form.initial.get('value_option'),
+                        value.value_option_id)
+        except IntegrityError:
+            # A concurrent write may have taken a unique value since
+            # validation, the unique index rejected this one
+            if not find_duplicates(values, form.instance._state.db):
+                raise
+            raise DuplicateValuesError()
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        cache.risk_type_changed(form.instance.risk_type_id,
+                                form.instance.tenant)
+
+
+@admin.register(FieldValue)
+class FieldValueAdmin(LargeTableAdmin):
+    """
+    Read only list of field values, values are edited with their risk.
+    """
+    list_display = ('id', 'risk_id', 'field', 'value')
+    list_select_related = ('field', 'value_option')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
 
-# Register your models here.
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,248 @@
+"""
+Archival of old risks to compressed files in cold storage.
+
+The field values of archived risks are moved out of the database to a
+gzipped JSON file per batch of risks, stored in the storage configured by
+`ARCHIVE_STORAGE` (a local directory by default, any Django storage class
+such as S3 can be used). The risk rows stay in the database and point to
+their archive, so archived risks keep their ids, tenant and counters.
+
+Archived risks are left out of lists, but are retrieved transparently by
+loading their values from the archive. `restore_risks` moves them back.
+"""
+import gzip
+import json
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import get_storage_class
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q, prefetch_related_objects
+from django.utils.dateparse import parse_date
+
+from core.bulk import bulk_insert
+from core.cache import LocalLRUCache
+from core.models import Field, FieldValue, Risk, RiskArchive, RiskType
+from core.uniqueness import get_value_hash
+
+ARCHIVE_VERSION = 1
+
+# Decoded archives, archive files never change once written
+_archives = LocalLRUCache(settings.ARCHIVE_CACHE_SIZE)
+
+
+def get_archive_storage():
+    storage_class = get_storage_class(settings.ARCHIVE_STORAGE)
+    return storage_class(**settings.ARCHIVE_STORAGE_OPTIONS)
+
+
+def encode_archive(risk_type, values):
+    """
+    Encode the field value rows of archived risks of `risk_type`, given as
+    a dict of rows by risk id.
+    """
+    content = json.dumps({
+        'version': ARCHIVE_VERSION,
+        'risk_type': risk_type.id,
+        'risks': values,
+    }, cls=DjangoJSONEncoder, separators=(',', ':'))
+    return gzip.compress(content.encode('utf-8'))
+
+
+def read_archive(archive):
+    """
+    Return the field value rows of the risks in `archive` by risk id.
+    """
+    risks = _archives.get(archive.name)
+    if risks is None:
+        with get_archive_storage().open(archive.name, 'rb') as archive_file:
+            content = json.loads(gzip.decompress(archive_file.read())
+                                 .decode('utf-8'))
+        risks = {int(risk_id): rows
+                 for risk_id, rows in content['risks'].items()}
+        _archives.set(archive.name, risks)
+    return risks
+
+
+def archived_usage_counts(using='default'):
+    """
+    Return the number of archived values selecting each option, by option
+    id.
+    """
+    counts = Counter()
+    archives = RiskArchive.objects.using(using).order_by('id')
+    for archive in archives.iterator():
+        rows = read_archive(archive)
+        # Restored and deleted risks are still in the archive file
+        for risk_id in archive.risks.values_list('id', flat=True):
+            counts.update(row[5] for row in rows.get(risk_id, [])
+                          if row[5] is not None)
+    return counts
+
+
+def archive_batch(risk_type, risks, batch_size, using):
+    """
+    Archive up to `batch_size` of `risks` of `risk_type`.
+
+    Returns the new `RiskArchive` or None if there was nothing to archive.
+    """
+    storage = get_archive_storage()
+    with transaction.atomic(using=using):
+        risk_ids = list(risks.filter(risk_type=risk_type, archive=None)
+                        .select_for_update().order_by('id')
+                        .values_list('id', flat=True)[:batch_size])
+        if not risk_ids:
+            return None
+
+        values = {risk_id: [] for risk_id in risk_ids}
+        rows = FieldValue.objects.using(using).filter(
+            risk_id__in=risk_ids,
+        ).order_by('risk_id', 'field_id').values_list(
+            'risk_id', 'id', 'field_id', 'value_text', 'value_number',
+            'value_date', 'value_option_id')
+        for row in rows.iterator():
+            values[row[0]].append(row[1:])
+
+        name = storage.save(
+            'risks/%s/%d/%s.json.gz' % (risk_type.tenant or 'default',
+                                        risk_type.id, uuid.uuid4().hex),
+            ContentFile(encode_archive(risk_type, values)))
+        try:
+            archive = RiskArchive.objects.using(using).create(
+                tenant=risk_type.tenant, risk_type=risk_type, name=name,
+                risk_count=len(risk_ids))
+            Risk.objects.using(using).filter(pk__in=risk_ids).update(
+                archive=archive)
+            FieldValue.objects.using(using).filter(
+                risk_id__in=risk_ids).delete()
+        except Exception:
+            storage.delete(name)
+            raise
+    return archive
+
+
+def archive_risks(created_before, risk_type_ids=None, batch_size=1000,
+                  using='default'):
+    """
+    Archive risks created before `created_before`, optionally only those
+    of `risk_type_ids`, in batches of `batch_size` risks. Risks without a
+    creation time predate creation times being recorded and are archived
+    too.
+
+    Returns the list of new archives.
+    """
+    risks = Risk.objects.using(using).filter(
+        Q(created__lt=created_before) | Q(created=None))
+    risk_types = RiskType.objects.using(using).filter(
+        id__in=risks.filter(archive=None).values('risk_type'))
+    if risk_type_ids:
+        risk_types = risk_types.filter(id__in=risk_type_ids)
+
+    archives = []
+    for risk_type in risk_types.order_by('id'):
+        while True:
+            archive = archive_batch(risk_type, risks, batch_size, using)
+            if archive is None:
+                break
+            archives.append(archive)
+    return archives
+
+
+def build_values(risk, rows):
+    """
+    Build unsaved `FieldValue` instances of `risk` from archived rows.
+    """
+    fields = {field.id: field for field in Field.objects.using(
+        risk._state.db).filter(risk_type=risk.risk_type_id)}
+    prefetch_related_objects(list(fields.values()), 'options')
+    options = {option.id: option for field in fields.values()
+               for option in field.options.all()}
+
+    return [
+        FieldValue(id=value_id, risk=risk, field=fields[field_id],
+                   value_text=text, value_number=number,
+                   value_date=parse_date(date) if date else None,
+                   value_option=options.get(option_id))
+        for (value_id, field_id, text, number, date, option_id) in rows
+    ]
+
+
+def load_archived_values(risk):
+    """
+    Load the field values of an archived `risk` from its archive, so that
+    `risk.field_values.all()` returns them without a query.
+    """
+    rows = read_archive(risk.archive).get(risk.id, [])
+    risk._prefetched_objects_cache = {
+        'field_values': build_values(risk, rows),
+    }
+
+
+def restore_risks(risks, using='default'):
+    """
+    Move the field values of the archived risks among `risks` back to the
+    database. Archives left without risks are deleted.
+
+    Returns the number of restored risks.
+    """
+    storage = get_archive_storage()
+    restored = 0
+    archives = RiskArchive.objects.using(using).filter(
+        id__in=risks.exclude(archive=None).values('archive'))
+    for archive in archives.order_by('id'):
+        with transaction.atomic(using=using):
+            risk_ids = list(risks.filter(archive=archive)
+                            .select_for_update().values_list('id', flat=True))
+            rows = read_archive(archive)
+            # Archived values don't hold on to unique values, restoring a
+            # value taken in the meantime fails on the unique index
+            unique_fields = dict(Field.objects.using(using).filter(
+                risk_type=archive.risk_type_id, unique=True,
+            ).values_list('id', 'field_type'))
+            values = []
+            for risk_id in risk_ids:
+                for (value_id, field_id, text, number, date,
+                     option_id) in rows.get(risk_id, []):
+                    value = FieldValue(
+                        id=value_id, risk_id=risk_id, field_id=field_id,
+                        value_text=text, value_number=number,
+                        value_date=parse_date(date) if date else None,
+                        value_option_id=option_id)
+                    if field_id in unique_fields:
+                        value.value_hash = get_value_hash(
+                            unique_fields[field_id],
+                            {Field.TEXT_FIELD: text,
+                             Field.NUMBER_FIELD: number,
+                             Field.DATE_FIELD: date,
+                             Field.ENUM_FIELD: option_id,
+                             }[unique_fields[field_id]])
+                    values.append(value)
+            bulk_insert(values, using)
+            Risk.objects.using(using).filter(pk__in=risk_ids).update(
+                archive=None)
+
+            if not archive.risks.exists():
+                archive.delete()
+                transaction.on_commit(
+                    lambda name=archive.name: storage.delete(name),
+                    using=using)
+        restored += len(risk_ids)
+    return restored
+
+
+def risk_type_deleted(risk_type):
+    """
+    Delete the archive files of a `risk_type` which is about to be deleted
+    once the deletion is committed.
+    """
+    storage = get_archive_storage()
+    using = risk_type._state.db
+    names = list(risk_type.archives.values_list('name', flat=True))
+    # Archives are protected from deletion while risks refer to them
+    risk_type.risks.exclude(archive=None).update(archive=None)
+    for name in names:
+        transaction.on_commit(lambda name=name: storage.delete(name),
+                              using=using)
@@ -0,0 +1,167 @@
+"""
+ASGI adapter for the Django WSGI application.
+
+Django 2.1 has no native ASGI support, so requests are handed to the regular
+WSGI application running in a bounded thread pool. Unlike a plain
+WSGI-to-ASGI bridge, the response body is pulled from the application one
+chunk at a time: between chunks no thread is held while the event loop
+waits for a slow client to accept data. Combined with streaming responses
+(see `core.streaming`) this lets a single process serve many slow clients
+with only a handful of worker threads and database connections.
+"""
+import asyncio
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+_END = object()
+
+
+def _next_chunk(iterator):
+    return next(iterator, _END)
+
+
+async def iterate_in_executor(iterable, executor, loop=None):
+    """
+    Asynchronously iterate over a blocking iterable, producing every item
+    in `executor`.
+    """
+    loop = loop or asyncio.get_event_loop()
+    iterator = await loop.run_in_executor(executor, iter, iterable)
+    while True:
+        item = await loop.run_in_executor(executor, _next_chunk, iterator)
+        if item is _END:
+            break
+        yield item
+
+
+def build_environ(scope, body):
+    """
+    Build a WSGI environ dict from an ASGI HTTP connection scope.
+    """
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8')
+                                                 .decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+        environ['REMOTE_PORT'] = str(scope['client'][1])
+
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            key = 'CONTENT_TYPE'
+        elif name == 'CONTENT_LENGTH':
+            key = 'CONTENT_LENGTH'
+        else:
+            key = 'HTTP_%s' % name
+        if key in environ:
+            value = '%s,%s' % (environ[key], value)
+        environ[key] = value
+
+    # The request body has been fully read (including chunked uploads)
+    environ['CONTENT_LENGTH'] = str(len(body))
+    return environ
+
+
+class ASGIHandler:
+    """
+    ASGI 3 application serving a WSGI application from a bounded pool of
+    `max_workers` threads.
+    """
+
+    def __init__(self, wsgi_application, max_workers=8):
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        else:
+            raise ValueError(
+                "Unsupported ASGI connection type '%s'" % scope['type'])
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def read_body(self, receive):
+        body = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            body.append(message.get('body', b''))
+            if not message.get('more_body', False):
+                return b''.join(body)
+
+    def start_application(self, environ):
+        """
+        Call the WSGI application and return its status, headers and
+        response iterable.
+        """
+        response_start = {}
+
+        def start_response(status, headers, exc_info=None):
+            response_start['status'] = int(status.split(' ', 1)[0])
+            response_start['headers'] = [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in headers
+            ]
+
+        result = self.wsgi_application(environ, start_response)
+        return response_start['status'], response_start['headers'], result
+
+    async def http(self, scope, receive, send):
+        body = await self.read_body(receive)
+        if body is None:
+            return
+
+        loop = asyncio.get_event_loop()
+        environ = build_environ(scope, body)
+        status, headers, result = await loop.run_in_executor(
+            self.executor, self.start_application, environ)
+
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': status,
+                'headers': headers,
+            })
+            async for chunk in iterate_in_executor(result, self.executor,
+                                                   loop):
+                if chunk:
+                    await send({
+                        'type': 'http.response.body',
+                        'body': chunk,
+                        'more_body': True,
+                    })
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            # Closing the response fires Django's `request_finished`
+            # signal which releases the database connection
+            if hasattr(result, 'close'):
+                await loop.run_in_executor(self.executor, result.close)
@@ -0,0 +1,83 @@
+"""
+Bulk inserts of many rows in a constant number of statements.
+"""
+from django.db import connections
+
+from core.models import Field, OptionValue
+
+# PostgreSQL allows at most 65535 parameters per statement
+MAX_QUERY_PARAMS = 65535
+
+
+def bulk_insert(objs, using):
+    """
+    Insert `objs` of the same model in as few statements as the backend
+    allows and return them with their primary keys set.
+    """
+    if not objs:
+        return []
+    model = type(objs[0])
+    connection = connections[using]
+    fields = [field for field in model._meta.concrete_fields
+              if field != model._meta.auto_field]
+    batch_size = min(connection.ops.bulk_batch_size(fields, objs),
+                     MAX_QUERY_PARAMS // len(fields))
+    objs = model.objects.using(using).bulk_create(objs, batch_size=batch_size)
+
+    if (objs[0].pk is None and
+            not connection.features.can_return_ids_from_bulk_insert):
+        # Fetch the primary keys of the rows just inserted. SQLite, the
+        # only supported backend which can't return them, serializes
+        # writing transactions so no other rows are interleaved.
+        pks = list(model.objects.using(using).order_by('-pk')
+                   .values_list('pk', flat=True)[:len(objs)])
+        for obj, pk in zip(objs, reversed(pks)):
+            obj.pk = pk
+    return objs
+
+
+def insert_field_options(fields, values, using):
+    """
+    Create options with the given `values` for each of `fields` and add
+    them to the fields.
+
+    Options and their relations to the fields are inserted with one
+    statement each, without building a model instance per row. On
+    PostgreSQL all values are passed as arrays.
+    """
+    field_ids = []
+    for field, field_values in zip(fields, values):
+        field_ids.extend([field.id] * len(field_values))
+    values = [value for field_values in values for value in field_values]
+    if not values:
+        return
+
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    options_table = qn(OptionValue._meta.db_table)
+    through_table = qn(Field.options.through._meta.db_table)
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # Rows are inserted and returned in the order of the array
+            cursor.execute(
+                'INSERT INTO %s (value, usage_count) '
+                'SELECT unnest(%%s::text[]), 0 RETURNING id' % options_table,
+                [values])
+            option_ids = [row[0] for row in cursor.fetchall()]
+            cursor.execute(
+                'INSERT INTO %s (field_id, optionvalue_id) '
+                'SELECT unnest(%%s::integer[]), unnest(%%s::integer[])'
+                % through_table, [field_ids, option_ids])
+            return
+
+        cursor.executemany(
+            'INSERT INTO %s (value, usage_count) VALUES (%%s, 0)'
+            % options_table, [(value,) for value in values])
+        # See bulk_insert() on fetching the primary keys of inserted rows
+        cursor.execute('SELECT id FROM %s ORDER BY id DESC LIMIT %%s'
+                       % options_table, [len(values)])
+        option_ids = [row[0] for row in reversed(cursor.fetchall())]
+        cursor.executemany(
+            'INSERT INTO %s (field_id, optionvalue_id) VALUES (%%s, %%s)'
+            % through_table, list(zip(field_ids, option_ids)))
@@ -0,0 +1,322 @@
+"""
+Read-through cache of risk and risk type representations.
+
+Representations are cached in two tiers: a small least recently used cache
+in the memory of each process in front of the Django cache backend
+configured by `REPRESENTATION_CACHE`.
+
+Risks and risk types never change after creation, but the counters in their
+representations do. Every entry records the generations it was rendered
+for: one per risk type, bumped when a risk of the type is created or
+deleted, and one for the list of risk types of a tenant. Payload schemas
+show no counters and depend on a third one, the definition of their risk
+type, bumped only when the risk type is edited or deleted. Generations live
+in the backend only, so with a backend shared by all processes (memcached,
+Redis, a database) an entry of any tier is stale as soon as one of its
+generations was bumped by any process.
+
+A local memory backend keeps generations per process, other processes
+would keep serving deleted risks and stale counters until their entries
+expire. Representations aren't cached with such a backend unless
+`REPRESENTATION_CACHE_ALLOW_LOCAL_MEMORY` is set, for deployments running
+a single process.
+
+Only one request renders a missing entry at a time, concurrent requests for
+the same key wait for it to be cached instead of all hitting the database.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from rest_framework.response import Response
+
+from core.tenancy import get_current_tenant, get_tenant_database
+
+# Seconds between checks for an entry rendered by another request
+LOCK_POLL_INTERVAL = 0.05
+
+
+class LocalLRUCache:
+    """
+    Thread-safe in-memory cache holding at most `max_size` entries.
+    """
+
+    def __init__(self, max_size=1000, timeout=None):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires is not None and expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+        expires = None
+        if self.timeout is not None:
+            expires = time.time() + self.timeout
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+local_cache = LocalLRUCache(settings.REPRESENTATION_LOCAL_CACHE_SIZE,
+                            settings.REPRESENTATION_CACHE_TIMEOUT)
+
+
+def get_shared_cache():
+    return caches[settings.REPRESENTATION_CACHE]
+
+
+def is_enabled():
+    """
+    Whether representations are cached, see the module docstring on local
+    memory backends.
+    """
+    return settings.REPRESENTATION_CACHE_ALLOW_LOCAL_MEMORY or \
+        not isinstance(get_shared_cache(), LocMemCache)
+
+
+def make_key(name, tenant=None):
+    if tenant is None:
+        tenant = get_current_tenant()
+    return 'repr:%s:%s' % (tenant, name)
+
+
+def risk_key(risk_id, tenant=None):
+    return make_key('risk:%s' % risk_id, tenant)
+
+
+def risk_type_key(risk_type_id, tenant=None):
+    return make_key('risk_type:%s' % risk_type_id, tenant)
+
+
+def risk_type_schema_key(risk_type_id, tenant=None):
+    return make_key('risk_type_schema:%s' % risk_type_id, tenant)
+
+
+def risk_type_list_key(tenant=None):
+    return make_key('risk_types', tenant)
+
+
+def risk_type_generation(risk_type_id, tenant=None):
+    return make_key('generation:risk_type:%s' % risk_type_id, tenant)
+
+
+def risk_type_definition_generation(risk_type_id, tenant=None):
+    return make_key('generation:risk_type_definition:%s' % risk_type_id,
+                    tenant)
+
+
+def risk_type_list_generation(tenant=None):
+    return make_key('generation:risk_types', tenant)
+
+
+def new_generation():
+    # Generations are never expired, but may be evicted. Starting from the
+    # current time makes sure an evicted generation is not reused.
+    return int(time.time() * 1000)
+
+
+def get_generations(names):
+    """
+    Return the current generation of each of `names` as a tuple.
+    """
+    cache = get_shared_cache()
+    generations = cache.get_many(names)
+    for name in names:
+        if name not in generations:
+            cache.add(name, new_generation(), timeout=None)
+            generations[name] = cache.get(name)
+    return tuple(generations[name] for name in names)
+
+
+def bump_generation(name):
+    cache = get_shared_cache()
+    try:
+        cache.incr(name)
+    except ValueError:
+        cache.set(name, new_generation(), timeout=None)
+
+
+def _get_entry(key):
+    """
+    Return the value of a cached entry unless one of its generations was
+    bumped.
+    """
+    entry = local_cache.get(key)
+    if entry is None:
+        entry = get_shared_cache().get(key)
+        if entry is None:
+            return None
+        local_cache.set(key, entry)
+
+    names, generations, value = entry
+    if get_generations(names) != generations:
+        return None
+    return value
+
+
+def _set_entry(key, names, generations, value):
+    entry = (names, generations, value)
+    get_shared_cache().set(key, entry, settings.REPRESENTATION_CACHE_TIMEOUT)
+    local_cache.set(key, entry)
+
+
+def read_through(key, load):
+    """
+    Return the cached value of `key`, rendering it on a miss.
+
+    `load` is called on a miss and returns the names of the generations the
+    value depends on along with a function rendering the value. Generations
+    are read before rendering so that a value rendered concurrently with a
+    write is never cached for the generation bumped by that write.
+    """
+    if not is_enabled():
+        return load()[1]()
+
+    value = _get_entry(key)
+    if value is not None:
+        return value
+
+    cache = get_shared_cache()
+    lock_key = key + ':lock'
+    timeout = settings.REPRESENTATION_CACHE_LOCK_TIMEOUT
+    locked = cache.add(lock_key, True, timeout)
+    if not locked:
+        # Wait for the request holding the lock to cache the value
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            value = _get_entry(key)
+            if value is not None:
+                return value
+            if cache.get(lock_key) is None:
+                # Released without caching a value, e.g. on a 404
+                break
+
+    try:
+        names, render = load()
+        generations = get_generations(names)
+        value = render()
+        _set_entry(key, names, generations, value)
+        return value
+    finally:
+        if locked:
+            cache.delete(lock_key)
+
+
+def _invalidate(keys, generations):
+    cache = get_shared_cache()
+    for key in keys:
+        local_cache.delete(key)
+    cache.delete_many(keys)
+    for name in generations:
+        bump_generation(name)
+
+
+def _on_commit(keys, generations):
+    # Invalidate right away so that the writing request itself does not
+    # read stale entries, and again on commit to drop entries rendered by
+    # concurrent requests from the data before the write.
+    _invalidate(keys, generations)
+    transaction.on_commit(lambda: _invalidate(keys, generations),
+                          using=get_tenant_database())
+
+
+def risk_type_changed(risk_type_id, tenant=None):
+    """
+    Invalidate representations showing the risks or counters of a risk
+    type.
+    """
+    _on_commit([], [risk_type_generation(risk_type_id, tenant),
+                    risk_type_list_generation(tenant)])
+
+
+def risk_type_edited(risk_type_id, tenant=None):
+    """
+    Invalidate representations of a risk type whose names or descriptions
+    were edited, its payload schema included.
+    """
+    _on_commit([risk_type_schema_key(risk_type_id, tenant)],
+               [risk_type_generation(risk_type_id, tenant),
+                risk_type_definition_generation(risk_type_id, tenant),
+                risk_type_list_generation(tenant)])
+
+
+def risk_deleted(risk):
+    _on_commit([risk_key(risk.id, risk.tenant)],
+               [risk_type_generation(risk.risk_type_id, risk.tenant),
+                risk_type_list_generation(risk.tenant)])
+
+
+def risk_type_deleted(risk_type):
+    _on_commit([risk_type_key(risk_type.id, risk_type.tenant),
+                risk_type_schema_key(risk_type.id, risk_type.tenant)],
+               [risk_type_generation(risk_type.id, risk_type.tenant),
+                risk_type_definition_generation(risk_type.id,
+                                                risk_type.tenant),
+                risk_type_list_generation(risk_type.tenant)])
+
+
+def clear():
+    """
+    Clear both tiers of the cache.
+    """
+    local_cache.clear()
+    get_shared_cache().clear()
+
+
+class CachedRetrieveMixin:
+    """
+    Serve the retrieve action of a viewset from the representation cache.
+
+    `cache_key` returns the key of an object given its primary key,
+    `cache_generations` the generations the representation of an instance
+    depends on.
+    """
+
+    def cache_key(self, pk):
+        raise NotImplementedError
+
+    def cache_generations(self, instance):
+        raise NotImplementedError
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        if not pk.isdigit():
+            return super().retrieve(request, *args, **kwargs)
+
+        def load():
+            instance = self.get_object()
+            return (self.cache_generations(instance),
+                    lambda: dict(self.get_serializer(instance).data))
+
+        return Response(read_through(self.cache_key(int(pk)), load))
@@ -0,0 +1,112 @@
+"""
+Counter caches of risks per risk type and field values per enum option.
+
+Counters are updated with relative `UPDATE`s in the same transaction as the
+write which changes them. `reconcile_counters` recomputes them from the
+actual rows, and the archived values of archived risks, to fix any drift.
+"""
+from collections import defaultdict
+
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from core.archive import archived_usage_counts
+from core.models import FieldValue, OptionValue, Risk, RiskType
+
+
+def risk_created(risk, option_ids):
+    """
+    Update counters for a new `risk` whose values selected `option_ids`.
+    """
+    RiskType.objects.filter(pk=risk.risk_type_id).update(
+        risk_count=F('risk_count') + 1)
+    if option_ids:
+        OptionValue.objects.filter(pk__in=option_ids).update(
+            usage_count=F('usage_count') + 1)
+
+
+def risk_deleted(risk):
+    """
+    Update counters for a `risk` which is about to be deleted.
+    """
+    # The values of archived risks are loaded from their archive
+    option_ids = [value.value_option_id for value in risk.field_values.all()
+                  if value.value_option_id is not None]
+    RiskType.objects.filter(pk=risk.risk_type_id, risk_count__gt=0).update(
+        risk_count=F('risk_count') - 1)
+    if option_ids:
+        OptionValue.objects.filter(pk__in=option_ids, usage_count__gt=0) \
+            .update(usage_count=F('usage_count') - 1)
+
+
+def value_option_changed(old_option_id, new_option_id):
+    """
+    Update counters for a value whose option changed from `old_option_id`
+    to `new_option_id`, either can be None.
+    """
+    if old_option_id == new_option_id:
+        return
+    if old_option_id is not None:
+        OptionValue.objects.filter(pk=old_option_id, usage_count__gt=0) \
+            .update(usage_count=F('usage_count') - 1)
+    if new_option_id is not None:
+        OptionValue.objects.filter(pk=new_option_id).update(
+            usage_count=F('usage_count') + 1)
+
+
+def risk_type_deleted(risk_type):
+    """
+    Update counters for a `risk_type` which is about to be deleted along
+    with all of its risks.
+    """
+    OptionValue.objects.filter(field__risk_type=risk_type).update(
+        usage_count=0)
+
+
+def actual_risk_count():
+    risks = Risk.objects.filter(risk_type=OuterRef('pk')).order_by() \
+        .values('risk_type').annotate(count=Count('pk')).values('count')
+    return Coalesce(Subquery(risks, output_field=IntegerField()), 0)
+
+
+def actual_usage_count():
+    values = FieldValue.objects.filter(value_option=OuterRef('pk')) \
+        .order_by().values('value_option') \
+        .annotate(count=Count('pk')).values('count')
+    return Coalesce(Subquery(values, output_field=IntegerField()), 0)
+
+
+def reconcile_counters(using='default', dry_run=False):
+    """
+    Find counters which drifted from the actual number of rows and fix
+    them unless `dry_run` is set.
+
+    Returns the ids of drifted risk types and options.
+    """
+    risk_types = RiskType.objects.using(using)
+    risk_type_ids = list(risk_types.annotate(actual=actual_risk_count())
+                         .exclude(risk_count=F('actual'))
+                         .values_list('pk', flat=True))
+    if risk_type_ids and not dry_run:
+        risk_types.filter(pk__in=risk_type_ids).update(
+            risk_count=actual_risk_count())
+
+    # Values of archived risks are no longer rows, options are expected to
+    # count them on top of the live values
+    archived = archived_usage_counts(using)
+    options = OptionValue.objects.using(using).annotate(
+        actual=actual_usage_count())
+    drifted = {pk: 0 for pk in options.exclude(pk__in=list(archived))
+               .exclude(usage_count=F('actual')).values_list('pk', flat=True)}
+    for pk, usage_count, actual in options.filter(
+            pk__in=list(archived)).values_list('pk', 'usage_count', 'actual'):
+        if usage_count != actual + archived[pk]:
+            drifted[pk] = archived[pk]
+    if drifted and not dry_run:
+        by_archived_count = defaultdict(list)
+        for pk, count in drifted.items():
+            by_archived_count[count].append(pk)
+        for count, ids in by_archived_count.items():
+            OptionValue.objects.using(using).filter(pk__in=ids).update(
+                usage_count=actual_usage_count() + count)
+    return risk_type_ids, sorted(drifted)
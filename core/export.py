@@ -0,0 +1,273 @@
+"""
+Parallel export of all risks to compressed files for offline processing.
+
+The risks of every risk type are split into shards of primary key ranges
+which are exported by a pool of worker processes. Every worker has its own
+database connection and streams the risks and values of its shard with a
+server-side cursor (on PostgreSQL), so shards are exported in parallel and
+in constant memory.
+
+Every shard is written to a gzipped CSV or NDJSON file with one row per
+risk and one column per field, enum values are written as the value of
+their option. Values of archived risks are read from their archive.
+
+`manifest.json` in the output directory lists the fields of every risk
+type and the file, id range, row count and SHA-256 checksum of every
+shard.
+"""
+import csv
+import gzip
+import hashlib
+import json
+import math
+import os
+from multiprocessing import Pool
+
+import django
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Count, Max, Min
+from django.db.transaction import TransactionManagementError
+from django.utils import timezone
+
+from core.archive import read_archive
+from core.models import (Field, FieldValue, OptionValue, Risk, RiskArchive,
+                         RiskType)
+
+CSV_FORMAT = 'csv'
+NDJSON_FORMAT = 'ndjson'
+EXPORT_FORMATS = (CSV_FORMAT, NDJSON_FORMAT)
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+
+# Rows fetched from the database at a time by each worker
+FETCH_SIZE = 2000
+
+
+def plan_shards(risk_type, shard_size, using):
+    """
+    Split the risks of `risk_type` in ranges of primary keys holding about
+    `shard_size` risks each.
+
+    Returns a list of inclusive `(first_id, last_id)` ranges.
+    """
+    stats = Risk.objects.using(using).filter(risk_type=risk_type) \
+        .aggregate(count=Count('id'), first=Min('id'), last=Max('id'))
+    if not stats['count']:
+        return []
+    span = stats['last'] - stats['first'] + 1
+    shard_count = math.ceil(stats['count'] / shard_size)
+    step = math.ceil(span / shard_count)
+    return [(first, min(first + step - 1, stats['last']))
+            for first in range(stats['first'], stats['last'] + 1, step)]
+
+
+def iter_risk_rows(risk_type_id, fields, first_id, last_id, using):
+    """
+    Generate `(risk_id, created, values)` of the risks of a risk type with
+    an id in `[first_id, last_id]`, in id order. `values` is a dict of
+    values by field id.
+
+    Risks and values are read with one streaming query each and merged.
+    """
+    field_types = {field['id']: field['field_type'] for field in fields}
+    risks = Risk.objects.using(using).filter(
+        risk_type=risk_type_id, id__gte=first_id, id__lte=last_id,
+    ).order_by('id').values_list('id', 'created', 'archive')
+    values = FieldValue.objects.using(using).filter(
+        risk_id__gte=first_id, risk_id__lte=last_id,
+        field_id__in=list(field_types),
+    ).order_by('risk_id', 'field_id').values_list(
+        'risk_id', 'field_id', 'value_text', 'value_number', 'value_date',
+        'value_option__value')
+
+    values = values.iterator(chunk_size=FETCH_SIZE)
+    pending = next(values, None)
+    # Risks are archived in id ranges, only the archive of the current
+    # risk is kept in memory
+    archive_id, archive_rows = None, {}
+    options = None
+
+    for risk_id, created, risk_archive_id in risks.iterator(
+            chunk_size=FETCH_SIZE):
+        row = {}
+        if risk_archive_id is not None:
+            if risk_archive_id != archive_id:
+                archive_id = risk_archive_id
+                archive_rows = read_archive(
+                    RiskArchive.objects.using(using).get(pk=archive_id))
+            if options is None:
+                options = dict(OptionValue.objects.using(using).filter(
+                    field__risk_type=risk_type_id).values_list('id', 'value'))
+            for (_, field_id, text, number, date,
+                 option_id) in archive_rows.get(risk_id, []):
+                row[field_id] = (text, number, date, options.get(option_id))
+        while pending is not None and pending[0] <= risk_id:
+            if pending[0] == risk_id:
+                row[pending[1]] = pending[2:]
+            pending = next(values, None)
+
+        yield risk_id, created, {
+            field_id: column_value(field_types[field_id], columns)
+            for field_id, columns in row.items()
+        }
+
+
+def column_value(field_type, columns):
+    text, number, date, option = columns
+    return {
+        Field.TEXT_FIELD: text,
+        Field.NUMBER_FIELD: number,
+        Field.DATE_FIELD: date,
+        Field.ENUM_FIELD: option,
+    }[field_type]
+
+
+def write_shard(path, export_format, fields, rows):
+    """
+    Write `rows` of `iter_risk_rows` to a gzipped file at `path`.
+
+    Returns the number of rows written.
+    """
+    count = 0
+    with gzip.open(path, 'wt', encoding='utf-8', newline='') as shard_file:
+        if export_format == CSV_FORMAT:
+            writer = csv.writer(shard_file)
+            writer.writerow(['risk_id', 'created'] +
+                            [field['name'] for field in fields])
+            for risk_id, created, values in rows:
+                created = created.isoformat() if created else ''
+                writer.writerow([risk_id, created] + [
+                    values.get(field['id']) for field in fields])
+                count += 1
+        else:
+            for risk_id, created, values in rows:
+                shard_file.write(json.dumps({
+                    'risk_id': risk_id,
+                    'created': created,
+                    'values': {str(field['id']): values.get(field['id'])
+                               for field in fields},
+                }, cls=DjangoJSONEncoder, ensure_ascii=False,
+                    separators=(',', ':')))
+                shard_file.write('\n')
+                count += 1
+    return count
+
+
+def file_checksum(path):
+    checksum = hashlib.sha256()
+    with open(path, 'rb') as shard_file:
+        for block in iter(lambda: shard_file.read(1 << 20), b''):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def export_shard(shard):
+    """
+    Export one shard described by a dict of `plan_export`, in a worker
+    process or the current one.
+
+    Returns the manifest entry of the shard.
+    """
+    path = os.path.join(shard['out'], shard['file'])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    rows = write_shard(path, shard['format'], shard['fields'], iter_risk_rows(
+        shard['risk_type'], shard['fields'], shard['first_id'],
+        shard['last_id'], shard['using']))
+    return {
+        'risk_type': shard['risk_type'],
+        'file': shard['file'],
+        'first_id': shard['first_id'],
+        'last_id': shard['last_id'],
+        'rows': rows,
+        'bytes': os.path.getsize(path),
+        'sha256': file_checksum(path),
+    }
+
+
+def plan_export(out, export_format, shard_size, risk_type_ids, using):
+    """
+    Return the manifest entries of the risk types to export and the shards
+    to export them in.
+    """
+    risk_types = RiskType.objects.using(using).order_by('id')
+    if risk_type_ids:
+        risk_types = risk_types.filter(id__in=risk_type_ids)
+
+    entries, shards = [], []
+    for risk_type in risk_types:
+        fields = list(risk_type.fields.order_by('id').values(
+            'id', 'name', 'field_type'))
+        entries.append({
+            'id': risk_type.id,
+            'tenant': risk_type.tenant,
+            'name': risk_type.name,
+            'fields': fields,
+        })
+        for index, (first_id, last_id) in enumerate(
+                plan_shards(risk_type, shard_size, using)):
+            shards.append({
+                'out': out,
+                'file': os.path.join(str(risk_type.id), 'part-%05d.%s.gz' % (
+                    index, export_format)),
+                'format': export_format,
+                'risk_type': risk_type.id,
+                'fields': fields,
+                'first_id': first_id,
+                'last_id': last_id,
+                'using': using,
+            })
+    return entries, shards
+
+
+def init_worker():
+    # Processes started with "spawn" don't inherit the configured apps
+    django.setup()
+
+
+def export_risks(out, workers=1, export_format=CSV_FORMAT, shard_size=100000,
+                 risk_type_ids=None, using='default'):
+    """
+    Export the risks of all risk types, or only of `risk_type_ids`, to
+    shards of about `shard_size` risks in the directory `out` using
+    `workers` processes, and write the manifest.
+
+    Returns the manifest.
+    """
+    if workers > 1 and connections[using].in_atomic_block:
+        # Workers can't see the uncommitted rows of this transaction, and
+        # closing its connection for them would break it
+        raise TransactionManagementError(
+            "Risks can't be exported by worker processes in a transaction.")
+    os.makedirs(out, exist_ok=True)
+    started = timezone.now()
+    entries, shards = plan_export(out, export_format, shard_size,
+                                  risk_type_ids, using)
+
+    if workers > 1 and len(shards) > 1:
+        # Forked workers must not share the connections of this process
+        connections.close_all()
+        with Pool(min(workers, len(shards)), initializer=init_worker) as pool:
+            results = pool.map(export_shard, shards, chunksize=1)
+    else:
+        results = [export_shard(shard) for shard in shards]
+
+    shards_by_risk_type = {entry['id']: [] for entry in entries}
+    for result in results:
+        shards_by_risk_type[result.pop('risk_type')].append(result)
+    for entry in entries:
+        entry['shards'] = shards_by_risk_type[entry['id']]
+        entry['rows'] = sum(shard['rows'] for shard in entry['shards'])
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'format': export_format,
+        'compression': 'gzip',
+        'started': started,
+        'finished': timezone.now(),
+        'rows': sum(entry['rows'] for entry in entries),
+        'risk_types': entries,
+    }
+    with open(os.path.join(out, MANIFEST_NAME), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, cls=DjangoJSONEncoder, indent=2)
+    return manifest
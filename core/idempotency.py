@@ -0,0 +1,139 @@
+"""
+Idempotency keys for create requests.
+
+Clients (or API Gateway) retrying a timed out `POST` send the same
+`Idempotency-Key` header. The first request claims the key, later requests
+with the same key replay the stored response without touching the write
+path. Keys expire after `IDEMPOTENCY_KEY_TTL` seconds.
+
+The response is stored in the same transaction as the created objects, so a
+key claimed by a request which died half way never has a committed result
+and can safely be claimed again after `IDEMPOTENCY_LOCK_TIMEOUT` seconds.
+"""
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, router, transaction
+from django.utils import timezone
+from rest_framework import exceptions, status
+from rest_framework.response import Response
+from rest_framework.utils import encoders
+
+from core.models import IdempotencyKey
+from core.tenancy import get_current_tenant
+
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+class IdempotencyConflict(exceptions.APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'A request with this Idempotency-Key is in progress.'
+    default_code = 'idempotency_conflict'
+
+    def __init__(self, detail=None, code=None, wait=1):
+        super().__init__(detail, code)
+        # Makes DRF send a Retry-After header
+        self.wait = wait
+
+
+class IdempotencyKeyMismatch(exceptions.APIException):
+    status_code = 422
+    default_detail = ('This Idempotency-Key was already used for a request'
+                      ' with a different payload.')
+    default_code = 'idempotency_key_mismatch'
+
+
+def claim_key(key, path, request_hash):
+    """
+    Claim an idempotency key.
+
+    Returns a `(record, claimed)` tuple, `claimed` is False if the key was
+    already claimed by another request.
+    """
+    tenant = get_current_tenant()
+    using = router.db_for_write(IdempotencyKey)
+    queryset = IdempotencyKey.objects.using(using).filter(
+        tenant=tenant, key=key, path=path)
+    now = timezone.now()
+
+    record = queryset.first()
+    if record is not None:
+        expired = record.created < now - timedelta(
+            seconds=settings.IDEMPOTENCY_KEY_TTL)
+        abandoned = record.status_code is None and record.created < (
+            now - timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT))
+        if not (expired or abandoned):
+            return record, False
+        # Expired keys and abandoned claims can be claimed again
+        queryset.filter(pk=record.pk, created=record.created).delete()
+
+    try:
+        with transaction.atomic(using=using):
+            record = IdempotencyKey.objects.using(using).create(
+                tenant=tenant, key=key, path=path,
+                request_hash=request_hash, created=now)
+        return record, True
+    except IntegrityError:
+        # Claimed by a concurrent request
+        record = queryset.first()
+        if record is None:
+            # The other request failed and released the key meanwhile
+            raise IdempotencyConflict()
+        return record, False
+
+
+def purge_expired_keys(using='default'):
+    """
+    Delete expired idempotency keys, returns the number of deleted keys.
+    """
+    expired = timezone.now() - timedelta(
+        seconds=settings.IDEMPOTENCY_KEY_TTL)
+    deleted, _ = IdempotencyKey.objects.using(using).filter(
+        created__lt=expired).delete()
+    return deleted
+
+
+class IdempotentCreateMixin:
+    """
+    Support the `Idempotency-Key` header on the create action of a viewset.
+    """
+
+    def create(self, request, *args, **kwargs):
+        key = request.META.get(settings.IDEMPOTENCY_KEY_HEADER)
+        if not key:
+            return super().create(request, *args, **kwargs)
+
+        if len(key) > IdempotencyKey._meta.get_field('key').max_length:
+            raise exceptions.ValidationError(
+                {'detail': 'Idempotency-Key is too long.'})
+
+        request_hash = hashlib.sha256(request.body).hexdigest()
+        record, claimed = claim_key(key, request.path, request_hash)
+
+        if not claimed:
+            if record.request_hash != request_hash:
+                raise IdempotencyKeyMismatch()
+            if record.status_code is None:
+                raise IdempotencyConflict()
+            response = Response(json.loads(record.response_body),
+                                status=record.status_code)
+            response[REPLAYED_HEADER] = 'true'
+            return response
+
+        using = record._state.db
+        try:
+            with transaction.atomic(using=using):
+                response = super().create(request, *args, **kwargs)
+                record.status_code = response.status_code
+                record.response_body = json.dumps(
+                    response.data, cls=encoders.JSONEncoder)
+                record.save(using=using,
+                            update_fields=['status_code', 'response_body'])
+        except Exception:
+            # Release the key, the request can be retried
+            record.delete()
+            raise
+
+        return response
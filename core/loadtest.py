@@ -0,0 +1,296 @@
+"""
+Concurrent load-testing harness for the risk API.
+
+Drives a weighted mix of risk type reads, risk creates and risk lists from
+many concurrent clients and collects per-endpoint latency statistics.
+"""
+import http.client
+import json
+import math
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.core.servers.basehttp import (ThreadedWSGIServer,
+                                          WSGIRequestHandler)
+from django.core.wsgi import get_wsgi_application
+
+from core.seeding import build_risk_type_payload, build_risk_payload
+
+READ_RISK_TYPE = "read_risk_type"
+CREATE_RISK = "create_risk"
+LIST_RISKS = "list_risks"
+
+OPERATIONS = (READ_RISK_TYPE, CREATE_RISK, LIST_RISKS)
+
+DEFAULT_MIX = "%s=60,%s=20,%s=20" % OPERATIONS
+
+
+def parse_mix(mix):
+    """
+    Parse a mix specification like "read_risk_type=60,create_risk=40" into
+    a dict of operation name to weight.
+    """
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.strip().partition("=")
+        if name not in OPERATIONS:
+            raise ValueError("Unknown operation '%s'. Choose from: %s" % (
+                name, ", ".join(OPERATIONS)))
+        try:
+            weights[name] = float(weight)
+        except ValueError:
+            raise ValueError("Invalid weight '%s' for '%s'" % (weight, name))
+        if weights[name] < 0:
+            raise ValueError("Weight for '%s' can not be negative" % name)
+
+    if not sum(weights.values()):
+        raise ValueError("At least one operation must have a weight.")
+    return weights
+
+
+def percentile(sorted_values, percent):
+    """
+    Return the nearest-rank percentile from a list of sorted values.
+    """
+    if not sorted_values:
+        return None
+    rank = int(math.ceil(percent / 100.0 * len(sorted_values))) - 1
+    rank = min(max(rank, 0), len(sorted_values) - 1)
+    return sorted_values[rank]
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """
+    Request handler which does not log every request to the console.
+    """
+    def log_message(self, format, *args):
+        pass
+
+
+class LoadTestServer(ThreadedWSGIServer):
+    """
+    Threaded WSGI server with a listen backlog large enough for many
+    concurrent clients.
+    """
+    request_queue_size = 1024
+
+
+def start_local_server(host="127.0.0.1", port=0):
+    """
+    Start the Django application in a background thread.
+
+    Returns the server instance and base url of the running server.
+    """
+    server = LoadTestServer((host, port), QuietRequestHandler)
+    server.set_app(get_wsgi_application())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, "http://%s:%d" % server.server_address[:2]
+
+
+class EndpointStats:
+    """
+    Latency and error statistics collected for a single endpoint.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.errors = 0
+
+    def record(self, latency, ok):
+        self.latencies.append(latency)
+        if not ok:
+            self.errors += 1
+
+    @property
+    def count(self):
+        return len(self.latencies)
+
+    def summary(self, elapsed):
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+        return {
+            "endpoint": self.name,
+            "requests": count,
+            "errors": self.errors,
+            "error_rate": self.errors / count if count else 0.0,
+            "throughput": count / elapsed if elapsed else 0.0,
+            "mean": sum(latencies) / count if count else None,
+            "p50": percentile(latencies, 50),
+            "p90": percentile(latencies, 90),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1] if latencies else None,
+        }
+
+
+class LoadTest:
+    """
+    Run a weighted mix of API operations from concurrent clients against
+    the server at `base_url`.
+
+    Each client opens a new connection per request to reproduce the
+    connection churn of API Gateway/Lambda traffic.
+    """
+
+    def __init__(self, base_url, clients=16, duration=10.0, requests=None,
+                 mix=DEFAULT_MIX, num_fields=10, num_options=5,
+                 seed_risks=10, timeout=30.0):
+        url = urlsplit(base_url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.prefix = url.path.rstrip("/")
+        self.clients = clients
+        self.duration = duration
+        self.requests = requests
+        self.weights = parse_mix(mix) if isinstance(mix, str) else mix
+        self.num_fields = num_fields
+        self.num_options = num_options
+        self.seed_risks = seed_risks
+        self.timeout = timeout
+
+        self.risk_type = None
+        self.stats = {name: EndpointStats(name) for name in self.weights}
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+        self._issued = 0
+
+    def request(self, method, path, data=None):
+        """
+        Issue a single request and return a (status, parsed body) tuple.
+        """
+        body = json.dumps(data) if data is not None else None
+        headers = {"Accept": "application/json"}
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+
+        connection = http.client.HTTPConnection(
+            self.host, self.port, timeout=self.timeout)
+        try:
+            connection.request(method, self.prefix + path, body, headers)
+            response = connection.getresponse()
+            content = response.read()
+        finally:
+            connection.close()
+
+        if content and response.getheader(
+                "Content-Type", "").startswith("application/json"):
+            content = json.loads(content.decode("utf-8"))
+        return response.status, content
+
+    def seed(self):
+        """
+        Create the risk type (and a few risks) used by the load test.
+        """
+        payload = build_risk_type_payload(self.num_fields, self.num_options)
+        status, content = self.request("POST", "/api/risk_types/", payload)
+        if status != 201:
+            raise RuntimeError(
+                "Unable to seed risk type (HTTP %s): %s" % (status, content))
+
+        status, self.risk_type = self.request(
+            "GET", "/api/risk_types/%d/" % content["id"])
+        if status != 200:
+            raise RuntimeError("Unable to read seeded risk type (HTTP %s)"
+                               % status)
+
+        # Fields with many options come without them, pick values among
+        # the first page of their options
+        for field in self.risk_type["fields"]:
+            if "options" not in field:
+                status, page = self.request(
+                    "GET", "/api/risk_types/%d/fields/%d/options/" % (
+                        self.risk_type["id"], field["id"]))
+                if status != 200:
+                    raise RuntimeError(
+                        "Unable to read options of seeded field (HTTP %s)"
+                        % status)
+                field["options"] = page["results"]
+
+        for _ in range(self.seed_risks):
+            status, content = self.request(
+                "POST", "/api/risks/", build_risk_payload(self.risk_type))
+            if status != 201:
+                raise RuntimeError(
+                    "Unable to seed risk (HTTP %s): %s" % (status, content))
+
+    def cleanup(self):
+        """
+        Delete the seeded risk type along with all risks created for it.
+        """
+        if self.risk_type is not None:
+            self.request("DELETE", "/api/risk_types/%d/" %
+                         self.risk_type["id"])
+            self.risk_type = None
+
+    def perform(self, operation, rand):
+        if operation == READ_RISK_TYPE:
+            status, _ = self.request(
+                "GET", "/api/risk_types/%d/" % self.risk_type["id"])
+            return status == 200
+        if operation == CREATE_RISK:
+            status, _ = self.request(
+                "POST", "/api/risks/",
+                build_risk_payload(self.risk_type, rand))
+            return status == 201
+        status, _ = self.request("GET", "/api/risks/")
+        return status == 200
+
+    def _next_request(self, deadline):
+        with self._lock:
+            if self.requests is not None:
+                if self._issued >= self.requests:
+                    return False
+                self._issued += 1
+                return True
+        return time.perf_counter() < deadline
+
+    def _client(self, deadline, seed):
+        rand = random.Random(seed)
+        operations = list(self.weights)
+        weights = [self.weights[operation] for operation in operations]
+
+        while self._next_request(deadline):
+            operation = rand.choices(operations, weights)[0]
+            started = time.perf_counter()
+            try:
+                ok = self.perform(operation, rand)
+            except (OSError, http.client.HTTPException, ValueError):
+                ok = False
+            latency = time.perf_counter() - started
+
+            with self._lock:
+                self.stats[operation].record(latency, ok)
+
+    def run(self):
+        """
+        Run the load test and return a list of per-endpoint summaries
+        followed by a summary of all requests.
+        """
+        if self.risk_type is None:
+            self.seed()
+
+        threads = []
+        started = time.perf_counter()
+        deadline = started + self.duration
+        for index in range(self.clients):
+            thread = threading.Thread(target=self._client,
+                                      args=(deadline, index), daemon=True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        self.elapsed = time.perf_counter() - started
+
+        return self.summary()
+
+    def summary(self):
+        total = EndpointStats("total")
+        summaries = []
+        for stats in self.stats.values():
+            summaries.append(stats.summary(self.elapsed))
+            total.latencies.extend(stats.latencies)
+            total.errors += stats.errors
+        summaries.append(total.summary(self.elapsed))
+        return summaries
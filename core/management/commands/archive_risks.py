@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+
+from core.archive import archive_risks
+
+
+class Command(BaseCommand):
+    help = ("Move the field values of old risks out of the database into "
+            "compressed archives in the archive storage.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than', type=int, required=True, metavar='DAYS',
+            help='Archive risks created more than this many days ago.')
+        parser.add_argument(
+            '--risk-type', type=int, action='append', dest='risk_types',
+            help='Only archive risks of this risk type, can be repeated.')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of risks per archive. Default: 1000')
+        parser.add_argument(
+            '--database', default=DEFAULT_DB_ALIAS,
+            help='Database to archive risks of. Default: "default"')
+
+    def handle(self, *args, **options):
+        created_before = timezone.now() - timedelta(
+            days=options['older_than'])
+        archives = archive_risks(created_before, options['risk_types'],
+                                 options['batch_size'], options['database'])
+        self.stdout.write("Archived %d risks in %d archives." % (
+            sum(archive.risk_count for archive in archives), len(archives)))
@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from core.seeding import build_risk_type_payload
+from core.serializers import RiskTypeSerializer
+
+
+class Command(BaseCommand):
+    help = ("Measure the creation of a wide risk type with large enum "
+            "option sets through RiskTypeSerializer.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fields', type=int, default=300,
+            help='Number of fields of the risk type. Default: 300')
+        parser.add_argument(
+            '--options', type=int, default=50000,
+            help='Total number of options, spread over the enum fields.'
+                 ' Default: 50000')
+        parser.add_argument(
+            '--repeat', type=int, default=3,
+            help='Number of risk types to create. Default: 3')
+        parser.add_argument(
+            '--keep-data', action='store_true',
+            help='Do not delete the created risk types.')
+
+    def handle(self, *args, **options):
+        payload = build_risk_type_payload(options['fields'], 1)
+        enum_fields = [field for field in payload['fields']
+                       if 'options' in field]
+        per_field = options['options'] // max(len(enum_fields), 1)
+        for field in enum_fields:
+            field['options'] = [{"value": "Option %d" % (index + 1)}
+                                for index in range(per_field)]
+
+        self.stdout.write("%d fields, %d options" % (
+            len(payload['fields']), per_field * len(enum_fields)))
+
+        for _ in range(options['repeat']):
+            serializer = RiskTypeSerializer(data=payload)
+            started = time.perf_counter()
+            serializer.is_valid(raise_exception=True)
+            validated = time.perf_counter()
+            with CaptureQueriesContext(connection) as create_queries:
+                risk_type = serializer.save()
+            created = time.perf_counter()
+            with CaptureQueriesContext(connection) as render_queries:
+                serializer.data
+            rendered = time.perf_counter()
+
+            self.stdout.write(
+                "validation %.0fms, create %.0fms in %d statements, "
+                "response %.0fms in %d queries" % (
+                    (validated - started) * 1000, (created - validated) * 1000,
+                    len(create_queries.captured_queries),
+                    (rendered - created) * 1000,
+                    len(render_queries.captured_queries)))
+            if not options['keep_data']:
+                risk_type.delete()
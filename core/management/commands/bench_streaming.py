@@ -0,0 +1,121 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+
+from core.asgi import ASGIHandler, build_environ
+from core.loadtest import percentile
+from core.seeding import seed_risk_type, seed_risks
+
+
+class Command(BaseCommand):
+    help = ("Compare concurrent streaming throughput of the WSGI and ASGI "
+            "entry points with slow clients.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--clients', type=int, default=64,
+            help='Number of concurrent clients. Default: 64')
+        parser.add_argument(
+            '--workers', type=int, default=8,
+            help='Worker threads available to each entry point. Default: 8')
+        parser.add_argument(
+            '--risks', type=int, default=50,
+            help='Number of risks to seed. Default: 50')
+        parser.add_argument(
+            '--fields', type=int, default=10,
+            help='Number of fields in the seeded risk type. Default: 10')
+        parser.add_argument(
+            '--chunk-size', type=int, default=10,
+            help='Number of risks per streamed chunk. Default: 10')
+        parser.add_argument(
+            '--client-delay', type=float, default=0.1,
+            help='Seconds a client takes to consume each chunk.'
+                 ' Default: 0.1')
+        parser.add_argument(
+            '--keep-data', action='store_true',
+            help='Do not delete the seeded risk type after the benchmark.')
+
+    def handle(self, *args, **options):
+        risk_type = seed_risk_type(options['fields'], name="Streaming bench")
+        seed_risks(risk_type, options['risks'])
+
+        try:
+            scope = self.build_scope(options['chunk_size'])
+            for name, bench in (("wsgi", self.bench_wsgi),
+                                ("asgi", self.bench_asgi)):
+                elapsed, latencies = bench(scope, options)
+                latencies.sort()
+                self.stdout.write(
+                    "%s: %d responses in %.2fs, %.1f responses/s, "
+                    "p50 %.0fms, p99 %.0fms" % (
+                        name, len(latencies), elapsed,
+                        len(latencies) / elapsed,
+                        percentile(latencies, 50) * 1000,
+                        percentile(latencies, 99) * 1000))
+        finally:
+            if not options['keep_data']:
+                risk_type.delete()
+
+    def build_scope(self, chunk_size):
+        hosts = [host for host in settings.ALLOWED_HOSTS if host != '*']
+        host = hosts[0].lstrip('.') if hosts else 'localhost'
+        return {
+            'type': 'http',
+            'method': 'GET',
+            'path': '/api/risks/stream/',
+            'query_string': ('chunk_size=%d' % chunk_size).encode(),
+            'headers': [(b'host', host.encode())],
+            'server': (host, 80),
+        }
+
+    def bench_wsgi(self, scope, options):
+        application = get_wsgi_application()
+        delay = options['client_delay']
+
+        def client(_):
+            started = time.perf_counter()
+            result = application(build_environ(scope, b''),
+                                 lambda status, headers: None)
+            try:
+                for _ in result:
+                    time.sleep(delay)
+            finally:
+                result.close()
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            latencies = list(executor.map(client, range(options['clients'])))
+        return time.perf_counter() - started, latencies
+
+    def bench_asgi(self, scope, options):
+        handler = ASGIHandler(get_wsgi_application(),
+                              max_workers=options['workers'])
+        delay = options['client_delay']
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            if message['type'] == 'http.response.body' and message['body']:
+                await asyncio.sleep(delay)
+
+        async def client():
+            started = time.perf_counter()
+            await handler(dict(scope), receive, send)
+            return time.perf_counter() - started
+
+        loop = asyncio.new_event_loop()
+        try:
+            started = time.perf_counter()
+            latencies = loop.run_until_complete(asyncio.gather(
+                *[client() for _ in range(options['clients'])], loop=loop))
+            elapsed = time.perf_counter() - started
+        finally:
+            handler.executor.shutdown(wait=True)
+            loop.close()
+        return elapsed, list(latencies)
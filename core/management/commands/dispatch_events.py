@@ -0,0 +1,51 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from core.outbox import Dispatcher, retry_failed_events
+
+
+class Command(BaseCommand):
+    help = ("Deliver risk events to the endpoints in OUTBOX_ENDPOINTS, "
+            "polling for new events until interrupted.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once no event is due instead of polling.')
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.OUTBOX_BATCH_SIZE,
+            help='Number of events claimed at a time. Default: %d'
+                 % settings.OUTBOX_BATCH_SIZE)
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='Seconds to wait when no event is due. Default: 1.0')
+        parser.add_argument(
+            '--retry-failed', action='store_true',
+            help='Deliver events which ran out of attempts again.')
+        parser.add_argument(
+            '--database', default=DEFAULT_DB_ALIAS,
+            help='Database to deliver events of. Default: "default"')
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            retried = retry_failed_events(options['database'])
+            self.stdout.write("Scheduled %d failed events." % retried)
+
+        dispatcher = Dispatcher(using=options['database'])
+        try:
+            while True:
+                counts = dispatcher.dispatch_due(options['batch_size'])
+                if any(counts.values()):
+                    self.stdout.write(
+                        "Delivered %(delivered)d events, %(retried)d to "
+                        "retry, %(failed)d failed." % counts)
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            dispatcher.close()
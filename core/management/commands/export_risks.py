@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from core.export import CSV_FORMAT, EXPORT_FORMATS, export_risks
+
+
+class Command(BaseCommand):
+    help = ("Export the risks of all risk types to gzipped CSV or NDJSON "
+            "shards written in parallel, with a manifest of row counts and "
+            "checksums.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--out', required=True, metavar='DIR',
+            help='Directory to write the shards and manifest.json to.')
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Number of worker processes. Default: 1')
+        parser.add_argument(
+            '--format', choices=EXPORT_FORMATS, default=CSV_FORMAT,
+            help='Format of the shards. Default: %s' % CSV_FORMAT)
+        parser.add_argument(
+            '--shard-size', type=int, default=100000,
+            help='Approximate number of risks per shard. Default: 100000')
+        parser.add_argument(
+            '--risk-type', type=int, action='append', dest='risk_types',
+            help='Only export risks of this risk type, can be repeated.')
+        parser.add_argument(
+            '--database', default=DEFAULT_DB_ALIAS,
+            help='Database to export risks of. Default: "default"')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        manifest = export_risks(
+            options['out'], options['workers'], options['format'],
+            options['shard_size'], options['risk_types'],
+            options['database'])
+        elapsed = time.perf_counter() - started
+
+        shards = sum(len(entry['shards']) for entry in manifest['risk_types'])
+        self.stdout.write(
+            "Exported %d risks of %d risk types in %d shards to %s in %.1fs "
+            "(%d risks/s)." % (
+                manifest['rows'], len(manifest['risk_types']), shards,
+                options['out'], elapsed,
+                manifest['rows'] / max(elapsed, 0.001)))
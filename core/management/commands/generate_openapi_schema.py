@@ -0,0 +1,42 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.openapi import (generate_schema_document, get_code_version,
+                          render_schema_document)
+
+
+class Command(BaseCommand):
+    help = ("Generate the OpenAPI schema document for the current code "
+            "version. The JSON document written to OPENAPI_SCHEMA_FILE is "
+            "served by /docs/ instead of generating it at runtime.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            help='Output file path, or "-" for stdout.'
+                 ' Default: OPENAPI_SCHEMA_FILE setting')
+        parser.add_argument(
+            '--format', choices=('json', 'yaml'), default='json',
+            help='Output format. Only JSON documents are served by the API.'
+                 ' Default: json')
+
+    def handle(self, *args, **options):
+        version = get_code_version()
+        document = generate_schema_document(version)
+
+        output = options['output'] or settings.OPENAPI_SCHEMA_FILE
+        if options['format'] == 'json':
+            content = json.dumps(document, indent=2).encode('utf-8')
+        else:
+            content = render_schema_document(document, 'yaml')
+
+        if output == '-':
+            self.stdout.write(content.decode('utf-8'))
+            return
+
+        with open(output, 'wb') as artifact:
+            artifact.write(content)
+        self.stdout.write("Wrote OpenAPI schema for code version %s to %s" % (
+            version, output))
@@ -0,0 +1,94 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.loadtest import DEFAULT_MIX, LoadTest, parse_mix, start_local_server
+
+
+class Command(BaseCommand):
+    help = ("Run a concurrent load test against the API and report "
+            "throughput, latency percentiles and error rate per endpoint.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url',
+            help='Base url of a running server. If omitted, the application'
+                 ' is started locally in a background thread.')
+        parser.add_argument(
+            '--clients', type=int, default=16,
+            help='Number of concurrent clients. Default: 16')
+        parser.add_argument(
+            '--duration', type=float, default=10.0,
+            help='Duration of the test in seconds. Default: 10')
+        parser.add_argument(
+            '--requests', type=int,
+            help='Stop after a total number of requests instead of after'
+                 ' --duration seconds.')
+        parser.add_argument(
+            '--mix', default=DEFAULT_MIX,
+            help='Weighted mix of operations. Default: %s' % DEFAULT_MIX)
+        parser.add_argument(
+            '--fields', type=int, default=10,
+            help='Number of fields in the seeded risk type. Default: 10')
+        parser.add_argument(
+            '--options', type=int, default=5,
+            help='Number of options per enum field. Default: 5')
+        parser.add_argument(
+            '--seed-risks', type=int, default=10,
+            help='Number of risks created before the test starts. Default: 10')
+        parser.add_argument(
+            '--keep-data', action='store_true',
+            help='Do not delete the seeded risk type after the test.')
+
+    def handle(self, *args, **options):
+        try:
+            mix = parse_mix(options['mix'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if options['clients'] < 1:
+            raise CommandError("--clients must be at least 1.")
+
+        server = None
+        url = options['url']
+        if not url:
+            server, url = start_local_server()
+            self.stdout.write("Started local server at %s" % url)
+
+        load_test = LoadTest(
+            url, clients=options['clients'], duration=options['duration'],
+            requests=options['requests'], mix=mix,
+            num_fields=options['fields'], num_options=options['options'],
+            seed_risks=options['seed_risks'])
+
+        try:
+            try:
+                load_test.seed()
+            except (RuntimeError, OSError) as e:
+                raise CommandError(str(e))
+
+            self.stdout.write(
+                "Running load test with %d clients..." % options['clients'])
+            summaries = load_test.run()
+        finally:
+            if not options['keep_data']:
+                load_test.cleanup()
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+        self.write_report(summaries, load_test.elapsed)
+
+    def write_report(self, summaries, elapsed):
+        def ms(value):
+            return "-" if value is None else "%.1f" % (value * 1000)
+
+        self.stdout.write("Elapsed: %.2fs" % elapsed)
+        row = "%-16s %9s %9s %7s %8s %8s %8s %8s %8s"
+        self.stdout.write(row % ("endpoint", "requests", "req/s", "errors",
+                                 "p50 ms", "p90 ms", "p99 ms", "max ms",
+                                 "err %"))
+        for summary in summaries:
+            self.stdout.write(row % (
+                summary["endpoint"], summary["requests"],
+                "%.1f" % summary["throughput"], summary["errors"],
+                ms(summary["p50"]), ms(summary["p90"]), ms(summary["p99"]),
+                ms(summary["max"]), "%.2f" % (summary["error_rate"] * 100)))
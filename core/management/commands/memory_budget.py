@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core import cache
+from core.memory import (BUDGET_FIELDS, BUDGET_OPTIONS, BUDGET_RISKS,
+                         SCENARIOS, measure_scenarios)
+from core.seeding import seed_risk_type, seed_risks
+from core.tenancy import get_tenant_database
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Measure the peak memory allocated by the risk endpoints on "
+            "seeded data with tracemalloc and compare it with their "
+            "budgets.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scenario', action='append', dest='scenarios',
+            choices=[name for name, _ in SCENARIOS],
+            help='Only measure this scenario, can be repeated.')
+        parser.add_argument(
+            '--fields', type=int, default=BUDGET_FIELDS,
+            help='Number of fields of the seeded risk type. Default: %d'
+                 % BUDGET_FIELDS)
+        parser.add_argument(
+            '--options', type=int, default=BUDGET_OPTIONS,
+            help='Number of options of each seeded enum field. Default: %d'
+                 % BUDGET_OPTIONS)
+        parser.add_argument(
+            '--risks', type=int, default=BUDGET_RISKS,
+            help='Number of seeded risks. Default: %d' % BUDGET_RISKS)
+        parser.add_argument(
+            '--top', type=int, default=5,
+            help='Number of allocation sites to show. Default: 5')
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Fail if a scenario exceeds its budget. Budgets only '
+                 'apply to the default data set.')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic(using=get_tenant_database()):
+                risk_type = seed_risk_type(
+                    options['fields'], options['options'],
+                    name="Memory budget")
+                seed_risks(risk_type, options['risks'])
+                usages = measure_scenarios(risk_type, options['scenarios'],
+                                           options['top'])
+                raise Rollback()
+        except Rollback:
+            # Drop representations of the rolled back data
+            cache.risk_type_changed(risk_type.id)
+
+        for usage in usages:
+            self.stdout.write(str(usage))
+            for statistic in usage.top:
+                self.stdout.write("    %s" % statistic)
+
+        over_budget = [usage.name for usage in usages
+                       if not usage.within_budget()]
+        if options['check'] and over_budget:
+            raise CommandError("Over budget: %s" % ", ".join(over_budget))
@@ -0,0 +1,89 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from core import cache
+from core.profiling import PROFILE_ID_HEADER
+from core.seeding import seed_risk_type, seed_risks
+from core.tenancy import get_tenant_database
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Profile a request to the API in-process against seeded data. "
+            "{risk_type} and {risk} in the URL are replaced with the ids of "
+            "the seeded risk type and one of its risks.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'url', help='URL to profile, e.g. /api/risk_types/{risk_type}/')
+        parser.add_argument(
+            '--method', default='GET',
+            help='HTTP method of the request. Default: GET')
+        parser.add_argument(
+            '--data', help='JSON body of the request.')
+        parser.add_argument(
+            '--fields', type=int, default=10,
+            help='Number of fields of the seeded risk type. Default: 10')
+        parser.add_argument(
+            '--options', type=int, default=5,
+            help='Number of options of each seeded enum field. Default: 5')
+        parser.add_argument(
+            '--risks', type=int, default=100,
+            help='Number of seeded risks. Default: 100')
+        parser.add_argument(
+            '--output', default=settings.PROFILING_DIR,
+            help='Directory to write the profile to. Default: %s'
+                 % settings.PROFILING_DIR)
+        parser.add_argument(
+            '--keep-data', action='store_true',
+            help='Do not delete the seeded data after profiling.')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic(using=get_tenant_database()):
+                risk_type = seed_risk_type(
+                    options['fields'], options['options'], name="Profiling")
+                seed_risks(risk_type, options['risks'])
+                self.profile(risk_type, options)
+                if not options['keep_data']:
+                    raise Rollback()
+        except Rollback:
+            # Drop representations of the rolled back data
+            cache.risk_type_changed(risk_type.id)
+
+    def profile(self, risk_type, options):
+        risk = risk_type.risks.order_by('id').first()
+        url = options['url'].format(risk_type=risk_type.id,
+                                    risk=risk.id if risk else 0)
+
+        hosts = [host for host in settings.ALLOWED_HOSTS if host != '*']
+        client = APIClient(
+            HTTP_HOST=hosts[0].lstrip('.') if hosts else 'localhost')
+        data = json.loads(options['data']) if options['data'] else None
+
+        with override_settings(PROFILING_ENABLED=True,
+                               PROFILING_DIR=options['output']):
+            response = getattr(client, options['method'].lower())(
+                url, data, format='json')
+
+        profile_id = response.get(PROFILE_ID_HEADER)
+        if profile_id is None:
+            raise CommandError("%s %s is not a profiled endpoint (%d)." % (
+                options['method'], url, response.status_code))
+
+        self.stdout.write("%s %s: %d" % (options['method'], url,
+                                         response.status_code))
+        path = os.path.join(options['output'], profile_id)
+        with open(path + '.txt') as summary:
+            self.stdout.write(summary.read())
+        for extension in ('prof', 'collapsed', 'txt'):
+            self.stdout.write("Wrote %s.%s" % (path, extension))
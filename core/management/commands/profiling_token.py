@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.profiling import make_profiling_token
+
+
+class Command(BaseCommand):
+    help = ("Print a token to profile API requests with, sent in the "
+            "X-Profile header.")
+
+    def handle(self, *args, **options):
+        self.stdout.write(make_profiling_token())
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from core.idempotency import purge_expired_keys
+from core.tenancy import get_tenant_databases
+
+
+class Command(BaseCommand):
+    help = ("Delete idempotency keys older than IDEMPOTENCY_KEY_TTL seconds "
+            "from the databases of all tenants.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database', action='append', dest='databases',
+            help='Only purge this database, can be repeated. Default: '
+                 '"default" and every database in TENANT_DATABASES')
+
+    def handle(self, *args, **options):
+        for database in options['databases'] or get_tenant_databases():
+            deleted = purge_expired_keys(database)
+            self.stdout.write("Deleted %d expired idempotency keys from "
+                              "%s." % (deleted, database))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Q
+
+from core import cache
+from core.counters import reconcile_counters
+from core.models import RiskType
+
+
+class Command(BaseCommand):
+    help = ("Recompute risk counts of risk types and usage counts of enum "
+            "options, fixing any drift from the actual number of rows.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database', default=DEFAULT_DB_ALIAS,
+            help='Database to reconcile. Default: "default"')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report drifted counters, do not fix them.')
+
+    def handle(self, *args, **options):
+        risk_type_ids, option_ids = reconcile_counters(
+            options['database'], options['dry_run'])
+
+        if not options['dry_run']:
+            # Drop cached representations showing the fixed counters
+            risk_types = RiskType.objects.using(options['database']).filter(
+                Q(pk__in=risk_type_ids) | Q(fields__options__in=option_ids))
+            for risk_type_id, tenant in risk_types.values_list(
+                    'id', 'tenant').distinct():
+                cache.risk_type_changed(risk_type_id, tenant)
+
+        action = "Found" if options['dry_run'] else "Fixed"
+        self.stdout.write("%s %d drifted risk type counters%s" % (
+            action, len(risk_type_ids),
+            ": %s" % risk_type_ids if risk_type_ids else "."))
+        self.stdout.write("%s %d drifted option counters%s" % (
+            action, len(option_ids),
+            ": %s" % option_ids if option_ids else "."))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from core.archive import restore_risks
+from core.models import Risk
+
+
+class Command(BaseCommand):
+    help = "Move archived risks back from the archive storage."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--risk', type=int, action='append', dest='risks',
+            help='Restore this risk, can be repeated.')
+        parser.add_argument(
+            '--archive', type=int, action='append', dest='archives',
+            help='Restore all risks of this archive, can be repeated.')
+        parser.add_argument(
+            '--risk-type', type=int, action='append', dest='risk_types',
+            help='Restore all risks of this risk type, can be repeated.')
+        parser.add_argument(
+            '--database', default=DEFAULT_DB_ALIAS,
+            help='Database to restore risks to. Default: "default"')
+
+    def handle(self, *args, **options):
+        if not (options['risks'] or options['archives'] or
+                options['risk_types']):
+            raise CommandError(
+                "Pass at least one of --risk, --archive or --risk-type.")
+
+        risks = Risk.objects.using(options['database']).none()
+        for lookup, ids in (('pk__in', options['risks']),
+                            ('archive__in', options['archives']),
+                            ('risk_type__in', options['risk_types'])):
+            if ids:
+                risks |= Risk.objects.using(options['database']).filter(
+                    **{lookup: ids})
+
+        restored = restore_risks(risks, options['database'])
+        self.stdout.write("Restored %d risks." % restored)
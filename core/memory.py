@@ -0,0 +1,170 @@
+"""
+Memory budgets of the risk endpoints.
+
+The peak memory allocated by Python while listing, retrieving and creating
+risks is measured with `tracemalloc` on a seeded data set of
+`BUDGET_RISKS` risks of a risk type with `BUDGET_FIELDS` fields and
+`BUDGET_OPTIONS` options per enum field. A test fails when a scenario
+exceeds its budget in `MEMORY_BUDGETS`, and `./manage.py memory_budget`
+reports the usage of every scenario and its largest allocation sites.
+
+Every budget is the peak measured by `./manage.py memory_budget` on
+CPython 3.6.15 with SQLite 3.40.1, Django 2.1.15 and Django REST framework
+3.9.0, plus 25%. The margin only holds in that environment: peaks vary
+between Python builds and database drivers, other environments measured
+peaks up to 27% lower, where the budgets leave 52-70% of headroom and only
+catch larger regressions. Re-measure and reset the budgets in the
+environment the tests run in, after upgrading any of these, and whenever a
+change reduces the memory usage of a scenario. tracemalloc only traces memory allocated by Python, deployed
+functions need headroom for the interpreter, C extensions and drivers on
+top of the budgets.
+"""
+import gc
+import tracemalloc
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory
+
+from core.seeding import build_risk_payload
+from core.serializers import RiskSerializer, RiskTypeSerializer
+from core.views import RiskViewSet
+
+# Data set the budgets apply to
+BUDGET_FIELDS = 20
+BUDGET_OPTIONS = 10
+BUDGET_RISKS = 100
+
+# Peak memory allocated by each scenario, in KiB: the peak measured in the
+# environment above plus 25%
+MEMORY_BUDGETS = {
+    # All risks with every value, field and option nested in each risk,
+    # measured at 11666 KiB
+    'risk_list': 14583,
+    # One risk, rendered without the representation cache, measured at
+    # 450 KiB
+    'risk_retrieve': 563,
+    # Validating and creating one risk with RiskSerializer, measured at
+    # 280 KiB
+    'risk_create': 350,
+}
+
+
+class MemoryUsage:
+    """
+    Memory allocated by Python while running a block of code.
+
+    `peak` is the highest amount of traced memory in bytes, `retained` and
+    `blocks` are the size and number of memory blocks still reachable at
+    the end, `top` are the allocation sites which retained the most memory.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.peak = None
+        self.retained = None
+        self.blocks = None
+        self.top = []
+
+    @property
+    def budget(self):
+        return MEMORY_BUDGETS.get(self.name)
+
+    def within_budget(self):
+        return self.budget is None or self.peak <= self.budget * 1024
+
+    def __str__(self):
+        return '%s: peak %.1f KiB (budget %s KiB), retained %.1f KiB in ' \
+               '%d blocks' % (self.name, self.peak / 1024.0,
+                              self.budget, self.retained / 1024.0,
+                              self.blocks)
+
+
+@contextmanager
+def track_memory(name, top=10):
+    """
+    Measure the memory allocated by Python in a `with` block.
+    """
+    usage = MemoryUsage(name)
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    # Only count memory allocated in the block
+    tracemalloc.clear_traces()
+    try:
+        yield usage
+        # Serializers and responses hold reference cycles, only count
+        # what is still reachable as retained
+        gc.collect()
+        usage.retained, usage.peak = tracemalloc.get_traced_memory()
+        statistics = tracemalloc.take_snapshot().statistics('lineno')
+        usage.blocks = sum(stat.count for stat in statistics)
+        usage.top = statistics[:top]
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+
+
+# Scenarios prepare their input and return a function running the
+# measured code, which returns what the endpoint would send
+
+def risk_list(risk_type):
+    request = APIRequestFactory().get('/api/risks/')
+    view = RiskViewSet.as_view({'get': 'list'})
+    return lambda: view(request).render()
+
+
+def risk_retrieve(risk_type):
+    risk_id = risk_type.risks.order_by('id').values_list(
+        'id', flat=True).first()
+    request = APIRequestFactory().get('/api/risks/%d/' % risk_id)
+    view = RiskViewSet.as_view({'get': 'retrieve'})
+    return lambda: view(request, pk=str(risk_id)).render()
+
+
+def risk_create(risk_type):
+    payload = build_risk_payload(RiskTypeSerializer(risk_type).data)
+
+    def create():
+        serializer = RiskSerializer(data=payload)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return serializer.data
+    return create
+
+
+SCENARIOS = (
+    ('risk_list', risk_list),
+    ('risk_retrieve', risk_retrieve),
+    ('risk_create', risk_create),
+)
+
+
+def measure_scenarios(risk_type, names=None, top=10):
+    """
+    Run the scenarios on the risks of `risk_type`, all of them or only
+    those in `names`, and return their `MemoryUsage`.
+    """
+    usages = []
+    # Queries logged in debug mode would be counted. Representations are
+    # not cached, in a private cache, so that the uncached paths are
+    # measured without touching the cache the API shares.
+    caches = dict(settings.CACHES, memory_budget={
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    })
+    with override_settings(DEBUG=False, CACHES=caches,
+                           REPRESENTATION_CACHE='memory_budget',
+                           REPRESENTATION_CACHE_ALLOW_LOCAL_MEMORY=False):
+        for name, scenario in SCENARIOS:
+            if names and name not in names:
+                continue
+            run = scenario(risk_type)
+            # Leave out one-off allocations of the first run, like lazy
+            # imports
+            run()
+            with track_memory(name, top) as usage:
+                result = run()
+                del result
+            usages.append(usage)
+    return usages
@@ -0,0 +1,35 @@
+# Generated by Django 2.1.3 on 2026-10-19 16:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='risk',
+            name='tenant',
+            field=models.CharField(blank=True, default='', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='risktype',
+            name='tenant',
+            field=models.CharField(blank=True, default='', max_length=50),
+        ),
+        migrations.AddIndex(
+            model_name='risk',
+            index=models.Index(fields=['tenant', 'id'], name='core_risk_tenant_3c968b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='risk',
+            index=models.Index(fields=['tenant', 'risk_type', 'id'], name='core_risk_tenant_9a17ab_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='risktype',
+            index=models.Index(fields=['tenant', 'id'], name='core_riskty_tenant_e83e10_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 2.1.3 on 2026-10-19 16:51
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_counters(apps, schema_editor):
+    RiskType = apps.get_model('core', 'RiskType')
+    Risk = apps.get_model('core', 'Risk')
+    OptionValue = apps.get_model('core', 'OptionValue')
+    FieldValue = apps.get_model('core', 'FieldValue')
+    db = schema_editor.connection.alias
+
+    risks = Risk.objects.using(db).filter(risk_type=OuterRef('pk')) \
+        .order_by().values('risk_type').annotate(count=Count('pk')) \
+        .values('count')
+    RiskType.objects.using(db).update(risk_count=Coalesce(
+        Subquery(risks, output_field=IntegerField()), 0))
+
+    values = FieldValue.objects.using(db) \
+        .filter(value_option=OuterRef('pk')).order_by() \
+        .values('value_option').annotate(count=Count('pk')).values('count')
+    OptionValue.objects.using(db).update(usage_count=Coalesce(
+        Subquery(values, output_field=IntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='optionvalue',
+            name='usage_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='risktype',
+            name='risk_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 2.1.3 on 2026-10-19 17:40
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+import django.db.models.deletion
+
+FIELD_RISK_INDEX = 'core_fieldvalue_field_risk_idx'
+
+
+def delete_duplicate_values(apps, schema_editor):
+    """
+    Keep only the latest value of a field for every risk so that the
+    unique constraint on (risk, field) can be added.
+    """
+    FieldValue = apps.get_model('core', 'FieldValue')
+    db_alias = schema_editor.connection.alias
+    duplicates = FieldValue.objects.using(db_alias).order_by() \
+        .values('risk', 'field').annotate(count=Count('pk'), last=Max('pk')) \
+        .filter(count__gt=1)
+    for duplicate in duplicates:
+        FieldValue.objects.using(db_alias).filter(
+            risk=duplicate['risk'], field=duplicate['field'],
+        ).exclude(pk=duplicate['last']).delete()
+
+
+def make_field_risk_index_covering(apps, schema_editor):
+    """
+    Include the non-text value columns in the (field, risk) index on
+    PostgreSQL 11+ so that scans of the values of a field are index-only.
+
+    Text values are left out, they can exceed the btree row size limit.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql' or connection.pg_version < 110000:
+        return
+    schema_editor.execute('DROP INDEX %s' % FIELD_RISK_INDEX)
+    schema_editor.execute(
+        'CREATE INDEX %s ON core_fieldvalue (field_id, risk_id) '
+        'INCLUDE (value_number, value_date, value_option_id)'
+        % FIELD_RISK_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_counter_caches'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_values,
+                             migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='fieldvalue',
+            unique_together={('risk', 'field')},
+        ),
+        migrations.AlterField(
+            model_name='fieldvalue',
+            name='risk',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='field_values', to='core.Risk'),
+        ),
+        migrations.AddIndex(
+            model_name='fieldvalue',
+            index=models.Index(fields=['field', 'risk'], name=FIELD_RISK_INDEX),
+        ),
+        migrations.AlterField(
+            model_name='fieldvalue',
+            name='field',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='field_values', to='core.Field'),
+        ),
+        migrations.RunPython(make_field_risk_index_covering,
+                             migrations.RunPython.noop),
+    ]
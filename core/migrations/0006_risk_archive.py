@@ -0,0 +1,43 @@
+# Generated by Django 2.1.3 on 2026-10-19 17:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_fieldvalue_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RiskArchive',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tenant', models.CharField(blank=True, default='', max_length=50)),
+                ('name', models.CharField(max_length=255)),
+                ('risk_count', models.PositiveIntegerField()),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('risk_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archives', to='core.RiskType')),
+            ],
+        ),
+        # Existing risks have no known creation time and are left NULL,
+        # only risks created from now on get the current time
+        migrations.AddField(
+            model_name='risk',
+            name='created',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='risk',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now, null=True),
+        ),
+        migrations.AddField(
+            model_name='risk',
+            name='archive',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='risks', to='core.RiskArchive'),
+        ),
+    ]
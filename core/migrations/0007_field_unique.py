@@ -0,0 +1,27 @@
+# Generated by Django 2.1.3 on 2026-10-19 17:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_risk_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='field',
+            name='unique',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='fieldvalue',
+            name='value_hash',
+            field=models.CharField(blank=True, editable=False, max_length=40, null=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='fieldvalue',
+            unique_together={('risk', 'field'), ('field', 'value_hash')},
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 2.1.3 on 2026-10-19 17:15
+
+from django.db import migrations
+
+VALUE_TRIGRAM_INDEX = 'core_optionvalue_value_trgm_idx'
+
+
+def create_value_trigram_index(apps, schema_editor):
+    """
+    Index option values by trigrams on PostgreSQL so that case insensitive
+    prefix and substring searches of options are index scans.
+
+    Indexes `UPPER(value)`, the expression Django matches with
+    `istartswith` and `icontains`.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX %s ON core_optionvalue '
+        'USING gin (UPPER(value) gin_trgm_ops)' % VALUE_TRIGRAM_INDEX)
+
+
+def drop_value_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS %s' % VALUE_TRIGRAM_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_field_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_value_trigram_index,
+                             drop_value_trigram_index),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.1.3 on 2026-10-19 17:26
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_option_value_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RiskEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tenant', models.CharField(blank=True, default='', max_length=50)),
+                ('event_type', models.CharField(choices=[('risk.created', 'Risk created'), ('risk.deleted', 'Risk deleted'), ('risk_type.deleted', 'Risk type deleted')], max_length=20)),
+                ('endpoint', models.CharField(max_length=50)),
+                ('payload', models.TextField()),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('next_attempt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('failed', models.BooleanField(default=False)),
+                ('last_error', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='riskevent',
+            index=models.Index(fields=['failed', 'next_attempt'], name='core_riskev_failed_d4cd35_idx'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 
 class RiskType(models.Model):
@@ -11,9 +12,20 @@ class RiskType(models.Model):
     E.g. A "Car" risk type can have fields like "Owner name", "Model No.",
     "Purchase Date" etc which are then required to be filled by while
     creating a Risk instance.
+
+    Risk types are owned by a tenant (insurer), see `core.tenancy`.
+
+    `risk_count` is a counter cache of the number of risks of this type.
     """
+    tenant = models.CharField(max_length=50, blank=True, default='')
     name = models.CharField(max_length=50)
     description = models.TextField(blank=True)
+    risk_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['tenant', 'id']),
+        ]
 
     def __str__(self):
         return self.name
@@ -22,16 +34,59 @@ class RiskType(models.Model):
 class Risk(models.Model):
     """
     Data collected on a risk of a given RiskType.
+
+    The tenant of the risk type is copied to the risk so that risks can be
+    looked up by tenant without joining risk types.
+
+    The field values of an archived risk are stored in its `archive`
+    instead of the database, see `core.archive`.
     """
+    tenant = models.CharField(max_length=50, blank=True, default='')
     risk_type = models.ForeignKey(RiskType, related_name="risks",
                                   on_delete=models.CASCADE)
+    # NULL for risks created before creation times were recorded
+    created = models.DateTimeField(default=timezone.now, null=True)
+    archive = models.ForeignKey('RiskArchive', related_name="risks",
+                                on_delete=models.PROTECT,
+                                null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['tenant', 'id']),
+            models.Index(fields=['tenant', 'risk_type', 'id']),
+        ]
 
     def __str__(self):
         return self.risk_type.name
 
 
+class RiskArchive(models.Model):
+    """
+    A compressed batch of archived risks of a risk type.
+
+    `name` is the name of the archive file in the archive storage, see
+    `core.archive`.
+    """
+    tenant = models.CharField(max_length=50, blank=True, default='')
+    risk_type = models.ForeignKey(RiskType, related_name="archives",
+                                  on_delete=models.CASCADE)
+    name = models.CharField(max_length=255)
+    risk_count = models.PositiveIntegerField()
+    created = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return self.name
+
+
 class OptionValue(models.Model):
+    """
+    An option of an enum field.
+
+    `usage_count` is a counter cache of the number of field values which
+    selected this option.
+    """
     value = models.TextField()
+    usage_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.value
@@ -43,6 +98,9 @@ class Field(models.Model):
 
     This essentially defines the data type of a field created by user.
     If the field type is "enum", a list of possible "options" are required.
+
+    The values of a `unique` field can't repeat among the risks of its risk
+    type, see `core.uniqueness`.
     """
 
     TEXT_FIELD = "text"
@@ -65,6 +123,7 @@ class Field(models.Model):
 
     field_type = models.CharField(max_length=10, choices=FIELD_TYPE_CHOICES)
     options = models.ManyToManyField(OptionValue, blank=True)
+    unique = models.BooleanField(default=False)
 
     def __str__(self):
         return self.name
@@ -79,11 +138,17 @@ class FieldValue(models.Model):
 
     A generic "value" attribute is used to represent and populate any type
     of data for simplicity.
+
+    `value_hash` is only set for values of unique fields, it is a hash of
+    the value which is unique per field, see `core.uniqueness`.
     """
+    # Both foreign keys are covered by composite indexes: the unique
+    # (risk, field) index serves reads of the values of a risk in field
+    # order, the (field, risk) index serves scans of the values of a field.
     field = models.ForeignKey(Field, related_name="field_values",
-                              on_delete=models.CASCADE)
+                              on_delete=models.CASCADE, db_index=False)
     risk = models.ForeignKey(Risk, related_name="field_values",
-                             on_delete=models.CASCADE)
+                             on_delete=models.CASCADE, db_index=False)
 
     value_text = models.TextField(blank=True, null=True)
     value_number = models.IntegerField(blank=True, null=True)
@@ -92,9 +157,21 @@ class FieldValue(models.Model):
                                      related_name="field_values",
                                      on_delete=models.CASCADE,
                                      null=True, blank=True)
+    value_hash = models.CharField(max_length=40, null=True, blank=True,
+                                  editable=False)
+
+    class Meta:
+        # NULL hashes never conflict, only values of unique fields are
+        # constrained by the (field, value_hash) index
+        unique_together = (('risk', 'field'), ('field', 'value_hash'))
+        indexes = [
+            # A covering index on PostgreSQL 11+, see migration 0005
+            models.Index(fields=['field', 'risk'],
+                         name='core_fieldvalue_field_risk_idx'),
+        ]
 
     def __str__(self):
-        return self.value
+        return str(self.value)
 
     @property
     def value(self):
@@ -125,3 +202,65 @@ class FieldValue(models.Model):
             Field.ENUM_FIELD: "value_option",
         }
         setattr(self, attr_map[self.field.field_type], data)
+
+
+class IdempotencyKey(models.Model):
+    """
+    Outcome of a create request made with an `Idempotency-Key` header.
+
+    A record without `status_code` is claimed by a request which is still
+    in progress. See `core.idempotency` for details.
+    """
+    tenant = models.CharField(max_length=50, blank=True, default='')
+    key = models.CharField(max_length=255)
+    path = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+
+    status_code = models.PositiveSmallIntegerField(blank=True, null=True)
+    response_body = models.TextField(blank=True)
+
+    created = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        unique_together = ('tenant', 'key', 'path')
+
+    def __str__(self):
+        return self.key
+
+
+class RiskEvent(models.Model):
+    """
+    An event of a risk to deliver to an endpoint, written in the same
+    transaction as the change it reports (a transactional outbox).
+
+    Undelivered events are claimed and delivered by `core.outbox`. Events
+    are deleted once delivered, `failed` events ran out of attempts.
+    """
+    RISK_CREATED = "risk.created"
+    RISK_DELETED = "risk.deleted"
+    RISK_TYPE_DELETED = "risk_type.deleted"
+
+    EVENT_TYPE_CHOICES = (
+        (RISK_CREATED, "Risk created"),
+        (RISK_DELETED, "Risk deleted"),
+        (RISK_TYPE_DELETED, "Risk type deleted"),
+    )
+
+    tenant = models.CharField(max_length=50, blank=True, default='')
+    event_type = models.CharField(max_length=20, choices=EVENT_TYPE_CHOICES)
+    endpoint = models.CharField(max_length=50)
+    payload = models.TextField()
+    created = models.DateTimeField(default=timezone.now)
+
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    failed = models.BooleanField(default=False)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['failed', 'next_attempt']),
+        ]
+
+    def __str__(self):
+        return self.event_type
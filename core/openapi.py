@@ -0,0 +1,181 @@
+"""
+Precomputed and cached OpenAPI schema.
+
+Generating the schema introspects every viewset and serializer, which is
+far too slow to do on every request. The schema document is instead
+generated once per code version: either at deploy time using the
+`generate_openapi_schema` management command, or lazily on first use. It is
+then kept in memory and served with long-lived cache headers and an ETag.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.urls import get_script_prefix, set_script_prefix
+from django.utils.cache import get_conditional_response, patch_cache_control
+from drf_yasg.app_settings import swagger_settings
+from drf_yasg.codecs import OpenAPICodecJson, yaml_sane_dump
+from drf_yasg.renderers import _SpecRenderer
+from drf_yasg.views import get_schema_view
+
+VERSION_KEY = 'x-code-version'
+
+# Packages whose source is fingerprinted when CODE_VERSION is not set
+SOURCE_PACKAGES = ('backend', 'core')
+
+_source_fingerprint = None
+_documents = {}
+_rendered = {}
+_lock = threading.Lock()
+
+
+def get_code_version():
+    """
+    Return the version of the deployed code.
+
+    Uses the `CODE_VERSION` setting if available, otherwise a fingerprint
+    of the project source code is computed (once per process).
+    """
+    global _source_fingerprint
+
+    if settings.CODE_VERSION:
+        return settings.CODE_VERSION
+
+    if _source_fingerprint is None:
+        digest = hashlib.sha1()
+        for package in SOURCE_PACKAGES:
+            root = os.path.join(settings.BASE_DIR, package)
+            for path, dirs, files in sorted(os.walk(root)):
+                dirs.sort()
+                for name in sorted(files):
+                    if not name.endswith('.py'):
+                        continue
+                    digest.update(name.encode('utf-8'))
+                    with open(os.path.join(path, name), 'rb') as source:
+                        digest.update(source.read())
+        _source_fingerprint = digest.hexdigest()[:12]
+    return _source_fingerprint
+
+
+def generate_schema_document(version):
+    """
+    Generate the OpenAPI document of the API as a plain dict.
+
+    The document is request independent: host and schemes are omitted and
+    the base path does not include any script prefix.
+    """
+    generator = swagger_settings.DEFAULT_GENERATOR_CLASS(
+        info=swagger_settings.DEFAULT_INFO, version='')
+
+    script_prefix = get_script_prefix()
+    set_script_prefix('/')
+    try:
+        schema = generator.get_schema(request=None, public=True)
+    finally:
+        set_script_prefix(script_prefix)
+
+    document = json.loads(
+        OpenAPICodecJson(validators=[]).encode(schema).decode('utf-8'),
+        object_pairs_hook=OrderedDict)
+    document[VERSION_KEY] = version
+    return document
+
+
+def load_schema_document(path, version):
+    """
+    Load a document written by `generate_openapi_schema`.
+
+    Returns None if the file does not exist or was generated for a
+    different code version.
+    """
+    try:
+        with open(path, encoding='utf-8') as artifact:
+            document = json.load(artifact, object_pairs_hook=OrderedDict)
+    except FileNotFoundError:
+        return None
+    if document.get(VERSION_KEY) != version:
+        return None
+    return document
+
+
+def get_schema_document():
+    """
+    Return the schema document for the current code version, loading it
+    from the deploy-time artifact or generating it on first use.
+    """
+    version = get_code_version()
+    document = _documents.get(version)
+    if document is None:
+        with _lock:
+            document = _documents.get(version)
+            if document is None:
+                document = load_schema_document(
+                    settings.OPENAPI_SCHEMA_FILE, version)
+                if document is None:
+                    document = generate_schema_document(version)
+                # Documents of older code versions are no longer needed
+                _documents.clear()
+                _rendered.clear()
+                _documents[version] = document
+    return document
+
+
+def render_schema_document(document, format):
+    if format == 'yaml':
+        return yaml_sane_dump(document, binary=True)
+    return json.dumps(document, ensure_ascii=False,
+                      separators=(',', ':')).encode('utf-8')
+
+
+def get_rendered_schema(request, format):
+    """
+    Return the encoded schema document for `request` along with its ETag.
+    """
+    document = get_schema_document()
+    host = request.get_host()
+    base_path = get_script_prefix().rstrip('/') + document['basePath']
+    key = (document[VERSION_KEY], format, request.scheme, host, base_path)
+
+    rendered = _rendered.get(key)
+    if rendered is None:
+        document = OrderedDict(document)
+        document['host'] = host
+        document['schemes'] = [request.scheme]
+        document['basePath'] = base_path
+        content = render_schema_document(document, format)
+        etag = '"%s"' % hashlib.sha1(content).hexdigest()
+        rendered = _rendered[key] = (content, etag)
+    return rendered
+
+
+def get_cached_schema_view(**kwargs):
+    """
+    Create a schema view which serves the cached schema document.
+
+    Accepts the same arguments as drf_yasg's `get_schema_view`.
+    """
+    schema_view = get_schema_view(**kwargs)
+
+    class CachedSchemaView(schema_view):
+
+        def get(self, request, version='', format=None):
+            renderer = request.accepted_renderer
+            # The web UI does not embed the schema, it is fetched separately
+            if not isinstance(renderer, _SpecRenderer):
+                return super().get(request, version, format)
+
+            content, etag = get_rendered_schema(
+                request, 'yaml' if 'yaml' in renderer.format else 'json')
+            response = HttpResponse(content, content_type='%s; charset=%s' % (
+                renderer.media_type, renderer.charset))
+            response['ETag'] = etag
+            patch_cache_control(response, public=True,
+                                max_age=settings.OPENAPI_SCHEMA_MAX_AGE)
+            return get_conditional_response(request, etag=etag,
+                                            response=response)
+
+    return CachedSchemaView
@@ -0,0 +1,237 @@
+"""
+Transactional outbox of risk events delivered to HTTP endpoints.
+
+Creating and deleting risks, and deleting risk types, write one `RiskEvent`
+row per endpoint in `OUTBOX_ENDPOINTS` in the same transaction as the
+change, with a single insert. An event is only recorded when its change is
+committed, and a committed change always has its events, without the
+request waiting on any endpoint.
+
+`./manage.py dispatch_events` claims due events in batches and POSTs their
+JSON payload to their endpoint, with at most `OUTBOX_ENDPOINT_CONCURRENCY`
+requests in flight per endpoint:
+
+- Events are claimed by moving their `next_attempt` past the claim
+  timeout, with `SELECT ... FOR UPDATE SKIP LOCKED` on PostgreSQL, so
+  several dispatchers can run side by side. Events of a dispatcher which
+  died are claimed again once their claim expires.
+- Delivered events, answered with a 2xx status, are deleted.
+- Failed deliveries are retried with exponential backoff and jitter, and
+  marked `failed` after `OUTBOX_MAX_ATTEMPTS` attempts.
+
+Events are delivered at least once and not necessarily in order, endpoints
+should deduplicate them by their `X-Event-Id` header.
+"""
+import http.client
+import json
+import random
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import RiskEvent
+
+# Characters of an error message kept on an event
+MAX_ERROR_LENGTH = 1000
+
+
+def record_event(event_type, tenant, data, using):
+    """
+    Write an event with `data` for every configured endpoint, in the
+    transaction of the change it reports.
+    """
+    endpoints = sorted(settings.OUTBOX_ENDPOINTS)
+    if not endpoints:
+        return []
+    now = timezone.now()
+    payload = json.dumps({
+        'type': event_type,
+        'tenant': tenant,
+        'created': now,
+        'data': data,
+    }, cls=DjangoJSONEncoder, separators=(',', ':'))
+    return RiskEvent.objects.using(using).bulk_create([
+        RiskEvent(tenant=tenant, event_type=event_type, endpoint=endpoint,
+                  payload=payload, created=now, next_attempt=now)
+        for endpoint in endpoints
+    ])
+
+
+def risk_created(risk):
+    record_event(RiskEvent.RISK_CREATED, risk.tenant, {
+        'id': risk.id,
+        'risk_type': risk.risk_type_id,
+    }, risk._state.db)
+
+
+def risk_deleted(risk):
+    record_event(RiskEvent.RISK_DELETED, risk.tenant, {
+        'id': risk.id,
+        'risk_type': risk.risk_type_id,
+    }, risk._state.db)
+
+
+def risk_type_deleted(risk_type):
+    record_event(RiskEvent.RISK_TYPE_DELETED, risk_type.tenant, {
+        'id': risk_type.id,
+    }, risk_type._state.db)
+
+
+def claim_events(batch_size, using='default'):
+    """
+    Claim up to `batch_size` events due for delivery for
+    `OUTBOX_CLAIM_TIMEOUT` seconds.
+    """
+    now = timezone.now()
+    with transaction.atomic(using=using):
+        # Rows locked by another dispatcher are left to it
+        events = list(RiskEvent.objects.using(using)
+                      .select_for_update(skip_locked=True)
+                      .filter(failed=False, next_attempt__lte=now)
+                      .order_by('next_attempt', 'id')[:batch_size])
+        if events:
+            RiskEvent.objects.using(using) \
+                .filter(pk__in=[event.pk for event in events]) \
+                .update(next_attempt=now + timedelta(
+                    seconds=settings.OUTBOX_CLAIM_TIMEOUT))
+    return events
+
+
+def deliver_event(url, event, timeout):
+    """
+    POST the payload of `event` to `url`.
+
+    Returns None when it was delivered, otherwise the error.
+    """
+    try:
+        request = urllib.request.Request(
+            url, data=event.payload.encode('utf-8'), method='POST', headers={
+                'Content-Type': 'application/json',
+                'X-Event-Id': str(event.id),
+                'X-Event-Type': event.event_type,
+            })
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+    except urllib.error.HTTPError as error:
+        return 'HTTP %d %s' % (error.code, error.reason)
+    except (OSError, http.client.HTTPException, ValueError) as error:
+        # ValueError is raised for malformed URLs
+        return '%s: %s' % (type(error).__name__, error)
+    return None
+
+
+def retry_delay(attempts):
+    """
+    Return the seconds to wait before retrying an event which failed
+    `attempts` times: the backoff doubled per attempt, up to the maximum,
+    with jitter so that events which failed together aren't retried
+    together.
+    """
+    delay = min(settings.OUTBOX_RETRY_BACKOFF * 2 ** (attempts - 1),
+                settings.OUTBOX_MAX_RETRY_BACKOFF)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def retry_failed_events(using='default'):
+    """
+    Schedule events which ran out of attempts for delivery again.
+    """
+    return RiskEvent.objects.using(using).filter(failed=True).update(
+        failed=False, attempts=0, next_attempt=timezone.now())
+
+
+class Dispatcher:
+    """
+    Deliver claimed events to their endpoints, with a pool of
+    `concurrency` threads per endpoint.
+
+    Threads only send requests, events are claimed and updated by the
+    calling thread.
+    """
+
+    def __init__(self, endpoints=None, concurrency=None, timeout=None,
+                 using='default'):
+        self.endpoints = settings.OUTBOX_ENDPOINTS \
+            if endpoints is None else endpoints
+        self.concurrency = concurrency or settings.OUTBOX_ENDPOINT_CONCURRENCY
+        self.timeout = timeout or settings.OUTBOX_TIMEOUT
+        self.using = using
+        self.pools = {}
+
+    def get_pool(self, endpoint):
+        if endpoint not in self.pools:
+            self.pools[endpoint] = ThreadPoolExecutor(
+                self.concurrency, thread_name_prefix='outbox-%s' % endpoint)
+        return self.pools[endpoint]
+
+    def dispatch(self, batch_size=None):
+        """
+        Claim a batch of due events and deliver them.
+
+        Returns the number of delivered, retried and failed events.
+        """
+        events = claim_events(batch_size or settings.OUTBOX_BATCH_SIZE,
+                              self.using)
+        deliveries = []
+        for event in events:
+            url = self.endpoints.get(event.endpoint)
+            if url is None:
+                error = 'Endpoint "%s" is not configured.' % event.endpoint
+                deliveries.append((event, None, error))
+            else:
+                deliveries.append((event, self.get_pool(event.endpoint).submit(
+                    deliver_event, url, event, self.timeout), None))
+        return self.record_results([
+            (event, future.result() if future is not None else error)
+            for event, future, error in deliveries
+        ])
+
+    def record_results(self, results):
+        counts = {'delivered': 0, 'retried': 0, 'failed': 0}
+        delivered = [event.pk for event, error in results if error is None]
+        if delivered:
+            RiskEvent.objects.using(self.using).filter(
+                pk__in=delivered).delete()
+            counts['delivered'] = len(delivered)
+
+        now = timezone.now()
+        for event, error in results:
+            if error is None:
+                continue
+            event.attempts += 1
+            event.last_error = error[:MAX_ERROR_LENGTH]
+            if event.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+                event.failed = True
+                counts['failed'] += 1
+            else:
+                event.next_attempt = now + timedelta(
+                    seconds=retry_delay(event.attempts))
+                counts['retried'] += 1
+            event.save(using=self.using, update_fields=[
+                'attempts', 'last_error', 'failed', 'next_attempt'])
+        return counts
+
+    def dispatch_due(self, batch_size=None):
+        """
+        Dispatch batches until no event is due.
+
+        Returns the total number of delivered, retried and failed events.
+        """
+        totals = {'delivered': 0, 'retried': 0, 'failed': 0}
+        while True:
+            counts = self.dispatch(batch_size)
+            if not any(counts.values()):
+                return totals
+            for key, count in counts.items():
+                totals[key] += count
+
+    def close(self):
+        for pool in self.pools.values():
+            pool.shutdown()
+        self.pools = {}
@@ -0,0 +1,168 @@
+"""
+On-demand profiling of single API requests.
+
+A request is profiled when `PROFILING_ENABLED` is set, or when it carries
+an `X-Profile` header with a token signed with the `SECRET_KEY`, which is
+printed by `./manage.py profiling_token`. Every profiled request is run
+under cProfile while a sampler thread records its call stacks, and three
+files named after the profile id are written to `PROFILING_DIR`:
+
+- `<id>.prof`: cProfile stats, readable with `pstats` or snakeviz
+- `<id>.collapsed`: sampled stacks in the collapsed format of
+  flamegraph.pl and speedscope
+- `<id>.txt`: the functions with the highest cumulative time
+
+The profile id is returned in the `X-Profile-Id` response header. Profiles
+which can't be written are logged, the response is returned without the
+header.
+"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core import signing
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_ID_HEADER = 'X-Profile-Id'
+TOKEN_SALT = 'core.profiling'
+
+logger = logging.getLogger(__name__)
+
+
+def make_profiling_token():
+    return signing.dumps('profile', salt=TOKEN_SALT)
+
+
+def is_valid_token(token):
+    try:
+        return signing.loads(token, salt=TOKEN_SALT,
+                             max_age=settings.PROFILING_TOKEN_MAX_AGE) \
+            == 'profile'
+    except signing.BadSignature:
+        return False
+
+
+def should_profile(request):
+    if settings.PROFILING_ENABLED:
+        return True
+    token = request.META.get(PROFILE_HEADER)
+    return bool(token) and is_valid_token(token)
+
+
+def frame_label(code):
+    filename = code.co_filename
+    for prefix in ('site-packages' + os.sep, settings.BASE_DIR + os.sep):
+        if prefix in filename:
+            filename = filename.split(prefix, 1)[1]
+            break
+    return '%s:%s' % (filename, code.co_name)
+
+
+class StackSampler(threading.Thread):
+    """
+    Record the call stack of a thread every `interval` seconds.
+    """
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+class Profile:
+    """
+    Profile the code run in a `with` block of the current thread.
+    """
+
+    def __init__(self, label=''):
+        self.label = label
+        self.id = '%s-%s' % (time.strftime('%Y%m%d-%H%M%S'),
+                             uuid.uuid4().hex[:8])
+        self.profiler = cProfile.Profile()
+        self.sampler = StackSampler(threading.get_ident(),
+                                    settings.PROFILING_SAMPLE_INTERVAL)
+        self.elapsed = None
+
+    def __enter__(self):
+        self.sampler.start()
+        self.started = time.perf_counter()
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.disable()
+        self.elapsed = time.perf_counter() - self.started
+        self.sampler.stop()
+
+    def summary(self, limit=30):
+        out = io.StringIO()
+        out.write('%s\n%.1fms\n\n' % (self.label, self.elapsed * 1000))
+        stats = pstats.Stats(self.profiler, stream=out)
+        stats.sort_stats('cumulative').print_stats(limit)
+        return out.getvalue()
+
+    def save(self, directory=None):
+        """
+        Write the profile files to `directory` and return their paths.
+        """
+        directory = directory or settings.PROFILING_DIR
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self.id)
+
+        paths = [path + '.prof', path + '.collapsed', path + '.txt']
+        self.profiler.dump_stats(paths[0])
+        with open(paths[1], 'w') as collapsed:
+            for stack, count in sorted(self.sampler.stacks.items()):
+                collapsed.write('%s %d\n' % (stack, count))
+        with open(paths[2], 'w') as summary:
+            summary.write(self.summary())
+        return paths
+
+
+class ProfilingMixin:
+    """
+    Profile requests to a viewset on demand.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if not should_profile(request):
+            return super().dispatch(request, *args, **kwargs)
+
+        with Profile('%s %s' % (request.method,
+                                request.get_full_path())) as profile:
+            response = super().dispatch(request, *args, **kwargs)
+            # Include rendering the response body
+            if hasattr(response, 'render'):
+                response.render()
+        try:
+            profile.save()
+        except OSError:
+            logger.exception('Could not save profile %s to %s.', profile.id,
+                             settings.PROFILING_DIR)
+            return response
+        response[PROFILE_ID_HEADER] = profile.id
+        return response
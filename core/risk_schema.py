@@ -0,0 +1,83 @@
+"""
+JSON Schema of the risk payload of a risk type.
+
+Clients validate `POST /api/risks/` payloads against the schema before
+sending them, which catches missing fields, wrongly typed values and
+unknown options without a round trip. The fields of a risk type never
+change, so the schema is compiled once and cached.
+"""
+import hashlib
+import json
+
+from django.db.models import prefetch_related_objects
+
+from core.models import Field
+
+JSON_SCHEMA_DRAFT = 'http://json-schema.org/draft-07/schema#'
+
+
+def build_value_schema(field):
+    """
+    Return the schema of the value of `field`, matching the validation of
+    `FieldValueSerializer`.
+    """
+    if field.field_type == Field.TEXT_FIELD:
+        return {'type': 'string', 'minLength': 1}
+    if field.field_type == Field.NUMBER_FIELD:
+        return {'type': 'integer'}
+    if field.field_type == Field.DATE_FIELD:
+        return {'type': 'string', 'format': 'date'}
+    return {'type': 'integer',
+            'enum': sorted(option.id for option in field.options.all())}
+
+
+def build_risk_schema(risk_type):
+    """
+    Build the JSON Schema of a `POST /api/risks/` payload for `risk_type`.
+
+    Every field must be given exactly once: `values` holds one item per
+    field, and must contain an item for each field id.
+    """
+    fields = list(risk_type.fields.order_by('id'))
+    prefetch_related_objects(fields, 'options')
+
+    items = [{
+        'title': field.name,
+        'type': 'object',
+        'required': ['field_id', 'value'],
+        'properties': {
+            'field_id': {'const': field.id},
+            'value': build_value_schema(field),
+        },
+    } for field in fields]
+
+    return {
+        '$schema': JSON_SCHEMA_DRAFT,
+        'title': risk_type.name,
+        'description': risk_type.description,
+        'type': 'object',
+        'required': ['risk_type', 'values'],
+        'properties': {
+            'risk_type': {'const': risk_type.id},
+            'values': {
+                'type': 'array',
+                'minItems': len(fields),
+                'maxItems': len(fields),
+                'items': {'oneOf': items},
+                'allOf': [
+                    {'contains': {'properties': {
+                        'field_id': {'const': field.id}}}}
+                    for field in fields
+                ],
+            },
+        },
+    }
+
+
+def render_risk_schema(risk_type):
+    """
+    Return the rendered schema of `risk_type` and its strong ETag.
+    """
+    content = json.dumps(build_risk_schema(risk_type),
+                         separators=(',', ':')).encode('utf-8')
+    return content, '"%s"' % hashlib.sha1(content).hexdigest()
@@ -0,0 +1,32 @@
+from core.tenancy import get_tenant_database
+
+
+class TenantRouter:
+    """
+    Route queries on `core` models to the database of the current tenant.
+
+    Large tenants can be placed on their own database alias using the
+    `TENANT_DATABASES` setting, every other tenant shares the default
+    database. All other apps only live in the default database.
+    """
+    app_label = 'core'
+
+    def _db_for(self, model, **hints):
+        if model._meta.app_label != self.app_label:
+            return None
+        # Related objects live in the same database as the instance
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return get_tenant_database()
+
+    def db_for_read(self, model, **hints):
+        return self._db_for(model, **hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db_for(model, **hints)
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label == self.app_label:
+            return True
+        return db == 'default'
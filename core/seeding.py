@@ -0,0 +1,138 @@
+"""
+Helpers to generate sample risk type and risk data.
+
+Used by benchmarking/load-testing tools to build realistic API payloads
+and to seed the database without depending on any existing data.
+"""
+import datetime
+import random
+import string
+
+from django.db import transaction
+from django.db.models import F
+
+from core import cache
+from core.counters import actual_usage_count
+from core.models import Field, FieldValue, OptionValue, Risk, RiskType
+from core.serializers import RiskTypeSerializer
+from core.uniqueness import set_value_hash
+
+# Cycle through all field types so that every validation path is exercised
+FIELD_TYPE_CYCLE = (Field.TEXT_FIELD, Field.NUMBER_FIELD, Field.DATE_FIELD,
+                    Field.ENUM_FIELD)
+
+
+def random_text(length=12, rand=random):
+    return "".join(rand.choice(string.ascii_letters) for _ in range(length))
+
+
+def build_risk_type_payload(num_fields=10, num_options=5, name=None,
+                            rand=random):
+    """
+    Build a `POST /api/risk_types/` payload with `num_fields` fields.
+
+    Field types are assigned in a round-robin fashion and every enum field
+    gets `num_options` options.
+    """
+    fields = []
+    for index in range(num_fields):
+        field_type = FIELD_TYPE_CYCLE[index % len(FIELD_TYPE_CYCLE)]
+        field = {
+            "name": "Field %d" % (index + 1),
+            "field_type": field_type,
+        }
+        if field_type == Field.ENUM_FIELD:
+            field["options"] = [
+                {"value": "Option %d" % (option + 1)}
+                for option in range(num_options)
+            ]
+        fields.append(field)
+
+    return {
+        "name": name or "Sample %s" % random_text(8, rand),
+        "description": "Generated sample risk type",
+        "fields": fields,
+    }
+
+
+def random_field_value(field, rand=random):
+    """
+    Generate a random API value for a serialized field
+    (as returned by `GET /api/risk_types/{id}/`).
+    """
+    field_type = field["field_type"]
+    if field_type == Field.TEXT_FIELD:
+        return random_text(rand=rand)
+    if field_type == Field.NUMBER_FIELD:
+        return rand.randint(0, 1000000)
+    if field_type == Field.DATE_FIELD:
+        date = datetime.date(2000, 1, 1) + datetime.timedelta(
+            days=rand.randint(0, 365 * 20))
+        return date.isoformat()
+    return rand.choice(field["options"])["id"]
+
+
+def build_risk_payload(risk_type, rand=random):
+    """
+    Build a `POST /api/risks/` payload for a serialized risk type.
+    """
+    return {
+        "risk_type": risk_type["id"],
+        "values": [
+            {"field_id": field["id"],
+             "value": random_field_value(field, rand)}
+            for field in risk_type["fields"]
+        ]
+    }
+
+
+def seed_risk_type(num_fields=10, num_options=5, name=None, rand=random):
+    """
+    Create a risk type with generated fields through `RiskTypeSerializer`.
+    """
+    serializer = RiskTypeSerializer(data=build_risk_type_payload(
+        num_fields, num_options, name, rand))
+    serializer.is_valid(raise_exception=True)
+    return serializer.save()
+
+
+@transaction.atomic
+def seed_risks(risk_type, count, batch_size=1000, rand=random):
+    """
+    Bulk insert `count` risks with random values for `risk_type`.
+
+    Bypasses serializer validation to make seeding large data sets fast.
+    """
+    fields = list(risk_type.fields.prefetch_related('options'))
+    options = {field.id: list(field.options.all()) for field in fields}
+
+    created = 0
+    while created < count:
+        size = min(batch_size, count - created)
+        Risk.objects.bulk_create(
+            [Risk(risk_type=risk_type) for _ in range(size)])
+        # Not every backend returns primary keys from bulk inserts,
+        # fetch the ids of the risks that were just created
+        risk_ids = list(risk_type.risks.order_by('-id')
+                        .values_list('id', flat=True)[:size])
+
+        values = []
+        for risk_id in reversed(risk_ids):
+            for field in fields:
+                value = FieldValue(risk_id=risk_id, field=field)
+                if field.field_type == Field.ENUM_FIELD:
+                    value.value = rand.choice(options[field.id])
+                else:
+                    value.value = random_field_value(
+                        {"field_type": field.field_type}, rand)
+                values.append(set_value_hash(value))
+        FieldValue.objects.bulk_create(values)
+        created += size
+
+    # Keep counter caches in sync
+    RiskType.objects.filter(pk=risk_type.pk).update(
+        risk_count=F('risk_count') + created)
+    OptionValue.objects.filter(field__risk_type=risk_type).update(
+        usage_count=actual_usage_count())
+    cache.risk_type_changed(risk_type.pk, risk_type.tenant)
+    return created
@@ -1,33 +1,112 @@
-from django.db import transaction
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, Prefetch, prefetch_related_objects
 from rest_framework import serializers
+from rest_framework.fields import SkipField
+from rest_framework.settings import api_settings
 
+from core import counters, outbox
+from core.bulk import bulk_insert, insert_field_options
 from core.models import Field, RiskType, OptionValue, Risk, FieldValue
+from core.tenancy import get_current_tenant, get_tenant_database
+from core.uniqueness import (duplicate_values_message, find_duplicates,
+                             set_value_hash)
+
+
+class TenantPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Primary key related field which only accepts objects owned by the
+    current tenant.
+
+    `tenant_field` is the lookup from the related model to its tenant.
+    """
+    def __init__(self, tenant_field='tenant', **kwargs):
+        self.tenant_field = tenant_field
+        super().__init__(**kwargs)
+
+    def get_queryset(self):
+        return super().get_queryset().filter(
+            **{self.tenant_field: get_current_tenant()})
+
+
+def parse_pk(data):
+    """
+    Return `data` as a primary key like a lookup by `pk` would, or None.
+    """
+    try:
+        return int(data)
+    except (TypeError, ValueError):
+        return None
+
+
+class ValueFieldRelatedField(TenantPrimaryKeyRelatedField):
+    """
+    Field of a value, looked up among the fields prefetched for all values
+    of a risk by `FieldValueListSerializer` instead of with a query.
+    """
+    def to_internal_value(self, data):
+        fields = getattr(self.parent, 'prefetched_fields', None)
+        if fields is None:
+            return super().to_internal_value(data)
+        try:
+            return fields[int(data)]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
 
 
 class OptionValueSerializer(serializers.ModelSerializer):
     class Meta:
         model = OptionValue
-        fields = ('id', 'value')
+        fields = ('id', 'value', 'usage_count')
+        read_only_fields = ('usage_count',)
         extra_kwargs = {
             'value': {
                 'help_text': 'Option value'
-            }
+            },
+            'usage_count': {
+                'help_text': 'Number of risks which selected this option.'
+            },
         }
 
 
+class InlineOptionsSerializer(serializers.ListSerializer):
+    """
+    Options of a field, left out of the representation of fields with more
+    than `INLINE_OPTIONS_LIMIT` options.
+    """
+    def get_attribute(self, instance):
+        if instance.option_count > settings.INLINE_OPTIONS_LIMIT:
+            raise SkipField()
+        if not instance.option_count:
+            return []
+        return super().get_attribute(instance)
+
+
 class FieldSerializer(serializers.ModelSerializer):
-    options = OptionValueSerializer(many=True, required=False)
+    options = InlineOptionsSerializer(
+        child=OptionValueSerializer(), required=False,
+        help_text='List of available options for this field.'
+                  ' Only Required when field_type is enum. Left out of'
+                  ' fields with many options, see option_count.')
+    option_count = serializers.IntegerField(
+        read_only=True,
+        help_text='Number of options of this field. Options of fields with'
+                  ' many options are served by the options endpoint of'
+                  ' the field.')
 
     class Meta:
         model = Field
-        fields = ('id', 'name', 'description', 'field_type', 'options')
+        fields = ('id', 'name', 'description', 'field_type', 'unique',
+                  'options', 'option_count')
         extra_kwargs = {
             'field_type': {
                 'help_text': 'Data type of value this field supports.'
             },
-            'options': {
-                'help_text': 'List of available options for this field.'
-                             ' Only Required when field_type is enum.'
+            'unique': {
+                'help_text': 'Whether values of this field must be unique'
+                             ' among the risks of the risk type.'
             },
         }
 
@@ -48,11 +127,25 @@ class FieldSerializer(serializers.ModelSerializer):
 
         return data
 
+    def to_representation(self, instance):
+        if not hasattr(instance, 'option_count'):
+            # Not counted by the query which fetched the field, count the
+            # options it comes with
+            prefetch_related_objects([instance], 'options')
+            instance.option_count = len(instance.options.all())
+        return super().to_representation(instance)
+
 
 class RiskTypeListSerializer(serializers.ModelSerializer):
     class Meta:
         model = RiskType
-        fields = ('id', 'name', 'description')
+        fields = ('id', 'name', 'description', 'risk_count')
+        read_only_fields = ('risk_count',)
+        extra_kwargs = {
+            'risk_count': {
+                'help_text': 'Number of risks of this risk type.'
+            }
+        }
 
 
 class RiskTypeSerializer(serializers.ModelSerializer):
@@ -62,25 +155,49 @@ class RiskTypeSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = RiskType
-        fields = ('id', 'name', 'description', 'fields')
+        fields = ('id', 'name', 'description', 'risk_count', 'fields')
+        read_only_fields = ('risk_count',)
+        extra_kwargs = {
+            'risk_count': {
+                'help_text': 'Number of risks of this risk type.'
+            }
+        }
 
-    @transaction.atomic
     def create(self, validated_data):
         fields_data = validated_data.pop('fields', [])
-        risk_type = RiskType.objects.create(**validated_data)
-
-        # create fields one-by-one from the supplied field list
-        for field_data in fields_data:
-            options_data = field_data.pop('options', [])
-            field = Field.objects.create(risk_type=risk_type, **field_data)
-
-            # create field options if any
-            for option_data in options_data:
-                option = OptionValue.objects.create(**option_data)
-                field.options.add(option)
+        using = get_tenant_database()
+
+        with transaction.atomic(using=using):
+            risk_type = RiskType.objects.using(using).create(
+                tenant=get_current_tenant(), **validated_data)
+
+            # Insert fields, options and their relations in bulk, wide
+            # risk types have hundreds of fields and thousands of options.
+            options_data = [field_data.pop('options', [])
+                            for field_data in fields_data]
+            fields = bulk_insert([
+                Field(risk_type=risk_type, **field_data)
+                for field_data in fields_data
+            ], using)
+            insert_field_options(fields, [
+                [option_data['value'] for option_data in field_options]
+                for field_options in options_data
+            ], using)
 
         return risk_type
 
+    def to_representation(self, instance):
+        # Count the options of all fields at once and only fetch those of
+        # fields which aren't too large to inline
+        prefetch_related_objects([instance], Prefetch(
+            'fields', queryset=Field.objects.annotate(
+                option_count=Count('options'))))
+        prefetch_related_objects([
+            field for field in instance.fields.all()
+            if 0 < field.option_count <= settings.INLINE_OPTIONS_LIMIT
+        ], 'options')
+        return super().to_representation(instance)
+
 
 class GenericValueField(serializers.Field):
     """
@@ -102,12 +219,24 @@ class GenericValueField(serializers.Field):
         return {"value": data}
 
 
+class FieldValueListSerializer(serializers.ListSerializer):
+    """
+    Values of a risk, validated against fields and options fetched for all
+    values at once instead of with queries per value.
+    """
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            self.child.prefetch(data)
+        return super().to_internal_value(data)
+
+
 class FieldValueSerializer(serializers.ModelSerializer):
     field = FieldSerializer(
         read_only=True, help_text='Read only list of fields for reference.')
-    field_id = serializers.PrimaryKeyRelatedField(
+    field_id = ValueFieldRelatedField(
         help_text='Primary Key ID of field the value belongs to.',
-        source='field', queryset=Field.objects.all(), required=True)
+        source='field', queryset=Field.objects.all(), required=True,
+        tenant_field='risk_type__tenant')
     value = GenericValueField(
         source="*", help_text='Actual value for the field.'
         ' Returns primary key of option if the field_type is enum.'
@@ -116,6 +245,48 @@ class FieldValueSerializer(serializers.ModelSerializer):
     class Meta:
         model = FieldValue
         fields = ('id', 'field', 'field_id', 'value')
+        list_serializer_class = FieldValueListSerializer
+
+    def prefetch(self, values):
+        """
+        Fetch the fields of `values` with their number of options, and the
+        options selected by enum values, with one query each.
+        """
+        values = [(parse_pk(value.get('field_id')), value.get('value'))
+                  for value in values if isinstance(value, dict)]
+        field_ids = {field_id for field_id, _ in values
+                     if field_id is not None}
+        self.prefetched_fields = {
+            field.id: field for field in self.fields['field_id']
+            .get_queryset().filter(id__in=field_ids)
+            .annotate(option_count=Count('options'))
+        } if field_ids else {}
+
+        selected = set()
+        for field_id, value in values:
+            field = self.prefetched_fields.get(field_id)
+            if field is not None and field.field_type == Field.ENUM_FIELD:
+                # Invalid option keys are reported by validate()
+                try:
+                    selected.add((field.id, serializers.IntegerField()
+                                  .run_validation(value)))
+                except serializers.ValidationError:
+                    continue
+        self.prefetched_options = {}
+        if selected:
+            relations = Field.options.through.objects.filter(
+                field_id__in={field_id for field_id, _ in selected},
+                optionvalue_id__in={option_id for _, option_id in selected},
+            ).select_related('optionvalue')
+            self.prefetched_options = {
+                (relation.field_id, relation.optionvalue_id):
+                    relation.optionvalue for relation in relations}
+
+    def get_option(self, field, option_pk):
+        options = getattr(self, 'prefetched_options', None)
+        if options is None:
+            return field.options.filter(pk=option_pk).first()
+        return options.get((field.id, option_pk))
 
     def validate(self, data):
         field = data["field"]
@@ -145,7 +316,7 @@ class FieldValueSerializer(serializers.ModelSerializer):
                 # Make sure value is a valid integer (i.e. primary key)
                 value_serializer = serializers.IntegerField()
                 option_pk = value_serializer.run_validation(value)
-                selected_option = field.options.filter(pk=option_pk).first()
+                selected_option = self.get_option(field, option_pk)
 
                 if selected_option is None:
                     raise serializers.ValidationError(
@@ -163,7 +334,27 @@ class FieldValueSerializer(serializers.ModelSerializer):
         return data
 
 
+class RiskListSerializer(serializers.ListSerializer):
+    """
+    Risks with their values, the options of the fields inlining them are
+    fetched for all risks at once.
+    """
+    def to_representation(self, data):
+        risks = list(data.all() if isinstance(data, models.Manager) else data)
+        fields = {value.field_id: value.field for risk in risks
+                  for value in risk.field_values.all()}
+        prefetch_related_objects([
+            field for field in fields.values()
+            if 0 < getattr(field, 'option_count', 0) <=
+            settings.INLINE_OPTIONS_LIMIT
+        ], 'options')
+        return super().to_representation(risks)
+
+
 class RiskSerializer(serializers.ModelSerializer):
+    risk_type = TenantPrimaryKeyRelatedField(
+        queryset=RiskType.objects.all(),
+        help_text='Primary key ID of risk_type for this risk.')
     values = FieldValueSerializer(
         source='field_values', many=True, allow_empty=False,
         help_text='List of field_id:value pairs for this risk.'
@@ -172,21 +363,17 @@ class RiskSerializer(serializers.ModelSerializer):
     class Meta:
         model = Risk
         fields = ('id', 'risk_type', 'values')
-        extra_kwargs = {
-            'risk_type': {
-                'help_text': 'Primary key ID of risk_type for this risk.'
-            }
-        }
+        list_serializer_class = RiskListSerializer
 
     def validate(self, data):
         values = data["field_values"]
         field_ids = [value["field"].id for value in values]
 
         # Make sure all fields for this risk type are submitted
-        missed_fields = data["risk_type"].fields.exclude(id__in=field_ids)
-        if missed_fields.exists():
-            field_names = missed_fields.values_list('name', flat=True)
-            field_names = ", ".join(["'%s'" % field for field in field_names])
+        missed_names = list(data["risk_type"].fields.exclude(
+            id__in=field_ids).values_list('name', flat=True))
+        if missed_names:
+            field_names = ", ".join(["'%s'" % name for name in missed_names])
             raise serializers.ValidationError(
                 "All fields are required. %s fields not found." % field_names)
 
@@ -195,13 +382,92 @@ class RiskSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 "Duplicate fields are not allowed.")
 
+        # Check the values of unique fields at once
+        duplicates = find_duplicates(
+            [set_value_hash(FieldValue(**value)) for value in values],
+            get_tenant_database())
+        if duplicates:
+            raise serializers.ValidationError(
+                duplicate_values_message(duplicates))
+
         return data
 
-    @transaction.atomic
     def create(self, validated_data):
         values = validated_data.pop('field_values')
-        risk = Risk.objects.create(**validated_data)
-        # Create field values for risk
-        for value in values:
-            FieldValue.objects.create(risk=risk, **value)
+        using = get_tenant_database()
+
+        try:
+            with transaction.atomic(using=using):
+                risk = Risk.objects.create(
+                    tenant=validated_data['risk_type'].tenant,
+                    **validated_data)
+                # Insert the values of all fields with one statement
+                field_values = bulk_insert([
+                    set_value_hash(FieldValue(risk=risk, **value))
+                    for value in values
+                ], using)
+
+                outbox.risk_created(risk)
+                counters.risk_created(risk, [
+                    value['value_option'].id for value in values
+                    if value.get('value_option') is not None
+                ])
+        except IntegrityError:
+            # A concurrent request may have taken a unique value since
+            # validation, the unique index rejected this one
+            duplicates = find_duplicates(
+                [set_value_hash(FieldValue(**value)) for value in values],
+                using)
+            if not duplicates:
+                raise
+            # Same response as errors of `validate`
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    duplicate_values_message(duplicates)]})
+
+        # Represent the risk with the values and fields at hand, only the
+        # options inlined in the fields are fetched
+        risk._prefetched_objects_cache = {'field_values': field_values}
+        prefetch_related_objects([
+            value.field for value in field_values
+            if 0 < getattr(value.field, 'option_count', 0) <=
+            settings.INLINE_OPTIONS_LIMIT
+        ], 'options')
         return risk
+
+
+class TableParamsSerializer(serializers.Serializer):
+    """
+    Query parameters of the columnar risk table of a risk type.
+    """
+    after = serializers.IntegerField(
+        min_value=0, default=0,
+        help_text='Return risks with an id greater than this id.')
+    limit = serializers.IntegerField(
+        min_value=1, max_value=settings.TABLE_MAX_PAGE_SIZE,
+        default=settings.TABLE_PAGE_SIZE,
+        help_text='Maximum number of risks to return.')
+
+
+class OptionSearchParamsSerializer(serializers.Serializer):
+    """
+    Query parameters of the options search of an enum field.
+    """
+    PREFIX = 'prefix'
+    CONTAINS = 'contains'
+
+    q = serializers.CharField(
+        default='', allow_blank=True, trim_whitespace=False,
+        help_text='Only return options whose value matches this text,'
+                  ' case insensitively.')
+    match = serializers.ChoiceField(
+        choices=(PREFIX, CONTAINS), default=PREFIX,
+        help_text='Match option values starting with q (prefix) or'
+                  ' containing q (contains).')
+    after = serializers.IntegerField(
+        min_value=0, default=0,
+        help_text='Return options with an id greater than this id.')
+    limit = serializers.IntegerField(
+        min_value=1, max_value=settings.OPTIONS_MAX_PAGE_SIZE,
+        default=settings.OPTIONS_PAGE_SIZE,
+        help_text='Maximum number of options to return.')
@@ -0,0 +1,90 @@
+"""
+Chunked JSON streaming of large list responses.
+
+Lists are fetched in primary key ordered chunks (keyset pagination) so only
+one chunk of model instances is held in memory at a time. Every chunk is a
+separate, short query which lets the ASGI entry point run each one in a
+bounded thread pool while slow clients are being served.
+"""
+import json
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.utils import encoders
+
+from core.tenancy import get_current_tenant, tenant_context
+
+
+def render_item(data):
+    return json.dumps(data, cls=encoders.JSONEncoder, ensure_ascii=False,
+                      separators=(',', ':')).encode('utf-8')
+
+
+def fetch_chunk(queryset, serializer_class, after=None, chunk_size=100,
+                context=None):
+    """
+    Fetch and serialize one chunk of objects with a primary key greater
+    than `after`.
+
+    Returns the rendered JSON objects and the primary key of the last
+    object in the chunk.
+    """
+    if after is not None:
+        queryset = queryset.filter(pk__gt=after)
+    objects = list(queryset.order_by('pk')[:chunk_size])
+    if not objects:
+        return [], None
+
+    data = serializer_class(objects, many=True, context=context or {}).data
+    return [render_item(item) for item in data], objects[-1].pk
+
+
+def iter_json_list(queryset, serializer_class, chunk_size=None,
+                   context=None):
+    """
+    Generate a JSON array of serialized objects chunk by chunk.
+
+    Chunks may be fetched from different threads after the request has
+    been processed, so every chunk is fetched on behalf of the tenant that
+    is current when this function is called.
+    """
+    chunk_size = chunk_size or settings.STREAM_CHUNK_SIZE
+    return _iter_json_list(queryset, serializer_class, chunk_size, context,
+                           get_current_tenant())
+
+
+def _iter_json_list(queryset, serializer_class, chunk_size, context, tenant):
+    yield b'['
+    after = None
+    first = True
+    while True:
+        with tenant_context(tenant):
+            items, after = fetch_chunk(queryset, serializer_class, after,
+                                       chunk_size, context)
+        if not items:
+            break
+        if not first:
+            yield b','
+        yield b','.join(items)
+        first = False
+        if len(items) < chunk_size:
+            break
+    yield b']'
+
+
+def streaming_list_response(viewset, request):
+    """
+    Return a `StreamingHttpResponse` of the viewset's queryset rendered as
+    a JSON array.
+    """
+    try:
+        chunk_size = int(request.query_params.get('chunk_size', 0))
+    except ValueError:
+        chunk_size = 0
+    chunk_size = min(max(chunk_size, 0), settings.STREAM_MAX_CHUNK_SIZE)
+
+    queryset = viewset.filter_queryset(viewset.get_queryset())
+    serializer_class = viewset.get_serializer_class()
+    content = iter_json_list(queryset, serializer_class, chunk_size,
+                             viewset.get_serializer_context())
+    return StreamingHttpResponse(content, content_type='application/json')
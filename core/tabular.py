@@ -0,0 +1,81 @@
+"""
+Columnar (tabular) representation of the risks of a risk type.
+
+Instead of one nested object per risk, a page of risks is returned as an
+ordered array of risk ids plus one array of values per field. Values of
+enum fields are dictionary encoded: the column holds indexes into a
+dictionary of the options used on the page.
+
+A page is built from one query on risks (to find the id range of the page)
+and a single scan of field values ordered by `(risk_id, field_id)`.
+"""
+from core.models import Field, FieldValue
+
+
+def build_table(risk_type, after=0, limit=100):
+    """
+    Build a columnar page of at most `limit` risks of `risk_type` with an
+    id greater than `after`. Archived risks are left out.
+
+    Returns the page and whether more risks are available.
+    """
+    risk_ids = list(risk_type.risks.filter(id__gt=after, archive=None)
+                    .order_by('id')
+                    .values_list('id', flat=True)[:limit + 1])
+    has_more = len(risk_ids) > limit
+    risk_ids = risk_ids[:limit]
+
+    fields = list(risk_type.fields.order_by('id'))
+    columns = {}
+    for field in fields:
+        column = {
+            'field_id': field.id,
+            'name': field.name,
+            'field_type': field.field_type,
+            'values': [None] * len(risk_ids),
+        }
+        if field.field_type == Field.ENUM_FIELD:
+            column['dictionary'] = {'ids': [], 'values': []}
+        columns[field.id] = column
+
+    if risk_ids:
+        rows = FieldValue.objects.filter(
+            risk_id__gte=risk_ids[0], risk_id__lte=risk_ids[-1],
+            field_id__in=columns,
+        ).order_by('risk_id', 'field_id').values_list(
+            'risk_id', 'field_id', 'value_text', 'value_number', 'value_date',
+            'value_option_id', 'value_option__value')
+
+        positions = {risk_id: index for index, risk_id in enumerate(risk_ids)}
+        # Option id -> index in the dictionary of each enum column
+        codes = {field_id: {} for field_id, column in columns.items()
+                 if 'dictionary' in column}
+
+        for (risk_id, field_id, text, number, date, option_id,
+             option_value) in rows.iterator():
+            column = columns[field_id]
+            field_type = column['field_type']
+            if field_type == Field.TEXT_FIELD:
+                value = text
+            elif field_type == Field.NUMBER_FIELD:
+                value = number
+            elif field_type == Field.DATE_FIELD:
+                value = date
+            elif option_id is None:
+                value = None
+            else:
+                field_codes = codes[field_id]
+                value = field_codes.get(option_id)
+                if value is None:
+                    value = field_codes[option_id] = len(field_codes)
+                    column['dictionary']['ids'].append(option_id)
+                    column['dictionary']['values'].append(option_value)
+            column['values'][positions[risk_id]] = value
+
+    table = {
+        'risk_type': risk_type.id,
+        'count': len(risk_ids),
+        'risk_ids': risk_ids,
+        'columns': [columns[field.id] for field in fields],
+    }
+    return table, has_more
@@ -0,0 +1,79 @@
+"""
+Request scoped tenant (insurer) resolution.
+
+Every risk type (and through it, every risk) belongs to a tenant. The
+tenant of a request is read from the `X-Tenant` header and stored in a
+thread local, where it is used to scope querysets and to route queries to
+the tenant's database (see `core.routers.TenantRouter`).
+
+Requests without a tenant header use the default, unnamed tenant ("").
+"""
+import re
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.http import JsonResponse
+
+DEFAULT_TENANT = ''
+
+TENANT_RE = re.compile(r'^[a-z0-9_-]{1,50}$')
+
+_state = threading.local()
+
+
+def get_current_tenant():
+    return getattr(_state, 'tenant', DEFAULT_TENANT)
+
+
+def set_current_tenant(tenant):
+    _state.tenant = tenant
+
+
+@contextmanager
+def tenant_context(tenant):
+    """
+    Run a block of code on behalf of `tenant`.
+    """
+    previous = get_current_tenant()
+    set_current_tenant(tenant)
+    try:
+        yield
+    finally:
+        set_current_tenant(previous)
+
+
+def get_tenant_database(tenant=None):
+    """
+    Return the database alias holding the data of `tenant`, defaults to the
+    current tenant.
+    """
+    if tenant is None:
+        tenant = get_current_tenant()
+    return settings.TENANT_DATABASES.get(tenant, 'default')
+
+
+def get_tenant_databases():
+    """
+    Return the aliases of all databases holding tenant data.
+    """
+    return sorted({'default'} | set(settings.TENANT_DATABASES.values()))
+
+
+class TenantMiddleware:
+    """
+    Resolve the tenant of a request from the tenant header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        tenant = request.META.get(settings.TENANT_HEADER, DEFAULT_TENANT)
+        tenant = tenant.strip().lower()
+        if tenant and not TENANT_RE.match(tenant):
+            return JsonResponse({"detail": "Invalid tenant."}, status=400)
+
+        request.tenant = tenant
+        with tenant_context(tenant):
+            return self.get_response(request)
@@ -1,10 +1,56 @@
+import asyncio
+import csv
+import gzip
+import hashlib
 import json
-
-from django.test import TestCase
+import os
+import pstats
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import StringIO
+from socketserver import ThreadingMixIn
+from unittest import mock, skipUnless
+
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.wsgi import get_wsgi_application
+from django.db import DatabaseError, IntegrityError, connection
+from django.db.transaction import TransactionManagementError
+from django.test import (TestCase, LiveServerTestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
-from rest_framework.test import APITestCase
-
-from core.models import RiskType, Field, Risk, FieldValue, OptionValue
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from core import (archive, cache, counters, export, memory, openapi,
+                  outbox, profiling, throttling, uniqueness)
+from core.admin import EstimatedCountPaginator
+from core.asgi import ASGIHandler
+from core.routers import TenantRouter
+from core.loadtest import LoadTest, parse_mix, percentile
+from core.models import (RiskType, Field, Risk, FieldValue, OptionValue,
+                         IdempotencyKey, RiskArchive, RiskEvent)
+from core.seeding import (build_risk_payload, build_risk_type_payload,
+                          seed_risk_type, seed_risks)
+from core.serializers import RiskTypeSerializer
+from core.tenancy import get_current_tenant, tenant_context
+
+
+class ResetStateMixin:
+    """
+    Start every test with an empty representation cache, primary keys are
+    reused between tests, and without any throttling state.
+    """
+
+    def setUp(self):
+        cache.clear()
+        throttling.write_buckets.clear()
+        throttling.load_monitor.reset()
+        super().setUp()
 
 
 class RiskTypeModelTestCase(TestCase):
@@ -144,8 +190,19 @@ class FieldValueModelTestCase(TestCase):
 
         self.assertEqual(field_value.value, field_value.value_option)
 
+    def test_risk_can_have_only_one_value_per_field(self):
+        risk_type = RiskType.objects.create(name="Car")
+        field = Field.objects.create(name="Name", risk_type=risk_type,
+                                     field_type=Field.TEXT_FIELD)
+        risk = Risk.objects.create(risk_type=risk_type)
+        FieldValue.objects.create(field=field, risk=risk, value_text="Honda")
+
+        with self.assertRaises(IntegrityError):
+            FieldValue.objects.create(field=field, risk=risk,
+                                      value_text="Tata")
+
 
-class RiskTypeAPITestCase(APITestCase):
+class RiskTypeAPITestCase(ResetStateMixin, APITestCase):
     def test_risk_type_api_post_works_with_valid_data(self):
         data = {
             "name": "Sample Risk Type",
@@ -208,8 +265,31 @@ class RiskTypeAPITestCase(APITestCase):
         self.assertEqual(field.options.first().value, "Enum Value 1")
         self.assertEqual(field.options.last().value, "Enum Value 2")
 
-
-class RiskAPITestCase(APITestCase):
+    def test_risk_type_api_post_query_count_does_not_grow_with_size(self):
+        def create(num_fields, num_options):
+            data = build_risk_type_payload(num_fields, num_options)
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.post("/api/risk_types/", data,
+                                            format="json")
+            self.assertEqual(response.status_code, 201)
+            return response.json(), len(context.captured_queries)
+
+        _, small = create(num_fields=4, num_options=2)
+        risk_type, large = create(num_fields=40, num_options=50)
+        self.assertEqual(large, small)
+
+        # Options are related to the field they were sent with
+        for field in Field.objects.filter(risk_type=risk_type["id"],
+                                          field_type=Field.ENUM_FIELD):
+            self.assertEqual(
+                list(field.options.order_by("id")
+                     .values_list("value", flat=True)),
+                ["Option %d" % (index + 1) for index in range(50)])
+        options = risk_type["fields"][3]["options"]
+        self.assertEqual(len(options), 50)
+
+
+class RiskAPITestCase(ResetStateMixin, APITestCase):
     def test_risk_api_post_works_with_valid_data(self):
         risk_type = RiskType.objects.create(name="Cars")
         text_field = Field.objects.create(name="Name", risk_type=risk_type,
@@ -448,3 +528,1904 @@ class RiskAPITestCase(APITestCase):
             "non_field_errors": ["Duplicate fields are not allowed."]
         }
         self.assertEqual(json.loads(response.content), expected_error_response)
+
+    def test_risk_api_post_query_count_does_not_grow_with_size(self):
+        def create(num_fields):
+            risk_type = seed_risk_type(num_fields, num_options=5)
+            data = build_risk_payload(RiskTypeSerializer(risk_type).data)
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.post("/api/risks/", data,
+                                            format="json")
+            self.assertEqual(response.status_code, 201)
+            return response.json(), data, len(context.captured_queries)
+
+        _, _, small = create(num_fields=4)
+        risk, data, large = create(num_fields=100)
+        self.assertEqual(large, small)
+
+        # Values are inserted and returned with their fields and options
+        self.assertEqual(len(risk["values"]), 100)
+        self.assertEqual(
+            [(value["field_id"], value["value"]) for value in data["values"]],
+            [(value["field"]["id"], value["value"])
+             for value in risk["values"]])
+        self.assertEqual(len(risk["values"][3]["field"]["options"]), 5)
+        stored = Risk.objects.get(pk=risk["id"]).field_values.order_by("id")
+        self.assertEqual([value["id"] for value in risk["values"]],
+                         [value.id for value in stored])
+        self.assertEqual(self.client.get("/api/risks/%d/" % risk["id"])
+                         .json(), risk)
+
+    def test_risk_api_post_queries(self):
+        risk_type = seed_risk_type(8, num_options=5)
+        data = build_risk_payload(RiskTypeSerializer(risk_type).data)
+        # The risk type, the fields with their option counts, the selected
+        # options and the fields left out, then the risk, its values and
+        # the counters in a savepoint, and the options shown with the
+        # fields. SQLite needs another query for the ids of the values.
+        queries = 11 if connection.features.can_return_ids_from_bulk_insert \
+            else 12
+        with self.assertNumQueries(queries):
+            response = self.client.post("/api/risks/", data, format="json")
+        self.assertEqual(response.status_code, 201)
+
+
+class LoadTestHelpersTestCase(TestCase):
+
+    def test_percentile_uses_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertIsNone(percentile([], 50))
+
+    def test_parse_mix(self):
+        self.assertEqual(parse_mix("read_risk_type=3,list_risks=1"),
+                         {"read_risk_type": 3.0, "list_risks": 1.0})
+        with self.assertRaises(ValueError):
+            parse_mix("unknown=1")
+        with self.assertRaises(ValueError):
+            parse_mix("create_risk=0")
+
+
+class LoadTestLiveServerTestCase(ResetStateMixin, LiveServerTestCase):
+
+    def test_load_test_reports_every_operation(self):
+        load_test = LoadTest(self.live_server_url, clients=1, requests=9,
+                             num_fields=4, num_options=2, seed_risks=1,
+                             mix={"read_risk_type": 1, "create_risk": 1,
+                                  "list_risks": 1})
+        load_test.seed()
+        self.assertEqual(Risk.objects.count(), 1)
+
+        summaries = load_test.run()
+        total = summaries[-1]
+        self.assertEqual(total["endpoint"], "total")
+        self.assertEqual(total["requests"], 9)
+        self.assertEqual(total["errors"], 0)
+
+        load_test.cleanup()
+        self.assertEqual(RiskType.objects.count(), 0)
+
+    def test_load_test_command(self):
+        out = StringIO()
+        call_command("loadtest", url=self.live_server_url, clients=1,
+                     requests=3, fields=2, seed_risks=0, stdout=out)
+        self.assertIn("total", out.getvalue())
+        self.assertEqual(RiskType.objects.count(), 0)
+
+
+class StreamingAPITestCase(ResetStateMixin, APITestCase):
+
+    def test_risk_stream_matches_list(self):
+        risk_type = seed_risk_type(num_fields=4, num_options=2)
+        seed_risks(risk_type, 7)
+
+        response = self.client.get("/api/risks/stream/?chunk_size=3")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        streamed = json.loads(b"".join(response.streaming_content))
+
+        listed = self.client.get("/api/risks/").json()
+        self.assertEqual(streamed, listed)
+
+    def test_risk_type_stream_of_empty_list(self):
+        response = self.client.get("/api/risk_types/stream/")
+        self.assertEqual(json.loads(b"".join(response.streaming_content)), [])
+
+
+class ASGIHandlerTestCase(ResetStateMixin, TransactionTestCase):
+
+    def request(self, method, path, body=b""):
+        handler = ASGIHandler(get_wsgi_application(), max_workers=2)
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": body}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            "type": "http",
+            "method": method,
+            "path": path,
+            "query_string": b"chunk_size=1",
+            "headers": [(b"host", b"testserver"),
+                        (b"content-type", b"application/json")],
+        }
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(handler(scope, receive, send))
+        finally:
+            handler.executor.shutdown(wait=True)
+            loop.close()
+
+        self.assertEqual(messages[0]["type"], "http.response.start")
+        self.assertFalse(messages[-1].get("more_body", False))
+        content = b"".join(message.get("body", b"")
+                           for message in messages[1:])
+        return messages[0]["status"], json.loads(content.decode("utf-8"))
+
+    def test_streaming_response_is_sent_in_chunks(self):
+        RiskType.objects.create(name="Cars")
+        RiskType.objects.create(name="Houses")
+
+        status, content = self.request("GET", "/api/risk_types/stream/")
+        self.assertEqual(status, 200)
+        self.assertEqual([item["name"] for item in content],
+                         ["Cars", "Houses"])
+
+    def test_request_body_is_passed_to_application(self):
+        data = {"name": "Cars",
+                "fields": [{"name": "Name", "field_type": "text"}]}
+        status, content = self.request("POST", "/api/risk_types/",
+                                       json.dumps(data).encode("utf-8"))
+        self.assertEqual(status, 201)
+        self.assertEqual(content["name"], "Cars")
+        self.assertEqual(RiskType.objects.count(), 1)
+
+
+class OpenAPISchemaTestCase(APITestCase):
+
+    def setUp(self):
+        openapi._documents.clear()
+        openapi._rendered.clear()
+
+    def test_schema_is_generated_once_and_cached(self):
+        generator_class = openapi.swagger_settings.DEFAULT_GENERATOR_CLASS
+        get_schema = generator_class.get_schema
+        with override_settings(CODE_VERSION="v1",
+                               OPENAPI_SCHEMA_FILE="/nonexistent.json"), \
+                mock.patch.object(generator_class, "get_schema",
+                                  autospec=True,
+                                  side_effect=get_schema) as generated:
+            response = self.client.get("/docs/?format=openapi")
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("/risk_types/",
+                          json.loads(response.content)["paths"])
+            self.assertIn("max-age=86400", response["Cache-Control"])
+
+            etag = response["ETag"]
+            response = self.client.get("/docs/?format=openapi",
+                                       HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(generated.call_count, 1)
+
+    def test_schema_is_regenerated_when_code_version_changes(self):
+        with override_settings(CODE_VERSION="v1",
+                               OPENAPI_SCHEMA_FILE="/nonexistent.json"):
+            first = self.client.get("/docs/?format=openapi")
+        with override_settings(CODE_VERSION="v2",
+                               OPENAPI_SCHEMA_FILE="/nonexistent.json"):
+            second = self.client.get("/docs/?format=openapi")
+        self.assertEqual(json.loads(second.content)["x-code-version"], "v2")
+        self.assertNotEqual(first["ETag"], second["ETag"])
+
+    def test_schema_artifact_is_served_for_matching_code_version(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "openapi.json")
+            with override_settings(CODE_VERSION="v1",
+                                   OPENAPI_SCHEMA_FILE=path):
+                call_command("generate_openapi_schema", stdout=StringIO())
+                with open(path) as artifact:
+                    document = json.load(artifact)
+                document["info"]["title"] = "From artifact"
+                with open(path, "w") as artifact:
+                    json.dump(document, artifact)
+
+                response = self.client.get("/docs/?format=openapi")
+                self.assertEqual(
+                    json.loads(response.content)["info"]["title"],
+                    "From artifact")
+
+            openapi._documents.clear()
+            with override_settings(CODE_VERSION="v2",
+                                   OPENAPI_SCHEMA_FILE=path):
+                response = self.client.get("/docs/?format=openapi")
+                self.assertEqual(
+                    json.loads(response.content)["info"]["title"],
+                    "Risk Management API")
+
+    def test_swagger_ui_is_served(self):
+        response = self.client.get("/docs/", HTTP_ACCEPT="text/html")
+        self.assertEqual(response.status_code, 200)
+
+
+class TenancyAPITestCase(ResetStateMixin, APITestCase):
+
+    def create_risk_type(self, tenant):
+        data = {"name": "Cars",
+                "fields": [{"name": "Name", "field_type": "text"}]}
+        response = self.client.post("/api/risk_types/", data, format="json",
+                                    HTTP_X_TENANT=tenant)
+        self.assertEqual(response.status_code, 201)
+        return RiskType.objects.get(id=response.json()["id"])
+
+    def test_risk_types_are_isolated_by_tenant(self):
+        risk_type = self.create_risk_type("acme")
+        self.assertEqual(risk_type.tenant, "acme")
+
+        response = self.client.get("/api/risk_types/", HTTP_X_TENANT="acme")
+        self.assertEqual(len(response.json()), 1)
+
+        response = self.client.get("/api/risk_types/")
+        self.assertEqual(response.json(), [])
+        response = self.client.get("/api/risk_types/%d/" % risk_type.id,
+                                   HTTP_X_TENANT="other")
+        self.assertEqual(response.status_code, 404)
+
+    def test_risk_inherits_tenant_of_risk_type(self):
+        risk_type = self.create_risk_type("acme")
+        field = risk_type.fields.get()
+        data = {"risk_type": risk_type.id,
+                "values": [{"field_id": field.id, "value": "Honda"}]}
+
+        response = self.client.post("/api/risks/", data, format="json",
+                                    HTTP_X_TENANT="other")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("risk_type", response.json())
+
+        response = self.client.post("/api/risks/", data, format="json",
+                                    HTTP_X_TENANT="acme")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Risk.objects.get().tenant, "acme")
+
+        response = self.client.get("/api/risks/stream/", HTTP_X_TENANT="acme")
+        self.assertEqual(
+            len(json.loads(b"".join(response.streaming_content))), 1)
+        response = self.client.get("/api/risks/")
+        self.assertEqual(response.json(), [])
+
+    def test_invalid_tenant_is_rejected(self):
+        response = self.client.get("/api/risk_types/",
+                                   HTTP_X_TENANT="not a tenant!")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(get_current_tenant(), "")
+
+
+@override_settings(TENANT_DATABASES={"big-insurer": "shard1"})
+class TenantRouterTestCase(TestCase):
+
+    def test_tenant_database_is_used_for_core_models(self):
+        router = TenantRouter()
+        self.assertEqual(router.db_for_read(Risk), "default")
+        with tenant_context("big-insurer"):
+            self.assertEqual(router.db_for_read(Risk), "shard1")
+            self.assertEqual(router.db_for_write(FieldValue), "shard1")
+            self.assertIsNone(router.db_for_read(get_user_model()))
+        with tenant_context("small-insurer"):
+            self.assertEqual(router.db_for_write(Risk), "default")
+
+    def test_related_objects_use_database_of_instance(self):
+        risk_type = RiskType.objects.create(name="Cars")
+        with tenant_context("big-insurer"):
+            self.assertEqual(
+                TenantRouter().db_for_read(Field, instance=risk_type),
+                "default")
+
+    def test_only_core_models_are_migrated_to_shards(self):
+        router = TenantRouter()
+        self.assertTrue(router.allow_migrate("shard1", "core"))
+        self.assertFalse(router.allow_migrate("shard1", "auth"))
+        self.assertTrue(router.allow_migrate("default", "auth"))
+
+
+class IdempotencyKeyAPITestCase(ResetStateMixin, APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.risk_type = RiskType.objects.create(name="Cars")
+        self.field = Field.objects.create(name="Name",
+                                          risk_type=self.risk_type,
+                                          field_type=Field.TEXT_FIELD)
+        self.data = {"risk_type": self.risk_type.id,
+                     "values": [{"field_id": self.field.id,
+                                 "value": "Honda"}]}
+
+    def post(self, data, key="key-1"):
+        return self.client.post("/api/risks/", data, format="json",
+                                HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_stored_response(self):
+        first = self.post(self.data)
+        self.assertEqual(first.status_code, 201)
+
+        with self.assertNumQueries(1):
+            second = self.post(self.data)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+        self.assertEqual(Risk.objects.count(), 1)
+
+        # Keys are scoped to the endpoint
+        data = {"name": "Houses",
+                "fields": [{"name": "Address", "field_type": "text"}]}
+        response = self.client.post("/api/risk_types/", data, format="json",
+                                    HTTP_IDEMPOTENCY_KEY="key-1")
+        self.assertEqual(response.status_code, 201)
+
+    def test_key_reused_with_different_payload(self):
+        self.post(self.data)
+        self.data["values"][0]["value"] = "Toyota"
+        response = self.post(self.data)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Risk.objects.count(), 1)
+
+    def test_key_of_request_in_progress(self):
+        self.post(self.data)
+        IdempotencyKey.objects.update(status_code=None)
+
+        response = self.post(self.data)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response["Retry-After"], "1")
+
+    @override_settings(IDEMPOTENCY_LOCK_TIMEOUT=60)
+    def test_abandoned_key_can_be_claimed_again(self):
+        self.post(self.data)
+        IdempotencyKey.objects.update(
+            status_code=None,
+            created=timezone.now() - timedelta(seconds=61))
+
+        response = self.post(self.data)
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn("Idempotent-Replayed", response)
+
+    @override_settings(IDEMPOTENCY_KEY_TTL=60)
+    def test_expired_keys(self):
+        self.post(self.data)
+        IdempotencyKey.objects.update(
+            created=timezone.now() - timedelta(seconds=61))
+
+        response = self.post(self.data)
+        self.assertNotIn("Idempotent-Replayed", response)
+        self.assertEqual(Risk.objects.count(), 2)
+
+        IdempotencyKey.objects.update(
+            created=timezone.now() - timedelta(seconds=61))
+        out = StringIO()
+        call_command("purge_idempotency_keys", stdout=out)
+        self.assertIn("Deleted 1 ", out.getvalue())
+
+    def test_keys_are_purged_from_every_tenant_database(self):
+        with override_settings(TENANT_DATABASES={"big-insurer": "shard1",
+                                                 "other": "shard1"}), \
+                mock.patch("core.management.commands.purge_idempotency_keys"
+                           ".purge_expired_keys", return_value=0) as purge:
+            call_command("purge_idempotency_keys", stdout=StringIO())
+            self.assertEqual(purge.call_args_list,
+                             [mock.call("default"), mock.call("shard1")])
+
+            purge.reset_mock()
+            call_command("purge_idempotency_keys", databases=["shard1"],
+                         stdout=StringIO())
+            self.assertEqual(purge.call_args_list, [mock.call("shard1")])
+
+    def test_failed_request_releases_key(self):
+        response = self.post({"risk_type": self.risk_type.id, "values": []})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        response = self.post(self.data)
+        self.assertEqual(response.status_code, 201)
+
+
+class RiskTypeTableAPITestCase(ResetStateMixin, APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.risk_type = RiskType.objects.create(name="Cars")
+        self.text_field = Field.objects.create(
+            name="Name", risk_type=self.risk_type,
+            field_type=Field.TEXT_FIELD)
+        self.date_field = Field.objects.create(
+            name="Purchase date", risk_type=self.risk_type,
+            field_type=Field.DATE_FIELD)
+        self.enum_field = Field.objects.create(
+            name="Car Type", risk_type=self.risk_type,
+            field_type=Field.ENUM_FIELD)
+        self.sedan = OptionValue.objects.create(value="Sedan")
+        self.suv = OptionValue.objects.create(value="SUV")
+        self.enum_field.options.add(self.sedan, self.suv)
+
+        self.risks = []
+        for name, option in (("Honda", self.suv), ("Kia", self.sedan),
+                             ("Ford", self.suv)):
+            risk = Risk.objects.create(risk_type=self.risk_type)
+            FieldValue.objects.create(risk=risk, field=self.text_field,
+                                      value_text=name)
+            FieldValue.objects.create(risk=risk, field=self.date_field,
+                                      value_date="2018-11-10")
+            FieldValue.objects.create(risk=risk, field=self.enum_field,
+                                      value_option=option)
+            self.risks.append(risk)
+
+    def test_table_returns_columns_per_field(self):
+        with self.assertNumQueries(4):
+            response = self.client.get(
+                "/api/risk_types/%d/table/" % self.risk_type.id)
+        self.assertEqual(response.status_code, 200)
+
+        table = response.json()
+        self.assertEqual(table["risk_ids"], [risk.id for risk in self.risks])
+        self.assertIsNone(table["next"])
+
+        text, date, enum = table["columns"]
+        self.assertEqual(text["field_id"], self.text_field.id)
+        self.assertEqual(text["values"], ["Honda", "Kia", "Ford"])
+        self.assertEqual(date["values"], ["2018-11-10"] * 3)
+        self.assertEqual(enum["values"], [0, 1, 0])
+        self.assertEqual(enum["dictionary"], {
+            "ids": [self.suv.id, self.sedan.id],
+            "values": ["SUV", "Sedan"],
+        })
+
+    def test_table_is_paginated_by_risk_id(self):
+        url = "/api/risk_types/%d/table/" % self.risk_type.id
+        table = self.client.get(url, {"limit": 2}).json()
+        self.assertEqual(table["risk_ids"],
+                         [risk.id for risk in self.risks[:2]])
+        self.assertIn("after=%d" % self.risks[1].id, table["next"])
+
+        table = self.client.get(table["next"]).json()
+        self.assertEqual(table["risk_ids"], [self.risks[2].id])
+        self.assertEqual(table["columns"][0]["values"], ["Ford"])
+        self.assertEqual(table["columns"][2]["dictionary"]["values"],
+                         ["SUV"])
+        self.assertIsNone(table["next"])
+
+    def test_table_validates_parameters(self):
+        response = self.client.get(
+            "/api/risk_types/%d/table/" % self.risk_type.id, {"limit": 0})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("limit", response.json())
+
+
+class CounterCacheTestCase(ResetStateMixin, APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.risk_type = RiskType.objects.create(name="Cars")
+        self.field = Field.objects.create(name="Car Type",
+                                          risk_type=self.risk_type,
+                                          field_type=Field.ENUM_FIELD)
+        self.sedan = OptionValue.objects.create(value="Sedan")
+        self.suv = OptionValue.objects.create(value="SUV")
+        self.field.options.add(self.sedan, self.suv)
+
+    def create_risk(self, option):
+        data = {"risk_type": self.risk_type.id,
+                "values": [{"field_id": self.field.id, "value": option.id}]}
+        response = self.client.post("/api/risks/", data, format="json")
+        self.assertEqual(response.status_code, 201)
+        return response.json()["id"]
+
+    def test_counters_are_updated_on_create_and_delete(self):
+        first = self.create_risk(self.suv)
+        self.create_risk(self.suv)
+        self.create_risk(self.sedan)
+
+        response = self.client.get("/api/risk_types/")
+        self.assertEqual(response.json()[0]["risk_count"], 3)
+        response = self.client.get("/api/risk_types/%d/" % self.risk_type.id)
+        self.assertEqual(response.json()["risk_count"], 3)
+        options = response.json()["fields"][0]["options"]
+        self.assertEqual([option["usage_count"] for option in options],
+                         [1, 2])
+
+        self.client.delete("/api/risks/%d/" % first)
+        self.risk_type.refresh_from_db()
+        self.suv.refresh_from_db()
+        self.assertEqual(self.risk_type.risk_count, 2)
+        self.assertEqual(self.suv.usage_count, 1)
+
+        self.client.delete("/api/risk_types/%d/" % self.risk_type.id)
+        self.suv.refresh_from_db()
+        self.assertEqual(self.suv.usage_count, 0)
+
+    def test_reconcile_counters_fixes_drift(self):
+        self.create_risk(self.suv)
+        RiskType.objects.update(risk_count=10)
+        OptionValue.objects.filter(pk=self.sedan.pk).update(usage_count=4)
+
+        out = StringIO()
+        call_command("reconcile_counters", dry_run=True, stdout=out)
+        self.assertIn("Found 1 drifted risk type counters", out.getvalue())
+        self.risk_type.refresh_from_db()
+        self.assertEqual(self.risk_type.risk_count, 10)
+
+        out = StringIO()
+        call_command("reconcile_counters", stdout=out)
+        self.assertIn("Fixed 1 drifted option counters: [%d]" % self.sedan.id,
+                      out.getvalue())
+        self.risk_type.refresh_from_db()
+        self.sedan.refresh_from_db()
+        self.suv.refresh_from_db()
+        self.assertEqual(self.risk_type.risk_count, 1)
+        self.assertEqual(self.sedan.usage_count, 0)
+        self.assertEqual(self.suv.usage_count, 1)
+
+
+@override_settings(REPRESENTATION_CACHE_ALLOW_LOCAL_MEMORY=True)
+class RepresentationCacheTestCase(ResetStateMixin, APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.risk_type = RiskType.objects.create(name="Cars")
+        self.field = Field.objects.create(name="Car Type",
+                                          risk_type=self.risk_type,
+                                          field_type=Field.ENUM_FIELD)
+        self.sedan = OptionValue.objects.create(value="Sedan")
+        self.field.options.add(self.sedan)
+
+    def create_risk(self):
+        data = {"risk_type": self.risk_type.id,
+                "values": [{"field_id": self.field.id,
+                            "value": self.sedan.id}]}
+        response = self.client.post("/api/risks/", data, format="json")
+        self.assertEqual(response.status_code, 201)
+        return response.json()["id"]
+
+    def test_retrieve_is_served_from_cache(self):
+        risk_id = self.create_risk()
+        for path in ("/api/risks/%d/" % risk_id,
+                     "/api/risk_types/%d/" % self.risk_type.id,
+                     "/api/risk_types/"):
+            first = self.client.get(path)
+            with self.assertNumQueries(0):
+                second = self.client.get(path)
+            self.assertEqual(second.json(), first.json())
+
+    def test_local_memory_backend_is_not_used_by_default(self):
+        risk_id = self.create_risk()
+        path = "/api/risks/%d/" % risk_id
+        with override_settings(REPRESENTATION_CACHE_ALLOW_LOCAL_MEMORY=False):
+            self.client.get(path)
+            with CaptureQueriesContext(connection) as context:
+                self.client.get(path)
+        self.assertTrue(context.captured_queries)
+        self.assertEqual(len(cache.local_cache), 0)
+
+    def test_shared_tier_is_used_when_local_tier_misses(self):
+        path = "/api/risk_types/%d/" % self.risk_type.id
+        self.client.get(path)
+        cache.local_cache.clear()
+        with self.assertNumQueries(0):
+            response = self.client.get(path)
+        self.assertEqual(response.json()["name"], "Cars")
+
+    def test_risk_create_invalidates_risk_type_representations(self):
+        first = self.create_risk()
+        self.client.get("/api/risks/%d/" % first)
+        self.client.get("/api/risk_types/")
+        self.client.get("/api/risk_types/%d/" % self.risk_type.id)
+
+        self.create_risk()
+        response = self.client.get("/api/risks/%d/" % first)
+        option = response.json()["values"][0]["field"]["options"][0]
+        self.assertEqual(option["usage_count"], 2)
+        response = self.client.get("/api/risk_types/")
+        self.assertEqual(response.json()[0]["risk_count"], 2)
+        response = self.client.get("/api/risk_types/%d/" % self.risk_type.id)
+        self.assertEqual(response.json()["risk_count"], 2)
+
+    def test_destroy_invalidates_cache(self):
+        risk_id = self.create_risk()
+        self.client.get("/api/risks/%d/" % risk_id)
+        self.client.get("/api/risk_types/%d/" % self.risk_type.id)
+
+        self.client.delete("/api/risks/%d/" % risk_id)
+        response = self.client.get("/api/risks/%d/" % risk_id)
+        self.assertEqual(response.status_code, 404)
+
+        self.client.delete("/api/risk_types/%d/" % self.risk_type.id)
+        response = self.client.get("/api/risk_types/%d/" % self.risk_type.id)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.client.get("/api/risk_types/").json(), [])
+
+    def test_bumped_generation_invalidates_local_tier(self):
+        path = "/api/risk_types/%d/" % self.risk_type.id
+        self.client.get(path)
+        RiskType.objects.filter(pk=self.risk_type.pk).update(name="Trucks")
+
+        # As if another process created a risk of the type
+        cache.bump_generation(cache.risk_type_generation(self.risk_type.id))
+        self.assertEqual(self.client.get(path).json()["name"], "Trucks")
+
+    def test_cache_is_isolated_by_tenant(self):
+        path = "/api/risk_types/%d/" % self.risk_type.id
+        self.client.get(path)
+        response = self.client.get(path, HTTP_X_TENANT="acme")
+        self.assertEqual(response.status_code, 404)
+
+    def test_concurrent_misses_render_once(self):
+        rendered = []
+
+        def render():
+            time.sleep(0.2)
+            rendered.append(True)
+            return {"value": 1}
+
+        def load():
+            return [cache.risk_type_list_generation()], render
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            cache.read_through("stampede", load))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [{"value": 1}] * 5)
+        self.assertEqual(len(rendered), 1)
+
+    def test_local_tier_evicts_least_recently_used(self):
+        local = cache.LocalLRUCache(max_size=2)
+        local.set("a", 1)
+        local.set("b", 2)
+        local.get("a")
+        local.set("c", 3)
+        self.assertIsNone(local.get("b"))
+        self.assertEqual(local.get("a"), 1)
+        self.assertEqual(local.get("c"), 3)
+
+
+class ThrottlingAPITestCase(ResetStateMixin, APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.data = {"name": "Cars",
+                     "fields": [{"name": "Name", "field_type": "text"}]}
+
+    @override_settings(WRITE_THROTTLE_RATE=0.01, WRITE_THROTTLE_BURST=2)
+    def test_writes_are_rate_limited_per_client(self):
+        for _ in range(2):
+            response = self.client.post("/api/risk_types/", self.data,
+                                        format="json")
+            self.assertEqual(response.status_code, 201)
+
+        with self.assertNumQueries(0):
+            response = self.client.post("/api/risk_types/", self.data,
+                                        format="json")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "100")
+
+        # Reads and other clients are not limited
+        self.assertEqual(self.client.get("/api/risk_types/").status_code, 200)
+        response = self.client.post("/api/risk_types/", self.data,
+                                    format="json", REMOTE_ADDR="10.0.0.2")
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post("/api/risk_types/", self.data,
+                                    format="json", HTTP_X_TENANT="acme")
+        self.assertEqual(response.status_code, 201)
+
+    def test_token_bucket_refills(self):
+        bucket = throttling.TokenBucket(capacity=1)
+        self.assertEqual(bucket.consume(rate=10, capacity=1), 0)
+        self.assertAlmostEqual(bucket.consume(rate=10, capacity=1), 0.1,
+                               places=2)
+        bucket.updated -= 0.1
+        self.assertEqual(bucket.consume(rate=10, capacity=1), 0)
+
+    @override_settings(LOAD_SHEDDING_MAX_IN_FLIGHT=1)
+    def test_expensive_reads_are_shed_when_too_many_requests_in_flight(self):
+        risk_type = RiskType.objects.create(name="Cars")
+        throttling.load_monitor.request_started()
+        try:
+            with self.assertNumQueries(0):
+                response = self.client.get("/api/risk_types/")
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response["Retry-After"], "5")
+            for path in ("/api/risks/", "/api/risks/stream/",
+                         "/api/risk_types/%d/table/" % risk_type.id):
+                self.assertEqual(self.client.get(path).status_code, 503)
+
+            # Cheap reads and writes are still served
+            response = self.client.get("/api/risk_types/%d/" % risk_type.id)
+            self.assertEqual(response.status_code, 200)
+        finally:
+            throttling.load_monitor.request_finished()
+
+        self.assertEqual(self.client.get("/api/risk_types/").status_code, 200)
+
+    @override_settings(LOAD_SHEDDING_MAX_DB_LATENCY=100,
+                       LOAD_SHEDDING_WINDOW=10)
+    def test_expensive_reads_are_shed_when_database_is_slow(self):
+        throttling.load_monitor.record_query(0.5)
+        self.assertEqual(self.client.get("/api/risks/").status_code, 503)
+
+        # Old samples leave the window
+        throttling.load_monitor._samples[0] = (0, 0.5)
+        self.assertEqual(self.client.get("/api/risks/").status_code, 200)
+
+    def test_queries_of_requests_are_timed(self):
+        self.client.get("/api/risk_types/")
+        self.assertTrue(throttling.load_monitor._samples)
+        self.assertEqual(throttling.load_monitor.in_flight, 0)
+
+
+class RiskArchiveTestCase(ResetStateMixin, APITransactionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        storage_settings = override_settings(
+            ARCHIVE_STORAGE_OPTIONS={"location": directory.name})
+        storage_settings.enable()
+        self.addCleanup(storage_settings.disable)
+        self.storage = archive.get_archive_storage()
+
+        self.risk_type = seed_risk_type(num_fields=4, num_options=3)
+        seed_risks(self.risk_type, 5)
+        self.risk_ids = list(self.risk_type.risks.order_by("id")
+                             .values_list("id", flat=True))
+        # The first three risks are old
+        Risk.objects.filter(pk__in=self.risk_ids[:3]).update(
+            created=timezone.now() - timedelta(days=400))
+
+    def archive(self, **options):
+        out = StringIO()
+        call_command("archive_risks", older_than=365, batch_size=2,
+                     stdout=out, **options)
+        return out.getvalue()
+
+    def get_risk(self, risk_id):
+        cache.clear()
+        response = self.client.get("/api/risks/%d/" % risk_id)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_old_risks_are_archived_in_batches(self):
+        before = [self.get_risk(risk_id) for risk_id in self.risk_ids]
+
+        self.assertIn("Archived 3 risks in 2 archives.", self.archive())
+        self.assertFalse(FieldValue.objects.filter(
+            risk_id__in=self.risk_ids[:3]).exists())
+        self.assertEqual(FieldValue.objects.filter(
+            risk_id__in=self.risk_ids[3:]).count(), 8)
+        for risk_archive in RiskArchive.objects.all():
+            self.assertTrue(self.storage.exists(risk_archive.name))
+            self.assertTrue(risk_archive.name.endswith(".json.gz"))
+
+        # Archived risks are retrieved transparently
+        after = [self.get_risk(risk_id) for risk_id in self.risk_ids]
+        self.assertEqual(after, before)
+
+        # and left out of lists and tables
+        response = self.client.get("/api/risks/")
+        self.assertEqual([risk["id"] for risk in response.json()],
+                         self.risk_ids[3:])
+        response = self.client.get(
+            "/api/risk_types/%d/table/" % self.risk_type.id)
+        self.assertEqual(response.json()["risk_ids"], self.risk_ids[3:])
+
+        # Nothing left to archive
+        self.assertIn("Archived 0 risks in 0 archives.", self.archive())
+
+    def test_risks_without_creation_time_are_archived(self):
+        # Risks created before creation times were recorded
+        Risk.objects.filter(pk=self.risk_ids[3]).update(created=None)
+        self.assertIn("Archived 4 risks", self.archive())
+        live = Risk.objects.filter(archive=None).values_list("id", flat=True)
+        self.assertEqual(list(live), self.risk_ids[4:])
+
+    def test_archive_policy_filters_risk_types(self):
+        other = seed_risk_type(num_fields=2)
+        seed_risks(other, 2)
+        Risk.objects.update(created=timezone.now() - timedelta(days=400))
+
+        self.assertIn("Archived 2 risks in 1 archives.",
+                      self.archive(risk_types=[other.id]))
+        self.assertFalse(Risk.objects.filter(
+            risk_type=self.risk_type).exclude(archive=None).exists())
+
+    def test_restore_risks(self):
+        before = [self.get_risk(risk_id) for risk_id in self.risk_ids]
+        self.archive()
+        first, second = RiskArchive.objects.order_by("id")
+
+        out = StringIO()
+        call_command("restore_risks", risks=[self.risk_ids[2]], stdout=out)
+        self.assertIn("Restored 1 risks.", out.getvalue())
+        self.assertFalse(RiskArchive.objects.filter(pk=second.pk).exists())
+        self.assertFalse(self.storage.exists(second.name))
+
+        call_command("restore_risks", archives=[first.id], stdout=StringIO())
+        self.assertFalse(RiskArchive.objects.exists())
+        self.assertFalse(Risk.objects.exclude(archive=None).exists())
+        self.assertEqual(FieldValue.objects.count(), 20)
+
+        after = [self.get_risk(risk_id) for risk_id in self.risk_ids]
+        self.assertEqual(after, before)
+
+    def test_restore_risks_hashes_unique_values(self):
+        text_field = self.risk_type.fields.get(field_type=Field.TEXT_FIELD)
+        Field.objects.filter(pk=text_field.pk).update(unique=True)
+        for value in FieldValue.objects.filter(field=text_field) \
+                .select_related("field"):
+            uniqueness.set_value_hash(value).save()
+        hashes = set(FieldValue.objects.exclude(value_hash=None)
+                     .values_list("risk_id", "value_hash"))
+        self.assertEqual(len(hashes), 5)
+
+        self.archive()
+        call_command("restore_risks", risk_types=[self.risk_type.id],
+                     stdout=StringIO())
+        self.assertEqual(set(FieldValue.objects.exclude(value_hash=None)
+                             .values_list("risk_id", "value_hash")), hashes)
+
+    def test_destroy_archived_risk_updates_counters(self):
+        self.archive()
+        usage = sum(OptionValue.objects.values_list("usage_count", flat=True))
+        option_ids = [value["value"] for value in
+                      self.get_risk(self.risk_ids[0])["values"]
+                      if value["field"]["field_type"] == Field.ENUM_FIELD]
+
+        response = self.client.delete("/api/risks/%d/" % self.risk_ids[0])
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(
+            sum(OptionValue.objects.values_list("usage_count", flat=True)),
+            usage - len(option_ids))
+
+    def test_reconcile_counts_archived_values(self):
+        self.archive()
+        self.client.delete("/api/risks/%d/" % self.risk_ids[0])
+        call_command("restore_risks", risks=[self.risk_ids[1]],
+                     stdout=StringIO())
+        self.assertEqual(counters.reconcile_counters(dry_run=True),
+                         ([], []))
+
+        usage = dict(OptionValue.objects.values_list("id", "usage_count"))
+        OptionValue.objects.update(usage_count=0)
+        counters.reconcile_counters()
+        self.assertEqual(
+            dict(OptionValue.objects.values_list("id", "usage_count")), usage)
+
+    def test_destroy_risk_type_deletes_archives(self):
+        self.archive()
+        names = list(RiskArchive.objects.values_list("name", flat=True))
+
+        response = self.client.delete(
+            "/api/risk_types/%d/" % self.risk_type.id)
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(RiskArchive.objects.exists())
+        for name in names:
+            self.assertFalse(self.storage.exists(name))
+
+
+class ProfilingAPITestCase(ResetStateMixin, APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        profiling_settings = override_settings(PROFILING_DIR=self.directory)
+        profiling_settings.enable()
+        self.addCleanup(profiling_settings.disable)
+
+        self.risk_type = seed_risk_type(num_fields=4)
+        self.path = "/api/risk_types/%d/" % self.risk_type.id
+
+    def assertProfiled(self, response):
+        profile_id = response[profiling.PROFILE_ID_HEADER]
+        path = os.path.join(self.directory, profile_id)
+
+        stats = pstats.Stats(path + ".prof")
+        self.assertTrue(any(function == "retrieve"
+                            for _, _, function in stats.stats))
+        with open(path + ".collapsed") as collapsed:
+            lines = collapsed.read().splitlines()
+        for line in lines:
+            stack, count = line.rsplit(" ", 1)
+            self.assertGreater(int(count), 0)
+            self.assertIn(";", stack)
+        with open(path + ".txt") as summary:
+            self.assertIn("GET %s" % self.path, summary.read())
+
+    def test_requests_are_not_profiled_by_default(self):
+        response = self.client.get(self.path)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(profiling.PROFILE_ID_HEADER, response)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_requests_with_signed_header_are_profiled(self):
+        response = self.client.get(
+            self.path, HTTP_X_PROFILE=profiling.make_profiling_token())
+        self.assertEqual(response.status_code, 200)
+        self.assertProfiled(response)
+
+    def test_invalid_and_expired_tokens_are_ignored(self):
+        response = self.client.get(self.path, HTTP_X_PROFILE="profile")
+        self.assertNotIn(profiling.PROFILE_ID_HEADER, response)
+
+        token = profiling.make_profiling_token()
+        with override_settings(PROFILING_TOKEN_MAX_AGE=-1):
+            response = self.client.get(self.path, HTTP_X_PROFILE=token)
+        self.assertNotIn(profiling.PROFILE_ID_HEADER, response)
+
+    @override_settings(PROFILING_ENABLED=True)
+    def test_every_request_is_profiled_when_enabled(self):
+        self.assertProfiled(self.client.get(self.path))
+
+    def test_unwritable_directory_keeps_response(self):
+        path = os.path.join(self.directory, "file")
+        open(path, "w").close()
+        with override_settings(PROFILING_DIR=os.path.join(path, "profiles")), \
+                self.assertLogs("core.profiling", "ERROR"):
+            response = self.client.get(
+                self.path, HTTP_X_PROFILE=profiling.make_profiling_token())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["id"], self.risk_type.id)
+        self.assertNotIn(profiling.PROFILE_ID_HEADER, response)
+
+    def test_profile_endpoint_command(self):
+        out = StringIO()
+        call_command("profile_endpoint", "/api/risks/{risk}/", risks=3,
+                     output=self.directory, stdout=out)
+        self.assertIn(": 200", out.getvalue())
+        self.assertEqual(
+            sorted(name.rsplit(".", 1)[1]
+                   for name in os.listdir(self.directory)),
+            ["collapsed", "prof", "txt"])
+        # Seeded data is rolled back
+        self.assertFalse(Risk.objects.exists())
+
+
+@override_settings(REPRESENTATION_CACHE_ALLOW_LOCAL_MEMORY=True)
+class RiskTypeSchemaAPITestCase(ResetStateMixin, APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.risk_type = RiskType.objects.create(name="Cars")
+        self.text_field = Field.objects.create(
+            name="Name", risk_type=self.risk_type,
+            field_type=Field.TEXT_FIELD)
+        self.number_field = Field.objects.create(
+            name="Seats", risk_type=self.risk_type,
+            field_type=Field.NUMBER_FIELD)
+        self.date_field = Field.objects.create(
+            name="Purchase date", risk_type=self.risk_type,
+            field_type=Field.DATE_FIELD)
+        self.enum_field = Field.objects.create(
+            name="Car Type", risk_type=self.risk_type,
+            field_type=Field.ENUM_FIELD)
+        self.sedan = OptionValue.objects.create(value="Sedan")
+        self.suv = OptionValue.objects.create(value="SUV")
+        self.enum_field.options.add(self.sedan, self.suv)
+        self.url = "/api/risk_types/%d/schema/" % self.risk_type.id
+
+    def test_schema_describes_risk_payload(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/json")
+
+        schema = response.json()
+        self.assertEqual(schema["required"], ["risk_type", "values"])
+        self.assertEqual(schema["properties"]["risk_type"],
+                         {"const": self.risk_type.id})
+
+        values = schema["properties"]["values"]
+        self.assertEqual(values["minItems"], 4)
+        self.assertEqual(values["maxItems"], 4)
+        self.assertEqual(
+            [item["properties"]["field_id"]["const"]
+             for item in values["items"]["oneOf"]],
+            [self.text_field.id, self.number_field.id, self.date_field.id,
+             self.enum_field.id])
+        self.assertEqual(
+            [item["properties"]["value"] for item in values["items"]["oneOf"]],
+            [{"type": "string", "minLength": 1},
+             {"type": "integer"},
+             {"type": "string", "format": "date"},
+             {"type": "integer",
+              "enum": sorted([self.sedan.id, self.suv.id])}])
+        self.assertEqual(
+            [rule["contains"]["properties"]["field_id"]["const"]
+             for rule in values["allOf"]],
+            [self.text_field.id, self.number_field.id, self.date_field.id,
+             self.enum_field.id])
+
+    def test_schema_is_cached_with_strong_etag(self):
+        response = self.client.get(self.url)
+        etag = response["ETag"]
+        self.assertFalse(etag.startswith("W/"))
+        self.assertIn("X-Tenant", response["Vary"])
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response["ETag"], etag)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+    def test_schema_is_kept_across_risk_writes(self):
+        self.client.get(self.url)
+        cache.risk_type_changed(self.risk_type.id)
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+
+    def test_schema_of_other_tenant_is_not_found(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        response = self.client.get(self.url, HTTP_X_TENANT="other")
+        self.assertEqual(response.status_code, 404)
+
+    def test_schema_is_dropped_with_risk_type(self):
+        self.client.get(self.url)
+        self.client.delete("/api/risk_types/%d/" % self.risk_type.id)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_schema_is_dropped_from_local_tier_of_other_processes(self):
+        self.client.get(self.url)
+        key = cache.risk_type_schema_key(self.risk_type.id)
+        entry = cache.local_cache.get(key)
+
+        # Fields are edited in the admin, which calls risk_type_edited
+        self.number_field.delete()
+        cache.risk_type_edited(self.risk_type.id)
+        # Another process still holds the entry in its local tier
+        cache.local_cache.set(key, entry)
+        values = self.client.get(self.url).json()["properties"]["values"]
+        self.assertEqual(values["minItems"], 3)
+
+        entry = cache.local_cache.get(key)
+        self.client.delete("/api/risk_types/%d/" % self.risk_type.id)
+        cache.local_cache.set(key, entry)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class UniqueFieldTestCase(ResetStateMixin, APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        response = self.client.post("/api/risk_types/", {
+            "name": "Cars",
+            "fields": [
+                {"name": "VIN", "field_type": "text", "unique": True},
+                {"name": "Color", "field_type": "text"},
+            ],
+        }, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.risk_type = RiskType.objects.get(pk=response.json()["id"])
+        self.vin_field, self.color_field = self.risk_type.fields.order_by("id")
+        self.assertTrue(self.vin_field.unique)
+        self.assertFalse(self.color_field.unique)
+
+    def post_risk(self, vin, color="Red"):
+        return self.client.post("/api/risks/", {
+            "risk_type": self.risk_type.id,
+            "values": [
+                {"field_id": self.vin_field.id, "value": vin},
+                {"field_id": self.color_field.id, "value": color},
+            ],
+        }, format="json")
+
+    def test_values_of_unique_fields_must_be_unique(self):
+        self.assertEqual(self.post_risk("1HGCM82633A004352").status_code, 201)
+        # Values of other fields may repeat
+        self.assertEqual(self.post_risk("JH4KA7561PC008269").status_code, 201)
+
+        response = self.post_risk("1HGCM82633A004352", color="Blue")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"non_field_errors": [
+            "Values of unique fields must be unique. 'VIN' values already "
+            "exist."]})
+        self.assertEqual(self.risk_type.risks.count(), 2)
+
+    def test_unique_value_is_released_when_risk_is_deleted(self):
+        risk_id = self.post_risk("1HGCM82633A004352").json()["id"]
+        self.client.delete("/api/risks/%d/" % risk_id)
+        self.assertEqual(self.post_risk("1HGCM82633A004352").status_code, 201)
+
+    def test_concurrently_taken_value_is_rejected_by_unique_index(self):
+        self.post_risk("1HGCM82633A004352")
+        # Let the value through validation as if it was taken by another
+        # request after validation
+        with mock.patch("core.serializers.find_duplicates",
+                        side_effect=[[], [self.vin_field]]):
+            response = self.post_risk("1HGCM82633A004352")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("'VIN' values already exist.",
+                      response.json()["non_field_errors"][0])
+        self.assertEqual(self.risk_type.risks.count(), 1)
+
+    def test_duplicates_are_found_in_batches(self):
+        self.post_risk("existing")
+        values = [
+            uniqueness.set_value_hash(
+                FieldValue(field=self.vin_field, value_text="VIN %d" % index))
+            for index in range(uniqueness.LOOKUP_BATCH_SIZE + 10)
+        ]
+        with self.assertNumQueries(2):
+            self.assertEqual(uniqueness.find_duplicates(values), [])
+
+        values.append(uniqueness.set_value_hash(
+            FieldValue(field=self.vin_field, value_text="VIN 0")))
+        self.assertEqual(uniqueness.find_duplicates(values), [self.vin_field])
+
+        values = [uniqueness.set_value_hash(
+            FieldValue(field=self.vin_field, value_text="existing"))]
+        self.assertEqual(uniqueness.find_duplicates(values), [self.vin_field])
+
+    def test_only_values_of_unique_fields_are_hashed(self):
+        risk_id = self.post_risk("1HGCM82633A004352").json()["id"]
+        hashes = dict(FieldValue.objects.filter(risk_id=risk_id)
+                      .values_list("field_id", "value_hash"))
+        self.assertEqual(hashes[self.vin_field.id], uniqueness.get_value_hash(
+            Field.TEXT_FIELD, "1HGCM82633A004352"))
+        self.assertIsNone(hashes[self.color_field.id])
+
+
+@override_settings(INLINE_OPTIONS_LIMIT=3)
+class FieldOptionsAPITestCase(ResetStateMixin, APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        response = self.client.post("/api/risk_types/", {
+            "name": "Addresses",
+            "fields": [
+                {"name": "Street", "field_type": "text"},
+                {"name": "Country", "field_type": "enum", "options": [
+                    {"value": "Germany"}, {"value": "France"}]},
+                {"name": "ZIP", "field_type": "enum", "options": [
+                    {"value": value} for value in
+                    ("10115", "10117", "20095", "80331", "50667", "01067")]},
+            ],
+        }, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.risk_type = RiskType.objects.get(pk=response.json()["id"])
+        self.zip_field = self.risk_type.fields.get(name="ZIP")
+        self.zip_options = list(self.zip_field.options.order_by("id"))
+        self.url = "/api/risk_types/%d/fields/%d/options/" % (
+            self.risk_type.id, self.zip_field.id)
+
+    def test_large_enum_fields_are_represented_by_option_count(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(
+                "/api/risk_types/%d/" % self.risk_type.id)
+        street, country, zip_code = response.json()["fields"]
+
+        self.assertEqual(street["options"], [])
+        self.assertEqual(street["option_count"], 0)
+        self.assertEqual([option["value"] for option in country["options"]],
+                         ["Germany", "France"])
+        self.assertEqual(country["option_count"], 2)
+        self.assertNotIn("options", zip_code)
+        self.assertEqual(zip_code["option_count"], 6)
+
+    def test_risk_list_only_fetches_inlined_options(self):
+        country_field = self.risk_type.fields.get(name="Country")
+        response = self.client.post("/api/risks/", {
+            "risk_type": self.risk_type.id,
+            "values": [
+                {"field_id": self.risk_type.fields.get(name="Street").id,
+                 "value": "Unter den Linden"},
+                {"field_id": country_field.id,
+                 "value": country_field.options.first().id},
+                {"field_id": self.zip_field.id,
+                 "value": self.zip_options[0].id},
+            ],
+        }, format="json")
+        self.assertEqual(response.status_code, 201)
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get("/api/risks/")
+        street, country, zip_code = [
+            value["field"] for value in response.json()[0]["values"]]
+        self.assertEqual(len(country["options"]), 2)
+        self.assertNotIn("options", zip_code)
+        options_query, = [query["sql"] for query in context.captured_queries
+                          if "core_field_options" in query["sql"] and
+                          "core_optionvalue" in query["sql"]]
+        # Only the options of the field inlining them are fetched
+        self.assertIn('"field_id" IN (%d)' % country_field.id, options_query)
+
+    def test_options_are_paginated_by_id(self):
+        page = self.client.get(self.url, {"limit": 4}).json()
+        self.assertEqual([option["id"] for option in page["results"]],
+                         [option.id for option in self.zip_options[:4]])
+        self.assertIn("after=%d" % self.zip_options[3].id, page["next"])
+
+        page = self.client.get(page["next"]).json()
+        self.assertEqual([option["value"] for option in page["results"]],
+                         ["50667", "01067"])
+        self.assertIsNone(page["next"])
+
+    def test_options_are_searched_by_prefix_or_substring(self):
+        page = self.client.get(self.url, {"q": "101"}).json()
+        self.assertEqual([option["value"] for option in page["results"]],
+                         ["10115", "10117"])
+
+        page = self.client.get(self.url, {"q": "06", "limit": 1}).json()
+        self.assertEqual(page["results"], [])
+
+        page = self.client.get(
+            self.url, {"q": "06", "match": "contains", "limit": 1}).json()
+        self.assertEqual([option["value"] for option in page["results"]],
+                         ["50667"])
+        self.assertIn("match=contains", page["next"])
+        self.assertIn("q=06", page["next"])
+        page = self.client.get(page["next"]).json()
+        self.assertEqual([option["value"] for option in page["results"]],
+                         ["01067"])
+
+    def test_options_of_other_risk_types_and_tenants_are_not_found(self):
+        other = RiskType.objects.create(name="Other")
+        url = "/api/risk_types/%d/fields/%d/options/" % (
+            other.id, self.zip_field.id)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(
+            self.client.get(self.url, HTTP_X_TENANT="other").status_code, 404)
+
+    def test_options_validates_parameters(self):
+        response = self.client.get(self.url, {"match": "regex", "limit": 0})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {"match", "limit"})
+
+
+class AdminTestCase(ResetStateMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(get_user_model().objects.create_superuser(
+            "admin", "admin@example.com", "password"))
+        self.risk_type = seed_risk_type(num_fields=4, num_options=3)
+        seed_risks(self.risk_type, 2)
+        self.risk = self.risk_type.risks.order_by("id").first()
+        self.values = list(self.risk.field_values.order_by("field_id")
+                           .select_related("field"))
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        urls = ["/admin/core/%s/" % model
+                for model in ("risktype", "field", "risk", "fieldvalue")]
+        counts = []
+        for url in urls:
+            with CaptureQueriesContext(connection) as context:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            counts.append(len(context.captured_queries))
+
+        seed_risks(self.risk_type, 20)
+        for url, count in zip(urls, counts):
+            with self.assertNumQueries(count):
+                self.client.get(url)
+
+    def test_change_pages(self):
+        for url in ("/admin/core/risktype/%d/change/" % self.risk_type.id,
+                    "/admin/core/field/%d/change/" % self.values[0].field_id,
+                    "/admin/core/risk/%d/change/" % self.risk.id,
+                    "/admin/core/fieldvalue/%d/change/" % self.values[0].id):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def post_values(self, changes):
+        data = {
+            "field_values-TOTAL_FORMS": len(self.values),
+            "field_values-INITIAL_FORMS": len(self.values),
+            "field_values-MIN_NUM_FORMS": 0,
+            "field_values-MAX_NUM_FORMS": 1000,
+        }
+        for index, value in enumerate(self.values):
+            prefix = "field_values-%d-" % index
+            data[prefix + "id"] = value.id
+            data[prefix + "risk"] = self.risk.id
+            for column in ("value_text", "value_number", "value_date",
+                           "value_option"):
+                current = getattr(value, column)
+                if column == "value_option" and current is not None:
+                    current = current.id
+                current = changes.get((index, column), current)
+                data[prefix + column] = "" if current is None else current
+        return self.client.post(
+            "/admin/core/risk/%d/change/" % self.risk.id, data)
+
+    def test_risk_values_are_edited_inline(self):
+        enum_value = self.values[3]
+        old_option = enum_value.value_option
+        new_option = enum_value.field.options.exclude(pk=old_option.pk)[0]
+        usage = {option.id: option.usage_count
+                 for option in enum_value.field.options.all()}
+
+        response = self.post_values({(0, "value_text"): "Corrected",
+                                     (3, "value_option"): new_option.id})
+        self.assertEqual(response.status_code, 302)
+
+        self.assertEqual(FieldValue.objects.get(pk=self.values[0].pk)
+                         .value_text, "Corrected")
+        self.assertEqual(FieldValue.objects.get(pk=enum_value.pk)
+                         .value_option, new_option)
+        old_option.refresh_from_db()
+        new_option.refresh_from_db()
+        self.assertEqual(old_option.usage_count, usage[old_option.id] - 1)
+        self.assertEqual(new_option.usage_count, usage[new_option.id] + 1)
+
+    def test_inline_values_are_validated(self):
+        other_option = OptionValue.objects.create(value="Other")
+        response = self.post_values({(1, "value_text"): "Not a number",
+                                     (3, "value_option"): other_option.id})
+        self.assertEqual(response.status_code, 200)
+        errors = response.context["inline_admin_formsets"][0].formset.errors
+        self.assertEqual(errors[1], {"value_text": [
+            "Must be empty for number fields."]})
+        self.assertEqual(errors[3], {"value_option": [
+            "Invalid value. Option value does not exist."]})
+
+    def test_inline_values_of_unique_fields_are_hashed_and_checked(self):
+        text_field = self.values[0].field
+        Field.objects.filter(pk=text_field.pk).update(unique=True)
+        other_value = FieldValue.objects.filter(field=text_field) \
+            .exclude(risk=self.risk).select_related("field").get()
+        uniqueness.set_value_hash(other_value).save()
+
+        response = self.post_values({(0, "value_text"):
+                                     other_value.value_text})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(
+            FieldValue.objects.get(pk=self.values[0].pk).value_hash)
+
+        response = self.post_values({(0, "value_text"): "Unique"})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            FieldValue.objects.get(pk=self.values[0].pk).value_hash,
+            uniqueness.get_value_hash(Field.TEXT_FIELD, "Unique"))
+
+    def test_concurrently_taken_value_is_reported_as_form_error(self):
+        text_field = self.values[0].field
+        Field.objects.filter(pk=text_field.pk).update(unique=True)
+        other_value = FieldValue.objects.filter(field=text_field) \
+            .exclude(risk=self.risk).select_related("field").get()
+        uniqueness.set_value_hash(other_value).save()
+
+        # Let the value through the first validation as if it was taken by
+        # another request after validation
+        calls = []
+
+        def find_duplicates(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                return []
+            return uniqueness.find_duplicates(*args)
+
+        with mock.patch("core.admin.find_duplicates", find_duplicates):
+            response = self.post_values({(0, "value_text"):
+                                         other_value.value_text})
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(response.status_code, 200)
+        errors = response.context["inline_admin_formsets"][0].formset.errors
+        self.assertEqual(errors[0], {"value_text": [
+            "Values of unique fields must be unique. '%s' values already "
+            "exist." % text_field.name]})
+        self.assertIsNone(
+            FieldValue.objects.get(pk=self.values[0].pk).value_hash)
+
+    @skipUnless(connection.vendor == "postgresql",
+                "Count estimates need PostgreSQL")
+    def test_large_changelists_are_counted_with_estimates(self):
+        queryset = FieldValue.objects.order_by("id")
+        with override_settings(ADMIN_EXACT_COUNT_LIMIT=0), \
+                mock.patch("core.admin.estimate_count", return_value=12345):
+            self.assertEqual(EstimatedCountPaginator(queryset, 100).count,
+                             12345)
+        self.assertEqual(EstimatedCountPaginator(queryset, 100).count,
+                         queryset.count())
+
+    def test_small_changelists_are_counted_exactly(self):
+        queryset = FieldValue.objects.order_by("id")
+        self.assertEqual(EstimatedCountPaginator(queryset, 100).count, 8)
+
+
+class ExportRisksMixin:
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.out = os.path.join(directory.name, "export")
+        storage_settings = override_settings(ARCHIVE_STORAGE_OPTIONS={
+            "location": os.path.join(directory.name, "archive")})
+        storage_settings.enable()
+        self.addCleanup(storage_settings.disable)
+
+        self.risk_types = [seed_risk_type(num_fields=4, num_options=3)
+                           for _ in range(2)]
+        for risk_type in self.risk_types:
+            seed_risks(risk_type, 7)
+        RiskType.objects.create(name="Empty")
+
+    def export(self, **options):
+        out = StringIO()
+        call_command("export_risks", out=self.out, shard_size=3,
+                     stdout=out, **options)
+        self.assertIn("Exported 14 risks of 3 risk types in 6 shards",
+                      out.getvalue())
+        with open(os.path.join(self.out, "manifest.json")) as manifest:
+            return json.load(manifest)
+
+    def read_shards(self, entry):
+        lines = []
+        for shard in entry["shards"]:
+            path = os.path.join(self.out, shard["file"])
+            with open(path, "rb") as shard_file:
+                self.assertEqual(
+                    hashlib.sha256(shard_file.read()).hexdigest(),
+                    shard["sha256"])
+            with gzip.open(path, "rt") as shard_file:
+                lines.append(shard_file.read().splitlines())
+        return lines
+
+    def expected_values(self, risk):
+        values = []
+        for value in sorted(risk.field_values.all(),
+                            key=lambda value: value.field_id):
+            value = value.value
+            values.append(value.value if isinstance(value, OptionValue)
+                          else value)
+        return values
+
+
+class ExportRisksTestCase(ExportRisksMixin, ResetStateMixin, TestCase):
+
+    def test_risks_are_exported_to_csv_shards(self):
+        manifest = self.export()
+        self.assertEqual(manifest["format"], "csv")
+        self.assertEqual(manifest["rows"], 14)
+
+        entry, _, empty = manifest["risk_types"]
+        risk_type = self.risk_types[0]
+        fields = list(risk_type.fields.order_by("id"))
+        self.assertEqual(entry["id"], risk_type.id)
+        self.assertEqual([field["id"] for field in entry["fields"]],
+                         [field.id for field in fields])
+        self.assertEqual(entry["rows"], 7)
+        self.assertEqual([shard["rows"] for shard in entry["shards"]],
+                         [3, 3, 1])
+        self.assertEqual(empty["rows"], 0)
+        self.assertEqual(empty["shards"], [])
+
+        shards = self.read_shards(entry)
+        for shard in shards:
+            self.assertEqual(shard[0], "risk_id,created," + ",".join(
+                field.name for field in fields))
+        rows = list(csv.reader(line for shard in shards
+                               for line in shard[1:]))
+        risks = list(risk_type.risks.order_by("id"))
+        self.assertEqual([int(row[0]) for row in rows],
+                         [risk.id for risk in risks])
+        for row, risk in zip(rows, risks):
+            self.assertEqual(row[2:], [str(value) for value in
+                                       self.expected_values(risk)])
+
+    def test_workers_are_refused_in_a_transaction(self):
+        with self.assertRaises(TransactionManagementError):
+            export.export_risks(self.out, workers=2)
+        self.assertFalse(os.path.exists(self.out))
+
+
+class ParallelExportRisksTestCase(ExportRisksMixin, ResetStateMixin,
+                                  TransactionTestCase):
+    """
+    Export with worker processes, which only see committed rows.
+    """
+
+    def test_risks_are_exported_to_ndjson_by_worker_processes(self):
+        # Archived risks are exported with the values of their archive
+        archive.archive_risks(timezone.now(), [self.risk_types[1].id],
+                              batch_size=4)
+
+        # Forked workers write the process id of every shard they export
+        pids = os.path.join(os.path.dirname(self.out), "pids")
+        os.makedirs(pids)
+        write_shard = export.write_shard
+
+        def record_pid(path, *args):
+            rows = write_shard(path, *args)
+            shard = os.path.relpath(path, self.out).replace(os.sep, "_")
+            with open(os.path.join(pids, "%s-%d" % (shard, os.getpid())),
+                      "w"):
+                pass
+            return rows
+
+        with mock.patch("core.export.write_shard", record_pid):
+            manifest = self.export(workers=2, format="ndjson")
+        self.assertEqual(manifest["format"], "ndjson")
+        workers = {name.rsplit("-", 1)[1] for name in os.listdir(pids)}
+        self.assertEqual(len(os.listdir(pids)), 6)
+        self.assertNotIn(str(os.getpid()), workers)
+
+        entry = manifest["risk_types"][1]
+        lines = [line for shard in self.read_shards(entry) for line in shard]
+        risks = list(self.risk_types[1].risks.order_by("id"))
+        self.assertEqual(len(lines), len(risks))
+        for line, risk in zip(lines, risks):
+            row = json.loads(line)
+            self.assertEqual(row["risk_id"], risk.id)
+            archive.load_archived_values(risk)
+            self.assertEqual(
+                [row["values"][str(field["id"])] for field in entry["fields"]],
+                json.loads(json.dumps(self.expected_values(risk),
+                                      cls=DjangoJSONEncoder)))
+
+
+class MemoryBudgetTestCase(ResetStateMixin, TestCase):
+    """
+    Enforce the memory budgets of `core.memory` on their data set.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.risk_type = seed_risk_type(memory.BUDGET_FIELDS,
+                                       memory.BUDGET_OPTIONS)
+        seed_risks(cls.risk_type, memory.BUDGET_RISKS)
+
+    def assertWithinBudget(self, name):
+        usage, = memory.measure_scenarios(self.risk_type, [name])
+        self.assertGreater(usage.peak, 0)
+        self.assertTrue(usage.within_budget(), "%s\n%s" % (
+            usage, "\n".join(str(statistic) for statistic in usage.top)))
+
+    def test_risk_list_is_within_budget(self):
+        self.assertWithinBudget("risk_list")
+
+    def test_risk_retrieve_is_within_budget(self):
+        self.assertWithinBudget("risk_retrieve")
+
+    def test_risk_create_is_within_budget(self):
+        self.assertWithinBudget("risk_create")
+
+    def test_shared_cache_is_left_alone(self):
+        shared = cache.get_shared_cache()
+        shared.set("unrelated", 1)
+        memory.measure_scenarios(self.risk_type, ["risk_retrieve"])
+        self.assertEqual(shared.get("unrelated"), 1)
+
+    def test_memory_budget_command(self):
+        out = StringIO()
+        call_command("memory_budget", fields=4, risks=5, check=True,
+                     stdout=out)
+        for name, _ in memory.SCENARIOS:
+            self.assertIn("%s: peak" % name, out.getvalue())
+
+        with mock.patch.dict(memory.MEMORY_BUDGETS, {"risk_create": 1}):
+            with self.assertRaisesMessage(CommandError,
+                                          "Over budget: risk_create"):
+                call_command("memory_budget", scenarios=["risk_create"],
+                             risks=1, check=True, stdout=StringIO())
+
+
+class StubEndpoint:
+    """
+    Local HTTP server recording the requests sent to it, answering with
+    the next of `statuses` (200 once they run out) after `delay` seconds.
+    """
+
+    def __init__(self, statuses=(), delay=0):
+        self.statuses = list(statuses)
+        self.delay = delay
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_POST(self):
+                with stub.lock:
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight,
+                                             stub.in_flight)
+                    status = stub.statuses.pop(0) if stub.statuses else 200
+                time.sleep(stub.delay)
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                with stub.lock:
+                    stub.in_flight -= 1
+                    stub.requests.append((dict(self.headers),
+                                          json.loads(body.decode("utf-8"))))
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        self.server = Server(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:%d/events" % self.server.server_port
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class RiskEventOutboxTestCase(ResetStateMixin, APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.stub = StubEndpoint()
+        self.addCleanup(self.stub.close)
+        settings = override_settings(OUTBOX_ENDPOINTS={
+            "billing": self.stub.url}, OUTBOX_RETRY_BACKOFF=60.0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        response = self.client.post("/api/risk_types/", {
+            "name": "Cars",
+            "fields": [{"name": "Model", "field_type": "text"}],
+        }, format="json")
+        self.risk_type = RiskType.objects.get(pk=response.json()["id"])
+        self.field = self.risk_type.fields.get()
+
+    def post_risk(self):
+        return self.client.post("/api/risks/", {
+            "risk_type": self.risk_type.id,
+            "values": [{"field_id": self.field.id, "value": "Civic"}],
+        }, format="json")
+
+    def dispatch(self, **kwargs):
+        dispatcher = outbox.Dispatcher(**kwargs)
+        try:
+            return dispatcher.dispatch_due()
+        finally:
+            dispatcher.close()
+
+    def test_changes_write_an_event_per_endpoint(self):
+        with override_settings(OUTBOX_ENDPOINTS={"billing": self.stub.url,
+                                                 "search": self.stub.url}):
+            risk_id = self.post_risk().json()["id"]
+        self.assertEqual(sorted(RiskEvent.objects.values_list(
+            "endpoint", "event_type")), [
+            ("billing", "risk.created"), ("search", "risk.created")])
+        payload = json.loads(RiskEvent.objects.first().payload)
+        self.assertEqual(payload["type"], "risk.created")
+        self.assertEqual(payload["data"], {
+            "id": risk_id, "risk_type": self.risk_type.id})
+
+        RiskEvent.objects.all().delete()
+        self.client.delete("/api/risks/%d/" % risk_id)
+        self.client.delete("/api/risk_types/%d/" % self.risk_type.id)
+        self.assertEqual(list(RiskEvent.objects.order_by("id").values_list(
+            "event_type", flat=True)), ["risk.deleted", "risk_type.deleted"])
+
+    def test_events_are_written_in_the_transaction_of_the_change(self):
+        with mock.patch("core.counters.risk_created",
+                        side_effect=DatabaseError("Connection lost")):
+            with self.assertRaises(DatabaseError):
+                self.post_risk()
+        self.assertFalse(Risk.objects.exists())
+        self.assertFalse(RiskEvent.objects.exists())
+
+        # Nothing is written without endpoints
+        with override_settings(OUTBOX_ENDPOINTS={}):
+            self.assertEqual(self.post_risk().status_code, 201)
+        self.assertFalse(RiskEvent.objects.exists())
+
+    def test_dispatch_delivers_and_deletes_events(self):
+        risk_id = self.post_risk().json()["id"]
+        event = RiskEvent.objects.get()
+
+        out = StringIO()
+        call_command("dispatch_events", once=True, stdout=out)
+        self.assertIn("Delivered 1 events, 0 to retry, 0 failed.",
+                      out.getvalue())
+        self.assertFalse(RiskEvent.objects.exists())
+
+        (headers, body), = self.stub.requests
+        self.assertEqual(headers["X-Event-Id"], str(event.id))
+        self.assertEqual(headers["X-Event-Type"], "risk.created")
+        self.assertEqual(headers["Content-Type"], "application/json")
+        self.assertEqual(body["data"]["id"], risk_id)
+
+    def test_failed_deliveries_are_retried_with_backoff(self):
+        self.stub.statuses = [503, 500]
+        self.post_risk()
+
+        self.assertEqual(self.dispatch(), {
+            "delivered": 0, "retried": 1, "failed": 0})
+        event = RiskEvent.objects.get()
+        self.assertEqual(event.attempts, 1)
+        self.assertEqual(event.last_error, "HTTP 503 Service Unavailable")
+        delay = (event.next_attempt - timezone.now()).total_seconds()
+        self.assertTrue(25 < delay <= 60, delay)
+
+        # Not due before its backoff elapsed
+        self.assertEqual(self.dispatch()["retried"], 0)
+        RiskEvent.objects.update(next_attempt=timezone.now())
+        self.dispatch()
+        event.refresh_from_db()
+        self.assertEqual(event.attempts, 2)
+        delay = (event.next_attempt - timezone.now()).total_seconds()
+        self.assertTrue(55 < delay <= 120, delay)
+
+        RiskEvent.objects.update(next_attempt=timezone.now())
+        self.assertEqual(self.dispatch()["delivered"], 1)
+        self.assertEqual(len(self.stub.requests), 3)
+        self.assertFalse(RiskEvent.objects.exists())
+
+    def test_events_fail_after_max_attempts(self):
+        self.stub.close()
+        self.post_risk()
+        with override_settings(OUTBOX_MAX_ATTEMPTS=1):
+            self.assertEqual(self.dispatch()["failed"], 1)
+        event = RiskEvent.objects.get()
+        self.assertTrue(event.failed)
+        self.assertIn("Connection", event.last_error)
+
+        # Events of unknown endpoints fail too
+        self.assertEqual(outbox.retry_failed_events(), 1)
+        with override_settings(OUTBOX_MAX_ATTEMPTS=1):
+            self.assertEqual(self.dispatch(endpoints={})["failed"], 1)
+        event.refresh_from_db()
+        self.assertEqual(event.last_error,
+                         'Endpoint "billing" is not configured.')
+
+    def test_malformed_endpoint_does_not_abort_the_batch(self):
+        with override_settings(OUTBOX_ENDPOINTS={"billing": self.stub.url,
+                                                 "search": "search/events"}):
+            self.post_risk()
+            self.assertEqual(self.dispatch(), {
+                "delivered": 1, "retried": 1, "failed": 0})
+        event = RiskEvent.objects.get()
+        self.assertEqual(event.endpoint, "search")
+        self.assertTrue(event.last_error.startswith("ValueError: "))
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_claimed_events_are_not_claimed_again(self):
+        self.post_risk()
+        self.post_risk()
+        self.assertEqual(len(outbox.claim_events(1)), 1)
+        self.assertEqual(len(outbox.claim_events(10)), 1)
+        self.assertEqual(outbox.claim_events(10), [])
+
+        # Claims of dispatchers which died expire
+        RiskEvent.objects.update(next_attempt=timezone.now())
+        self.assertEqual(len(outbox.claim_events(10)), 2)
+
+    def test_requests_per_endpoint_are_limited(self):
+        for _ in range(6):
+            self.post_risk()
+        self.stub.delay = 0.1
+        self.assertEqual(self.dispatch(concurrency=2), {
+            "delivered": 6, "retried": 0, "failed": 0})
+        self.assertEqual(self.stub.max_in_flight, 2)
+
+
+@skipUnless(connection.vendor == "postgresql", "Query plans need PostgreSQL")
+class QueryPlanTestCase(ResetStateMixin, APITestCase):
+    """
+    Run `EXPLAIN` on the queries of the main read and write paths against
+    a large seeded data set and fail on sequential scans of large tables.
+    """
+    # Tables with at least this many rows must not be scanned sequentially
+    LARGE_TABLE_ROWS = 5000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.risk_types = [seed_risk_type(num_fields=10, num_options=20)
+                          for _ in range(20)]
+        for risk_type in cls.risk_types:
+            seed_risks(risk_type, 500)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+            cursor.execute(
+                "SELECT relname FROM pg_class WHERE relkind = 'r' "
+                "AND relname LIKE 'core\\_%%' AND reltuples >= %s",
+                [cls.LARGE_TABLE_ROWS])
+            cls.large_tables = {row[0] for row in cursor.fetchall()}
+
+    def setUp(self):
+        super().setUp()
+        self.risk_type = self.risk_types[7]
+        self.risk = self.risk_type.risks.order_by("id")[250]
+
+    def explain(self, sql, params=None):
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]["Plan"]
+
+    def find_seq_scans(self, plan):
+        scans = []
+        if (plan["Node Type"] == "Seq Scan" and
+                plan["Relation Name"] in self.large_tables):
+            scans.append(plan["Relation Name"])
+        for child in plan.get("Plans", []):
+            scans.extend(self.find_seq_scans(child))
+        return scans
+
+    def assertNoSeqScans(self, sql, params=None):
+        plan = self.explain(sql, params)
+        scans = self.find_seq_scans(plan)
+        self.assertFalse(scans, "Sequential scan of %s in:\n%s\n%s" % (
+            ", ".join(scans), sql, json.dumps(plan, indent=2)))
+
+    def assertQuerysetUsesIndexes(self, queryset):
+        self.assertNoSeqScans(*queryset.query.sql_with_params())
+
+    def assertRequestUsesIndexes(self, method, path, data=None):
+        """
+        Make a request and check the plans of all queries it ran.
+        """
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(path, data,
+                                                    format="json")
+        self.assertLess(response.status_code, 400, response.content)
+
+        statements = [query["sql"] for query in context.captured_queries
+                      if query["sql"].startswith(("SELECT", "UPDATE",
+                                                  "DELETE"))]
+        self.assertTrue(statements)
+        for sql in statements:
+            self.assertNoSeqScans(sql)
+
+    def test_large_tables_are_seeded(self):
+        self.assertIn(FieldValue._meta.db_table, self.large_tables)
+        self.assertIn(Risk._meta.db_table, self.large_tables)
+
+    def test_risk_retrieve(self):
+        self.assertRequestUsesIndexes("get", "/api/risks/%d/" % self.risk.id)
+
+    def test_risk_type_retrieve(self):
+        self.assertRequestUsesIndexes(
+            "get", "/api/risk_types/%d/" % self.risk_type.id)
+
+    def test_risk_type_table(self):
+        self.assertRequestUsesIndexes(
+            "get", "/api/risk_types/%d/table/?after=%d&limit=100" % (
+                self.risk_type.id, self.risk.id))
+
+    def test_risk_create(self):
+        payload = build_risk_payload(RiskTypeSerializer(self.risk_type).data)
+        self.assertRequestUsesIndexes("post", "/api/risks/", payload)
+
+    def test_risk_destroy(self):
+        self.assertRequestUsesIndexes(
+            "delete", "/api/risks/%d/" % self.risk.id)
+
+    def test_values_of_a_risk(self):
+        self.assertQuerysetUsesIndexes(
+            FieldValue.objects.filter(risk=self.risk).order_by("field_id"))
+
+    def test_values_of_a_field(self):
+        field = self.risk_type.fields.filter(
+            field_type=Field.NUMBER_FIELD).first() or \
+            self.risk_type.fields.first()
+        self.assertQuerysetUsesIndexes(
+            FieldValue.objects.filter(field=field).values_list(
+                "risk_id", "value_number", "value_option_id"))
+
+    def test_values_of_an_option(self):
+        option = OptionValue.objects.filter(
+            field__risk_type=self.risk_type).first()
+        self.assertQuerysetUsesIndexes(
+            FieldValue.objects.filter(value_option=option).values("risk_id"))
+
+    def test_risks_of_a_risk_type(self):
+        self.assertQuerysetUsesIndexes(
+            Risk.objects.filter(tenant="", risk_type=self.risk_type)
+            .order_by("id")[:100])
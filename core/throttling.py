@@ -0,0 +1,226 @@
+"""
+In-process rate limiting and load shedding.
+
+Both work on the memory of the current process only, so rejecting a request
+never costs a database or cache round trip.
+
+Write actions are rate limited per client with token buckets: every client
+may burst up to `WRITE_THROTTLE_BURST` writes, refilled at
+`WRITE_THROTTLE_RATE` writes per second.
+
+Expensive read actions are shed while the process is overloaded, i.e. when
+more than `LOAD_SHEDDING_MAX_IN_FLIGHT` requests are being processed or the
+average duration of the queries of the last `LOAD_SHEDDING_WINDOW` seconds
+is over `LOAD_SHEDDING_MAX_DB_LATENCY` milliseconds.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from rest_framework import exceptions, status
+from rest_framework.throttling import BaseThrottle
+
+from core.tenancy import get_current_tenant
+
+
+class TokenBucket:
+    """
+    Bucket of tokens, starting full.
+    """
+
+    def __init__(self, capacity):
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def consume(self, rate, capacity):
+        """
+        Refill the bucket at `rate` tokens per second up to `capacity`
+        tokens and take a token from it.
+
+        Returns 0 if a token was taken, otherwise the seconds until the
+        next token is available.
+        """
+        now = time.monotonic()
+        self.tokens = min(capacity,
+                          self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        if rate <= 0:
+            return None
+        return (1 - self.tokens) / rate
+
+
+class TokenBucketStore:
+    """
+    Token buckets of the most recently seen `max_size` clients.
+
+    Buckets of clients evicted from the store start over full.
+    """
+
+    def __init__(self):
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, rate, capacity, max_size):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(capacity)
+                while len(self._buckets) > max_size:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket.consume(rate, capacity)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+write_buckets = TokenBucketStore()
+
+
+class WriteRateThrottle(BaseThrottle):
+    """
+    Rate limit write actions of a viewset per client and tenant.
+    """
+    write_actions = ('create', 'destroy')
+
+    def get_cache_key(self, request, view):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            ident = 'user:%s' % user.pk
+        else:
+            ident = self.get_ident(request)
+        return '%s:%s' % (get_current_tenant(), ident)
+
+    def allow_request(self, request, view):
+        self.retry_after = None
+        if getattr(view, 'action', None) not in self.write_actions:
+            return True
+
+        self.retry_after = write_buckets.consume(
+            self.get_cache_key(request, view),
+            settings.WRITE_THROTTLE_RATE, settings.WRITE_THROTTLE_BURST,
+            settings.WRITE_THROTTLE_MAX_CLIENTS)
+        return self.retry_after == 0
+
+    def wait(self):
+        if self.retry_after is None:
+            return None
+        return math.ceil(self.retry_after)
+
+
+class ServiceOverloaded(exceptions.APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'The service is overloaded, try again later.'
+    default_code = 'service_overloaded'
+
+    def __init__(self, detail=None, code=None, wait=1):
+        super().__init__(detail, code)
+        # Makes DRF send a Retry-After header
+        self.wait = wait
+
+
+class LoadMonitor:
+    """
+    Track the requests in flight and the durations of recent queries of
+    the current process.
+    """
+
+    def __init__(self, max_samples=1000):
+        self.in_flight = 0
+        self._samples = deque(maxlen=max_samples)
+        self._total = 0.0
+        self._lock = threading.Lock()
+
+    def request_started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def request_finished(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def record_query(self, duration):
+        with self._lock:
+            if len(self._samples) == self._samples.maxlen:
+                self._total -= self._samples[0][1]
+            self._samples.append((time.monotonic(), duration))
+            self._total += duration
+
+    def db_latency(self):
+        """
+        Return the average duration in seconds of the queries of the last
+        `LOAD_SHEDDING_WINDOW` seconds.
+        """
+        expired = time.monotonic() - settings.LOAD_SHEDDING_WINDOW
+        with self._lock:
+            while self._samples and self._samples[0][0] < expired:
+                self._total -= self._samples.popleft()[1]
+            if not self._samples:
+                return 0.0
+            return self._total / len(self._samples)
+
+    def is_overloaded(self):
+        max_in_flight = settings.LOAD_SHEDDING_MAX_IN_FLIGHT
+        if max_in_flight and self.in_flight > max_in_flight:
+            return True
+        max_latency = settings.LOAD_SHEDDING_MAX_DB_LATENCY
+        return bool(max_latency) and self.db_latency() * 1000 > max_latency
+
+    def reset(self):
+        with self._lock:
+            self.in_flight = 0
+            self._samples.clear()
+            self._total = 0.0
+
+    def time_query(self, execute, sql, params, many, context):
+        start = time.monotonic()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.record_query(time.monotonic() - start)
+
+
+load_monitor = LoadMonitor()
+
+
+class LoadMonitorMiddleware:
+    """
+    Count requests in flight and time their queries for `load_monitor`.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        load_monitor.request_started()
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(
+                        load_monitor.time_query))
+                return self.get_response(request)
+        finally:
+            load_monitor.request_finished()
+
+
+class LoadSheddingMixin:
+    """
+    Reject the `shed_actions` of a viewset right away while the process is
+    overloaded.
+    """
+    shed_actions = ('list', 'stream', 'table')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.action in self.shed_actions and load_monitor.is_overloaded():
+            raise ServiceOverloaded(
+                wait=settings.LOAD_SHEDDING_RETRY_AFTER)
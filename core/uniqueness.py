@@ -0,0 +1,84 @@
+"""
+Uniqueness of the values of unique fields.
+
+Values of fields with `unique` set get a `value_hash`, a hash of the field
+type and value, and the database has a unique index on
+`(field_id, value_hash)`. Hashes keep the index small whatever the length
+of text values, and make looking up an existing value a single index probe.
+
+Values are checked in batches before they are written so that clients get
+a validation error naming the fields, while the unique index keeps
+concurrent writes of the same value from both succeeding.
+"""
+import datetime
+import hashlib
+
+from core.models import FieldValue, OptionValue
+
+# Values looked up per query, keeps the query parameters under the limit
+# of every backend
+LOOKUP_BATCH_SIZE = 400
+
+
+def get_value_hash(field_type, value):
+    """
+    Return the hash of `value` of a field of `field_type`. Options can be
+    given as `OptionValue` objects or primary keys.
+    """
+    if value is None:
+        return None
+    if isinstance(value, OptionValue):
+        value = value.pk
+    elif isinstance(value, datetime.date):
+        value = value.isoformat()
+    content = '%s:%s' % (field_type, value)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def set_value_hash(field_value):
+    """
+    Set the `value_hash` of a `FieldValue` whose field is unique.
+    """
+    field = field_value.field
+    field_value.value_hash = get_value_hash(
+        field.field_type, field_value.value) if field.unique else None
+    return field_value
+
+
+def find_duplicates(field_values, using='default'):
+    """
+    Return the fields of `field_values` whose value is already taken,
+    either by an existing value or by another of `field_values`.
+
+    Existing values are looked up with one query per `LOOKUP_BATCH_SIZE`
+    values, each served by the unique index.
+    """
+    hashed = [value for value in field_values if value.value_hash]
+    duplicates = {}
+
+    seen = set()
+    for value in hashed:
+        key = (value.field_id, value.value_hash)
+        if key in seen:
+            duplicates[value.field_id] = value.field
+        seen.add(key)
+
+    keys = sorted(seen)
+    existing = set()
+    for start in range(0, len(keys), LOOKUP_BATCH_SIZE):
+        batch = keys[start:start + LOOKUP_BATCH_SIZE]
+        existing.update(FieldValue.objects.using(using).filter(
+            field_id__in={field_id for field_id, _ in batch},
+            value_hash__in={value_hash for _, value_hash in batch},
+        ).values_list('field_id', 'value_hash'))
+    for value in hashed:
+        if (value.field_id, value.value_hash) in existing:
+            duplicates[value.field_id] = value.field
+
+    return sorted(duplicates.values(), key=lambda field: field.id)
+
+
+def duplicate_values_message(fields):
+    field_names = ", ".join(["'%s'" % field.name for field in fields])
+    return "Values of unique fields must be unique. %s values already " \
+           "exist." % field_names
@@ -1,16 +1,45 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Prefetch
+from django.http import HttpResponse
+from django.utils.cache import (get_conditional_response,
+                                patch_cache_control, patch_vary_headers)
+from django.utils.http import urlencode
 from rest_framework import viewsets, mixins
+from rest_framework.decorators import action
+from rest_framework.generics import get_object_or_404
+from rest_framework.response import Response
 
-from core.models import RiskType, Risk
+from core import archive, cache, counters, outbox
+from core.idempotency import IdempotentCreateMixin
+from core.models import Field, RiskType, Risk
 from core.serializers import (RiskTypeSerializer, RiskTypeListSerializer,
-                              RiskSerializer)
+                              RiskSerializer, TableParamsSerializer,
+                              OptionValueSerializer,
+                              OptionSearchParamsSerializer)
+from core.streaming import streaming_list_response
+from core.profiling import ProfilingMixin
+from core.risk_schema import render_risk_schema
+from core.tabular import build_table
+from core.tenancy import get_current_tenant, get_tenant_database
+from core.throttling import LoadSheddingMixin, WriteRateThrottle
 
 
-class RiskTypeViewSet(mixins.CreateModelMixin,
+class RiskTypeViewSet(ProfilingMixin,
+                      LoadSheddingMixin,
+                      cache.CachedRetrieveMixin,
+                      IdempotentCreateMixin,
+                      mixins.CreateModelMixin,
                       mixins.DestroyModelMixin,
                       viewsets.ReadOnlyModelViewSet):
     """
     API to create, view and delete risk types.
 
+    Representations returned by list and retrieve are cached, see
+    core/cache.py. Creates and deletes are rate limited per client, list,
+    stream and table requests are rejected while the service is
+    overloaded, see core/throttling.py.
+
     list:
     Return list of risk types with only name and description
 
@@ -18,36 +47,214 @@ class RiskTypeViewSet(mixins.CreateModelMixin,
     Return a risk type by id with field details
 
     create:
-    Create a new risk type with along with fields and option values
+    Create a new risk type with along with fields and option values.
+    Send an `Idempotency-Key` header to safely retry the request.
 
     destroy:
     Delete a risk type by id
+
+    stream:
+    Stream the list of risk types as a JSON array, chunk by chunk
+
+    table:
+    Return risks of a risk type in a columnar format: an array of risk ids
+    and one array of values per field. Enum values are indexes into the
+    column's dictionary of options. Paginate with `after` (last risk id of
+    the previous page) and `limit`.
+
+    schema:
+    Return the JSON Schema of the payload to create a risk of a risk type.
+    Clients can validate risks against it before sending them. Served with
+    a strong ETag, send `If-None-Match` to revalidate.
+
+    field_options:
+    Search the options of an enum field of a risk type, for autocompletes.
+    Fields with many options are returned without their options by
+    retrieve. Options are returned in id order, `q` filters them by a
+    prefix (or a substring with `match=contains`) of their value.
+    Paginate with `after` (last option id of the previous page) and
+    `limit`.
     """
     queryset = RiskType.objects.all()
+    throttle_classes = (WriteRateThrottle,)
+
+    def get_queryset(self):
+        return super().get_queryset().filter(tenant=get_current_tenant())
 
     def get_serializer_class(self):
-        if self.action == "list":
+        if self.action in ("list", "stream"):
             return RiskTypeListSerializer
         return RiskTypeSerializer
 
+    def cache_key(self, pk):
+        return cache.risk_type_key(pk)
+
+    def cache_generations(self, instance):
+        return [cache.risk_type_generation(instance.id)]
+
+    def list(self, request, *args, **kwargs):
+        def load():
+            return ([cache.risk_type_list_generation()],
+                    lambda: list(super(RiskTypeViewSet, self).list(
+                        request, *args, **kwargs).data))
+
+        return Response(cache.read_through(cache.risk_type_list_key(), load))
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        cache.risk_type_changed(serializer.instance.id)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic(using=get_tenant_database()):
+            counters.risk_type_deleted(instance)
+            cache.risk_type_deleted(instance)
+            archive.risk_type_deleted(instance)
+            outbox.risk_type_deleted(instance)
+            instance.delete()
+
+    @action(detail=False)
+    def stream(self, request):
+        return streaming_list_response(self, request)
+
+    @action(detail=True)
+    def table(self, request, pk=None):
+        params = TableParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        after = params.validated_data['after']
+        limit = params.validated_data['limit']
+
+        table, has_more = build_table(self.get_object(), after, limit)
+        table['next'] = None
+        if has_more:
+            table['next'] = request.build_absolute_uri('%s?%s' % (
+                request.path, urlencode({'after': table['risk_ids'][-1],
+                                         'limit': limit})))
+        return Response(table)
+
+    @action(detail=True)
+    def schema(self, request, pk=None):
+        def load():
+            instance = self.get_object()
+            # The schema shows no counters, risk writes don't change it
+            return ([cache.risk_type_definition_generation(instance.id)],
+                    lambda: render_risk_schema(instance))
 
-class RiskViewSet(mixins.CreateModelMixin,
+        content, etag = cache.read_through(
+            cache.risk_type_schema_key(self.kwargs['pk']), load)
+        response = HttpResponse(content, content_type='application/json')
+        response['ETag'] = etag
+        patch_cache_control(response, private=True,
+                            max_age=settings.RISK_SCHEMA_MAX_AGE)
+        patch_vary_headers(response, ['X-Tenant'])
+        return get_conditional_response(request, etag=etag,
+                                        response=response)
+
+    @action(detail=True, url_path=r'fields/(?P<field_id>\d+)/options',
+            url_name='field-options')
+    def field_options(self, request, pk=None, field_id=None):
+        params = OptionSearchParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        q = params.validated_data['q']
+        after = params.validated_data['after']
+        limit = params.validated_data['limit']
+
+        field = get_object_or_404(
+            Field.objects.filter(risk_type__in=self.get_queryset()),
+            pk=field_id, risk_type=pk)
+        options = field.options.filter(id__gt=after).order_by('id')
+        if q and params.validated_data['match'] == params.PREFIX:
+            options = options.filter(value__istartswith=q)
+        elif q:
+            options = options.filter(value__icontains=q)
+        # Fetch an extra option to know if there is a next page
+        options = list(options[:limit + 1])
+
+        next_url = None
+        if len(options) > limit:
+            options = options[:limit]
+            query = dict(params.validated_data, after=options[-1].id)
+            next_url = request.build_absolute_uri(
+                '%s?%s' % (request.path, urlencode(query)))
+        return Response({
+            'results': OptionValueSerializer(options, many=True).data,
+            'next': next_url,
+        })
+
+
+class RiskViewSet(ProfilingMixin,
+                  LoadSheddingMixin,
+                  cache.CachedRetrieveMixin,
+                  IdempotentCreateMixin,
+                  mixins.CreateModelMixin,
                   mixins.DestroyModelMixin,
                   viewsets.ReadOnlyModelViewSet):
     """
     API to create, view and delete risk objects.
 
+    Representations returned by retrieve are cached, see core/cache.py.
+    Creates and deletes are rate limited per client, list and stream
+    requests are rejected while the service is overloaded, see
+    core/throttling.py. Creates and deletes are reported to the endpoints
+    in OUTBOX_ENDPOINTS, see core/outbox.py.
+
     list:
-    Return list of risk objects
+    Return list of risk objects, archived risks are left out
 
     retrieve:
     Return a risk object by id
 
     create:
-    Create a new risk object from a risk type template
+    Create a new risk object from a risk type template.
+    Send an `Idempotency-Key` header to safely retry the request.
 
     destroy:
     Delete a risk object by id
+
+    stream:
+    Stream the list of risk objects as a JSON array, chunk by chunk
     """
     queryset = Risk.objects.all()
     serializer_class = RiskSerializer
+    throttle_classes = (WriteRateThrottle,)
+
+    def get_queryset(self):
+        queryset = super().get_queryset().filter(tenant=get_current_tenant())
+        if self.action in ("list", "stream"):
+            # Archived risks are only available one by one. Options of the
+            # fields are fetched by RiskListSerializer, only for the fields
+            # which inline them.
+            queryset = queryset.filter(archive=None).prefetch_related(
+                Prefetch('field_values__field', queryset=Field.objects
+                         .annotate(option_count=Count('options'))),
+                'field_values__value_option')
+        else:
+            queryset = queryset.select_related('archive')
+        return queryset
+
+    def get_object(self):
+        instance = super().get_object()
+        if instance.archive is not None:
+            archive.load_archived_values(instance)
+        return instance
+
+    def cache_key(self, pk):
+        return cache.risk_key(pk)
+
+    def cache_generations(self, instance):
+        # Options of the fields in the representation show usage counts
+        return [cache.risk_type_generation(instance.risk_type_id)]
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        cache.risk_type_changed(serializer.instance.risk_type_id)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic(using=get_tenant_database()):
+            counters.risk_deleted(instance)
+            cache.risk_deleted(instance)
+            outbox.risk_deleted(instance)
+            instance.delete()
+
+    @action(detail=False)
+    def stream(self, request):
+        return streaming_list_response(self, request)